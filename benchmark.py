@@ -0,0 +1,105 @@
+'''
+Benchmark for MiniFactory project:
+Replays the recorded mqtt sessions in log_mqtt into the simulated factory
+and writes the results of every session as one json.
+
+Usage: python3 benchmark.py [RECORDING ...] [--factory Right] [--sim 5] [--out benchmark.json]
+'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# script of every factory
+LINE_SCRIPTS = {"Right": "rightline.py", "Left": "leftline.py"}
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def run_recording(recording: str, factory: str, time_scale: float, timeout: float) -> dict:
+    '''Runs the factory with one recording in a temporary directory, so the log and the wh_content stay untouched.
+
+    Args:
+        recording (str): Path of the recording.
+        factory (str): Name of the factory (Right, Left).
+        time_scale (float): Time scale of the simulator.
+        timeout (float): Max real time for the run in s.
+    Returns:
+        dict: Results of the run.
+    '''
+    with tempfile.TemporaryDirectory() as run_dir:
+        os.mkdir(os.path.join(run_dir, "log"))
+        shutil.copy(os.path.join(ROOT_DIR, "wh_content.json"), run_dir)
+        output = os.path.join(run_dir, "results.json")
+        command = [sys.executable, os.path.join(ROOT_DIR, LINE_SCRIPTS[factory]),
+                   "--sim", str(time_scale), "--replay", os.path.abspath(recording), "--bench", output, "--log", "ERROR"]
+        try:
+            process = subprocess.run(command, cwd=run_dir, timeout=timeout, capture_output=True, text=True)
+        except subprocess.TimeoutExpired:
+            return {"recording": recording, "errors": [f"Run took longer than {timeout}s"]}
+        if not os.path.exists(output):
+            return {"recording": recording, "errors": [f"No results, exit code {process.returncode}: {process.stderr[-2000:]}"]}
+        with open(output, "r") as fp:
+            return json.load(fp)
+
+
+def is_failed(result: dict) -> bool:
+    '''Returns True if the run ended with an error, a problem or a timeout.'''
+    return bool(result.get("errors") or result.get("problems") or result.get("timed_out"))
+
+
+def get_products_per_hour(runs: "list[dict]") -> float:
+    '''Returns the products per hour over the summed run time of the runs.'''
+    run_time = sum(result["run_time"] for result in runs)
+    return round(sum(result["products"] for result in runs) / run_time * 3600, 2) if run_time > 0 else 0
+
+
+def get_summary(results: "dict[str, dict]") -> dict:
+    '''Returns the products per hour and the worst loop run times over every recording.
+    products_per_hour counts every run, clean_products_per_hour only the runs that are not listed in failed.
+    '''
+    runs = [result for result in results.values() if "products" in result]
+    clean_runs = [result for result in runs if not is_failed(result)]
+    return {
+        "recordings": len(results),
+        "failed": [name for name, result in results.items() if is_failed(result)],
+        "products": sum(result["products"] for result in runs),
+        "products_per_hour": get_products_per_hour(runs),
+        "clean_products_per_hour": get_products_per_hour(clean_runs),
+        "loop_ms_max": max((result["loop_ms"].get("max", 0) for result in runs), default=0),
+        "loop_ms_p99": max((result["loop_ms"].get("p99", 0) for result in runs), default=0),
+        "threads_max": max((result["threads"]["max"] for result in runs), default=0)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays recorded mqtt sessions into the simulated factory.")
+    parser.add_argument("recordings", nargs="*", default=sorted(glob.glob(os.path.join(ROOT_DIR, "log_mqtt", "*.log"))), help="recorded sessions (default: log_mqtt/*.log)")
+    parser.add_argument("--factory", choices=list(LINE_SCRIPTS), default="Right", help="factory the sessions were recorded on")
+    parser.add_argument("--sim", type=float, default=5, metavar="TIME_SCALE", help="time scale of the simulator")
+    parser.add_argument("--timeout", type=float, default=3600, help="max real time for every recording in s")
+    parser.add_argument("--out", default="benchmark.json", help="file for the results")
+    args = parser.parse_args()
+
+    results = {}
+    for recording in args.recordings:
+        print(f"Running {recording}", file=sys.stderr)
+        results[os.path.basename(recording)] = run_recording(recording, args.factory, args.sim, args.timeout)
+
+    summary = get_summary(results)
+    with open(args.out, "w") as fp:
+        json.dump({"summary": summary, "recordings": results}, fp, indent=4)
+    print(json.dumps(summary, indent=4))
+    if summary["failed"]:
+        print(f"Failed runs: {', '.join(summary['failed'])}", file=sys.stderr)
+        sys.exit(1)
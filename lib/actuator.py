@@ -7,12 +7,35 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2023.09.14"
 
-import threading
+import math
 import time
+from concurrent.futures import wait
 from revpimodio2 import RevPiModIO
 
 from lib.logger import log
-from lib.sensor import Sensor, SensorType, SensorTimeoutError, EncoderOverflowError, NoDetectionError
+from lib.machine import submit, actuator_executor
+from lib.sensor import Sensor, SensorType, SensorTimeoutError, EncoderOverflowError, NoDetectionError, get_io
+from lib.telemetry import AxisRecorder, get_recorder
+
+# weight of the newest measurement in the axis speeds
+SPEED_SMOOTHING = 0.5
+# measured speed of every axis in encoder values per second, {actuator: speed}
+axis_speeds: "dict[str, float]" = {}
+# measured overshoot of every axis after the stop in encoder values, {actuator: overshoot}
+axis_overshoots: "dict[str, float]" = {}
+# distance before the trigger value where every axis starts to slow down, {actuator: distance}
+ramp_distances: "dict[str, float]" = {}
+
+def get_axis_speed(actuator: str, default: float=None) -> float:
+    '''Returns the measured speed of an axis, measured by every run_to_encoder_value().
+
+    Args:
+        actuator (str): Whole name of the actuator with direction.
+        default (float): Returned if the axis was not measured yet.
+    Returns:
+        float: Speed in encoder values per second.
+    '''
+    return axis_speeds.get(actuator, default)
 
 class Actuator():
     '''Control for Actuators, can also call Sensors.'''
@@ -22,34 +45,54 @@ class Actuator():
         run_for_time(): Run Actuator for certain amount of time.
         move_axis(): Moves an axis to the given trigger value.
         run_to_encoder_value(): Run Actuator until the trigger_value of encoder is reached.
+        __run_ramp(): Run Actuator to the trigger_value and slow down on a ramp.
+        __tune_ramp(): Updates the overshoot and the ramp distance of the last ramp.
         run_to_encoder_start(): Run Actuator to the encoder reference switch and resets the counter to 0.
         start(): Start actuator.
         stop(): Stop actuator.
+        __measure_speed(): Updates the measured speed of the axis.
         set_pwm(): Set PWM to percentage.
         join(): Joins the current thread and raises Exceptions.
+        is_done(): Returns True if no function runs as thread.
     Attributes:
+        PWM_RAMP (bool): If True axes created with pwm_ramp ramp the PWM down, set by the pwm_ramp of the factory config.
         __ENCODER_TRIGGER_THRESHOLD (int): Range around trigger value where trigger happens for encoder.
         __COUNTER_TRIGGER_THRESHOLD (int): Range around trigger value where trigger happens for counter.
         __PWM_TRIGGER_THRESHOLD (int): Range around trigger value where trigger happens while actuator is slowed down.
         __PWM_WINDOW (int): Range around the trigger value where the actuator is slowed down from the start.
         __PWM_DURATION (int): Range around the trigger value where the actuator is slowed down.
+        __RAMP_STEPS (int): Number of PWM steps of the ramp.
+        __RAMP_MIN_DISTANCE (int): Min distance of the ramp.
+        __RAMP_TUNING (float): Factor the ramp distance is changed by after every run.
+        __RAMP_HOLD_BAND (int): Misses up to this distance shorten the ramp, bigger misses inside __PWM_TRIGGER_THRESHOLD keep it.
         __revpi (RevPiModIO): RevPiModIO Object to control the motors and sensors.
         name (str): Exact name of the sensor in PiCtory (everything before first '_').
         line_name (str): Name of current line.
         __pwm (str): Name of PWM-pin, Slows motor down, before reaching the value.
+        __pwm_io (IO): Cached IO object of the PWM-pin.
+        __ios (dict): Cached actuator name and IO object for every used direction.
         __type (str): Specifier for motor name.
-        __thread (Thread): Thread object if a function is called as thread.
+        __future (Future): Future of the function if a function is called as thread.
         exception (Exception): Holds exception if exception was raised.
         __pwm_value (int): Value for pwm, the percentage of the speed.
+        __pwm_ramp (bool): If True and PWM_RAMP is set the PWM is ramped down on the remaining distance, else the motor runs at pwm_slow_value before the value.
+        __last_ramp (tuple): (actuator, trigger value, stop value, direction sign) of the last ramp, the overshoot is measured at the start of the next run.
+        recorder (AxisRecorder): Records the motion of the actuator, is dumped after a timeout.
+        __recorder (AxisRecorder): Recorder of the actuator, None until the actuator first runs to a sensor or an encoder value.
         log (Logger): Log object to print to log.
     '''
+    PWM_RAMP = False
     __ENCODER_TRIGGER_THRESHOLD = 40
     __COUNTER_TRIGGER_THRESHOLD = 0
     __PWM_TRIGGER_THRESHOLD = 15
     __PWM_WINDOW = 300
     __PWM_DURATION = 100
+    __RAMP_STEPS = 5
+    __RAMP_MIN_DISTANCE = 50
+    __RAMP_TUNING = 1.25
+    __RAMP_HOLD_BAND = 5
 
-    def __init__(self, revpi: RevPiModIO, name: str, line_name: str, pwm: str=None, pwm_slow_value=20, type: str=None):
+    def __init__(self, revpi: RevPiModIO, name: str, line_name: str, pwm: str=None, pwm_slow_value=20, type: str=None, pwm_ramp=False):
         '''Initializes Actuator.
         
         Args:
@@ -59,26 +102,40 @@ class Actuator():
             pwm: Name of PWM-pin, Slows motor down, before reaching the value.
             pwm_slow_value: Percentage to that the motor slows.
             type (str): Specifier for motor name.
+            pwm_ramp (bool): Ramps the PWM down on the remaining distance instead of running at pwm_slow_value before the value, if PWM_RAMP is set.
         '''
         self.__revpi = revpi
         self.name = name
         self.line_name = line_name
         self.__pwm = pwm
+        self.__pwm_io = get_io(revpi, pwm) if pwm else None
+        self.__ios: "dict[str, tuple]" = {}
         self.__pwm_slow_value = pwm_slow_value
         self.__type = ("_" + type) if type else ""
 
-        self.__thread = None
+        self.__future = None
         self.exception = None
         self.__pwm_value = 100
+        self.__pwm_ramp = pwm_ramp
+        self.__last_ramp = None
+        self.__recorder: AxisRecorder = None
 
         global log
         self.log = log.getChild(f"{self.line_name}(Act)")
 
-        self.log.debug(f"Created: Actuator {self.name}{self.__type}")
+        self.log.debug("Created: Actuator %s%s", self.name, self.__type)
+
+
+    @property
+    def recorder(self) -> AxisRecorder:
+        '''Recorder of the actuator, is created on first use, so valves and compressors don't hold a ring buffer.'''
+        if self.__recorder == None:
+            self.__recorder = get_recorder(self.name + self.__type)
+        return self.__recorder
 
 
     def __del__(self):
-        self.log.debug(f"Destroyed {type(self).__name__}: {self.name}{self.__type}")
+        self.log.debug("Destroyed %s: %s%s", type(self).__name__, self.name, self.__type)
 
 
     def run_to_sensor(self, direction: str, stop_sensor: str, stop_delay_in_ms=0, timeout_in_s=10, as_thread=False):
@@ -96,28 +153,32 @@ class Actuator():
         actuator = self.name + ( "_" + direction if direction != "" else "")
         # call this function again as a thread
         if as_thread == True:
-            self.__thread = threading.Thread(target=self.run_to_sensor, args=(direction, stop_sensor, stop_delay_in_ms, timeout_in_s, False), name=actuator)
-            self.__thread.start()
+            self.__future = submit(actuator, self.run_to_sensor, direction, stop_sensor, stop_delay_in_ms, timeout_in_s, False, executor=actuator_executor)
             return
 
-        self.log.info(f"{actuator} run to sensor {stop_sensor}")
+        self.log.info("%s run to sensor %s", actuator, stop_sensor)
 
         try:
             sensor = Sensor(self.__revpi, stop_sensor, self.line_name)
 
             # check if already at stop sensor
             if sensor.get_current_value() == True:
-                self.log.info(f"{actuator} already at sensor {stop_sensor}")
+                self.log.info("%s already at sensor %s", actuator, stop_sensor)
                 return
 
             #start actuator
+            recorder = self.recorder
             self.start(direction)
+            recorder.record(False)
 
             sensor.wait_for_detect(timeout_in_s=timeout_in_s)
+            recorder.record(True)
             time.sleep(stop_delay_in_ms/1000)
             
         except Exception as e:
             self.exception = e
+            if isinstance(e, SensorTimeoutError):
+                self.recorder.dump()
             if not as_thread:
                 raise
         finally:
@@ -138,11 +199,10 @@ class Actuator():
         actuator = self.name + ( "_" + direction if direction != "" else "")
         # call this function again as a thread
         if as_thread == True:
-            self.__thread = threading.Thread(target=self.run_for_time, args=(direction, wait_time_in_s, check_sensor, False), name=actuator)
-            self.__thread.start()
+            self.__future = submit(actuator, self.run_for_time, direction, wait_time_in_s, check_sensor, False, executor=actuator_executor)
             return
 
-        self.log.info(f"{actuator} run for time: {wait_time_in_s}")
+        self.log.info("%s run for time: %s", actuator, wait_time_in_s)
         try:
             self.start(direction)
             
@@ -152,7 +212,7 @@ class Actuator():
                 sensor.start_monitor()
 
             time.sleep(wait_time_in_s) # Wait for given time
-            self.log.info(f"{actuator} run time reached")
+            self.log.info("%s run time reached", actuator)
 
 
             if check_sensor and sensor.is_detected() == False:
@@ -187,8 +247,7 @@ class Actuator():
         actuator = self.name + ( "_" + direction if direction != "" else "")
         # call this function again as a thread
         if as_thread == True:
-            self.__thread = threading.Thread(target=self.move_axis, args=(direction, trigger_value, current_value, move_threshold, encoder, ref_sw, timeout_in_s, False), name=actuator)
-            self.__thread.start()
+            self.__future = submit(actuator, self.move_axis, direction, trigger_value, current_value, move_threshold, encoder, ref_sw, timeout_in_s, False, executor=actuator_executor)
             return
 
         try:
@@ -200,7 +259,7 @@ class Actuator():
                 self.run_to_encoder_start(direction, ref_sw, encoder, timeout_in_s)
             # if trigger value is the same as the current value don't move
             elif abs(current_value - trigger_value) < move_threshold:
-                self.log.info(f"{self.name}_{direction} :Axis already at position")
+                self.log.info("%s_%s :Axis already at position", self.name, direction)
             # move to value
             else:
                 self.run_to_encoder_value(direction, encoder, trigger_value, timeout_in_s)
@@ -226,34 +285,46 @@ class Actuator():
         actuator = self.name + ( "_" + direction if direction != "" else "")
         # call this function again as a thread
         if as_thread == True:
-            self.__thread = threading.Thread(target=self.run_to_encoder_value, args=(direction, encoder, trigger_value, timeout_in_s, False), name=actuator)
-            self.__thread.start()
+            self.__future = submit(actuator, self.run_to_encoder_value, direction, encoder, trigger_value, timeout_in_s, False, executor=actuator_executor)
             return
 
-        self.log.info(f"{actuator} run to value {trigger_value} at {encoder.name}")
+        self.log.info("%s run to value %s at %s", actuator, trigger_value, encoder.name)
 
         
         trigger_threshold = self.__ENCODER_TRIGGER_THRESHOLD if encoder.type == SensorType.ENCODER else self.__COUNTER_TRIGGER_THRESHOLD
         
         try:
-            self.start(direction)
-            
-            if self.__pwm:
-                trigger_threshold = self.__PWM_TRIGGER_THRESHOLD
-                if abs(encoder.get_current_value() - trigger_value) > self.__PWM_WINDOW:
-                    # run most of the way at full power
-                    offset = -self.__PWM_DURATION if trigger_value > encoder.get_current_value() else self.__PWM_DURATION
-                    encoder.wait_for_encoder(trigger_value+offset, self.__ENCODER_TRIGGER_THRESHOLD, timeout_in_s)
-
-                # run at 20% speed for PWM_WINDOW values
-                self.set_pwm(self.__pwm_slow_value)
-                self.start(direction)                
-            
-            # run to trigger_value
-            self.log.info(f"{actuator} stopped at {encoder.wait_for_encoder(trigger_value, trigger_threshold, timeout_in_s)}")
+            start_value = encoder.get_current_value()
+            start_time = time.time()
+            self.recorder.start_move(start_value, trigger_value)
+
+            if self.__pwm and self.__pwm_ramp and self.PWM_RAMP:
+                self.__tune_ramp(start_value)
+                stop_value = self.__run_ramp(actuator, direction, encoder, trigger_value, timeout_in_s)
+            else:
+                self.start(direction)
+
+                if self.__pwm:
+                    trigger_threshold = self.__PWM_TRIGGER_THRESHOLD
+                    if abs(encoder.get_current_value() - trigger_value) > self.__PWM_WINDOW:
+                        # run most of the way at full power
+                        offset = -self.__PWM_DURATION if trigger_value > encoder.get_current_value() else self.__PWM_DURATION
+                        encoder.wait_for_encoder(trigger_value+offset, self.__ENCODER_TRIGGER_THRESHOLD, timeout_in_s, recorder=self.recorder)
+
+                    # run at 20% speed for PWM_WINDOW values
+                    self.set_pwm(self.__pwm_slow_value)
+                    self.start(direction)
+
+                # run to trigger_value
+                stop_value = encoder.wait_for_encoder(trigger_value, trigger_threshold, timeout_in_s, recorder=self.recorder)
+            self.log.info("%s stopped at %s", actuator, stop_value)
+            self.recorder.end_move(stop_value)
+            self.__measure_speed(actuator, abs(stop_value - start_value), time.time() - start_time)
 
         except Exception as e:
             self.exception = e
+            if isinstance(e, SensorTimeoutError):
+                self.recorder.dump()
             if not as_thread:
                 raise
         finally:
@@ -263,6 +334,88 @@ class Actuator():
                 self.set_pwm(100)
 
 
+    def __run_ramp(self, actuator: str, direction: str, encoder: Sensor, trigger_value: int, timeout_in_s: int) -> int:
+        '''Run Actuator to the trigger_value and slow down on a ramp, the PWM falls with the square root of the remaining distance.
+        The actuator stops earlier by the measured overshoot of the axis.
+
+        Args:
+            actuator (str): Whole name of the actuator with direction.
+            direction (str): Actuator direction, (last part of whole name).
+            encoder (Sensor): Sensor object for the used encoder.
+            trigger_value (int): Encoder-Value at which the motor stops.
+            timeout_in_s (int): Time after which an exception is raised.
+        Returns:
+            int: Encoder value at the stop.
+        Raises:
+            SensorTimeoutError: Timeout is reached (no detection happened).
+        '''
+        end_time = time.time() + timeout_in_s
+        distance = ramp_distances.get(actuator, self.__PWM_DURATION)
+        start_value = encoder.get_current_value()
+        # 1 if the encoder value gets smaller, -1 if it gets bigger
+        sign = 1 if trigger_value < start_value else -1
+        # stop earlier, but never behind the start
+        stop_value = trigger_value + sign * min(axis_overshoots.get(actuator, 0), distance / 2, abs(start_value - trigger_value) / 2)
+
+        # (remaining distance, pwm) of every step, the speed falls like at constant deceleration
+        steps = []
+        for step in range(1, self.__RAMP_STEPS):
+            share = (self.__RAMP_STEPS - step) / self.__RAMP_STEPS
+            steps.append((distance * share, max(self.__pwm_slow_value, round(100 * math.sqrt(share)))))
+
+        # start with the pwm of the step the axis is in
+        remaining = abs(start_value - stop_value)
+        self.__pwm_value = min((pwm for step_distance, pwm in steps if step_distance >= remaining), default=100)
+        self.start(direction)
+        value = start_value
+        for step_distance, pwm in steps:
+            if pwm >= self.__pwm_value:
+                continue
+            # the axis can pass more than one step in a cycle
+            if (value - stop_value) * sign > step_distance:
+                value = encoder.wait_for_encoder(stop_value + sign * step_distance, self.__PWM_TRIGGER_THRESHOLD, max(end_time - time.time(), 0), recorder=self.recorder)
+            self.__pwm_value = pwm
+            self.__pwm_io.value = pwm
+            self.recorder.set_drive(pwm, direction)
+
+        # run to trigger_value
+        if (value - stop_value) * sign > self.__PWM_TRIGGER_THRESHOLD:
+            value = encoder.wait_for_encoder(stop_value, self.__PWM_TRIGGER_THRESHOLD, max(end_time - time.time(), 0), recorder=self.recorder)
+        self.__last_ramp = (actuator, trigger_value, stop_value, sign)
+        return value
+
+
+    def __tune_ramp(self, value: int):
+        '''Updates the overshoot and the ramp distance of the last ramp with the encoder value after it.
+        The ramp gets longer if the axis went past the trigger_value by more than __PWM_TRIGGER_THRESHOLD,
+        shorter if it stopped within __RAMP_HOLD_BAND of it and stays the same else (a stop before the value isn't fixed by a longer ramp).
+
+        Args:
+            value (int): Current encoder value.
+        '''
+        if self.__last_ramp == None:
+            return
+        actuator, trigger_value, stop_value, sign = self.__last_ramp
+        self.__last_ramp = None
+        distance = ramp_distances.get(actuator, self.__PWM_DURATION)
+        # overshoot after the stop and distance the trigger_value was missed by, positive if the axis went past it
+        overshoot = (stop_value - value) * sign
+        missed = (trigger_value - value) * sign
+        # axis was moved by something else
+        if abs(overshoot) > distance:
+            return
+
+        last_overshoot = axis_overshoots.get(actuator, 0)
+        axis_overshoots[actuator] = max(SPEED_SMOOTHING * overshoot + (1 - SPEED_SMOOTHING) * last_overshoot, 0)
+        if missed > self.__PWM_TRIGGER_THRESHOLD:
+            distance *= self.__RAMP_TUNING
+        elif abs(missed) <= self.__RAMP_HOLD_BAND:
+            distance /= self.__RAMP_TUNING
+        else:
+            return
+        ramp_distances[actuator] = min(max(distance, self.__RAMP_MIN_DISTANCE), self.__PWM_WINDOW)
+
+
     def run_to_encoder_start(self, direction: str, ref_sw: str, encoder: Sensor, timeout_in_s=10, as_thread=False):
         '''Run Actuator to the encoder reference switch and resets the encoder to 0.
         
@@ -278,11 +431,12 @@ class Actuator():
         actuator = self.name + ( "_" + direction if direction != "" else "")
         # call this function again as a thread
         if as_thread == True:
-            self.__thread = threading.Thread(target=self.run_to_encoder_start, args=(direction, ref_sw, encoder, timeout_in_s, False), name=actuator)
-            self.__thread.start()
+            self.__future = submit(actuator, self.run_to_encoder_start, direction, ref_sw, encoder, timeout_in_s, False, executor=actuator_executor)
             return
 
-        self.log.info(f"{actuator} run to encoder start")
+        self.log.info("%s run to encoder start", actuator)
+        # the encoder is reset, so the overshoot of the last ramp can't be measured
+        self.__last_ramp = None
         try:
             self.run_to_sensor(direction, ref_sw, timeout_in_s=timeout_in_s)
             encoder.reset_encoder()
@@ -299,12 +453,14 @@ class Actuator():
         Args:
             direction (str): Actuator direction, (last part of whole name).
         '''
-        actuator = self.name + ( "_" + direction if direction != "" else "")
+        actuator, io = self.__get_io(direction)
         if self.__pwm:
-            self.__revpi.io[self.__pwm].value = self.__pwm_value
-        if self.__revpi.io[actuator].value != True:
-            self.log.info(f"{actuator} start")
-            self.__revpi.io[actuator].value = True 
+            self.__pwm_io.value = self.__pwm_value
+        if self.__recorder != None:
+            self.__recorder.set_drive(self.__pwm_value if self.__pwm else 100, direction)
+        if io.value != True:
+            self.log.info("%s start", actuator)
+            io.value = True 
 
 
     def stop(self, direction: str=""):
@@ -313,13 +469,42 @@ class Actuator():
         Args:
             direction (str): Actuator direction, (last part of whole name).
         '''
-        actuator = self.name + ( "_" + direction if direction != "" else "")
-        self.log.info(f"{actuator} stop")
-        self.__revpi.io[actuator].value = False
+        actuator, io = self.__get_io(direction)
+        self.log.info("%s stop", actuator)
+        io.value = False
+        if self.__recorder != None:
+            self.__recorder.set_drive(0, "")
         if self.__pwm:
-            self.__revpi.io[self.__pwm].value = 0
+            self.__pwm_io.value = 0
+
+
+    def __get_io(self, direction: str) -> tuple:
+        '''Get the name and the IO object of the actuator for direction, resolves it only on first use.
+        
+        Args:
+            direction (str): Actuator direction, (last part of whole name).
+        Returns:
+            tuple: (actuator name, IO object)
+        '''
+        handle = self.__ios.get(direction)
+        if handle == None:
+            actuator = self.name + ( "_" + direction if direction != "" else "")
+            handle = (actuator, get_io(self.__revpi, actuator))
+            self.__ios[direction] = handle
+        return handle
 
     
+    def __measure_speed(self, actuator: str, distance: int, duration: float):
+        '''Updates the measured speed of the axis with the smoothed speed of the last run.'''
+        if distance == 0 or duration <= 0:
+            return
+        speed = distance / duration
+        last_speed = axis_speeds.get(actuator)
+        if last_speed != None:
+            speed = SPEED_SMOOTHING * speed + (1 - SPEED_SMOOTHING) * last_speed
+        axis_speeds[actuator] = speed
+
+
     def set_pwm(self, percentage: int):
         '''Set PWM value to percentage.
         
@@ -331,7 +516,7 @@ class Actuator():
         if percentage < 0 or percentage > 100:
             raise(ValueError(f"{self.__pwm}: {percentage} :Out of range (0-100)"))
         
-        self.log.info(f"{self.__pwm} set to {percentage}%")
+        self.log.info("%s set to %s%%", self.__pwm, percentage)
         self.__pwm_value = percentage
 
 
@@ -341,6 +526,11 @@ class Actuator():
         Raises:
             Exception: Exceptions that a thrown in thread function.
         '''
-        self.__thread.join()
+        wait((self.__future,))
         if self.exception:
             raise self.exception
+
+
+    def is_done(self) -> bool:
+        '''Returns True if no function runs as thread, the thread is not joined.'''
+        return self.__future == None or self.__future.done()
@@ -7,11 +7,11 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.01.12"
 
-import threading
 from enum import Enum
+from concurrent.futures import wait
 
 from lib.logger import log
-from lib.machine import Machine, MainState
+from lib.machine import Machine, MainState, submit
 from lib.sensor import Sensor, SensorTimeoutError, NoDetectionError, EncoderOverflowError
 from lib.actuator import Actuator
 
@@ -44,7 +44,7 @@ class Conveyor(Machine):
         global log
         self.log = log.getChild(f"{self.line_name}(Conv)")
 
-        self.log.debug(f"Created {type(self).__name__}: {self.name}")
+        self.log.debug("Created %s: %s", type(self).__name__, self.name)
 
 
     def run_to_stop_sensor(self, direction: str, stop_sensor: str, start_sensor: str=None, stop_delay_in_ms=0, timeout_in_s=10, end_machine=False, as_thread=True):
@@ -64,11 +64,10 @@ class Conveyor(Machine):
         '''
         # call this function again as a thread
         if as_thread == True:
-            self.thread = threading.Thread(target=self.run_to_stop_sensor, args=(direction, stop_sensor, start_sensor, stop_delay_in_ms, timeout_in_s, end_machine, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.run_to_stop_sensor, direction, stop_sensor, start_sensor, stop_delay_in_ms, timeout_in_s, end_machine, False)
             return
         
-        self.log.warning(f"{self.name} :Running to: {stop_sensor}")
+        self.log.warning("%s :Running to: %s", self.name, stop_sensor)
         try:
             if start_sensor != None:
                 # wait for start sensor to detect product
@@ -84,7 +83,7 @@ class Conveyor(Machine):
         except Exception as error:
             self.error_handler(error)
         else:
-            self.log.warning(f"{self.name} :Reached: {stop_sensor}")
+            self.log.warning("%s :Reached: %s", self.name, stop_sensor)
             self.position += 1
             if end_machine:
                 self.switch_state(MainState.END)
@@ -108,11 +107,10 @@ class Conveyor(Machine):
         '''
         # call this function again as a thread
         if as_thread == True:
-            self.thread = threading.Thread(target=self.run_to_counter_value, args=(direction, counter, trigger_value, timeout_in_s, end_machine, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.run_to_counter_value, direction, counter, trigger_value, timeout_in_s, end_machine, False)
             return
 
-        self.log.warning(f"{self.name} :Running to value: {trigger_value} at {counter}")
+        self.log.warning("%s :Running to value: %s at %s", self.name, trigger_value, counter)
         self.switch_state(State.RUN)
         try:
             encoder = Sensor(self.revpi, counter, self.line_name)
@@ -124,7 +122,7 @@ class Conveyor(Machine):
         except Exception as error:
             self.error_handler(error)
         else:
-            self.log.warning(f"{self.name} :Reached value: {trigger_value} at {counter}")
+            self.log.warning("%s :Reached value: %s at %s", self.name, trigger_value, counter)
             self.position += 1
             if end_machine:
                 self.switch_state(MainState.END)
@@ -147,11 +145,10 @@ class Conveyor(Machine):
         '''
         # call this function again as a thread
         if as_thread == True:
-            self.thread = threading.Thread(target=self.run_to_counter_value, args=(direction, wait_time_in_s, check_sensor, end_machine, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.run_for_time, direction, wait_time_in_s, check_sensor, end_machine, False)
             return
 
-        self.log.warning(f"{self.name} :Running for time: {wait_time_in_s} s")
+        self.log.warning("%s :Running for time: %s s", self.name, wait_time_in_s)
         self.switch_state(State.RUN)
         try:
             Actuator(self.revpi, self.name, self.line_name).run_for_time(direction, wait_time_in_s, check_sensor)
@@ -161,7 +158,7 @@ class Conveyor(Machine):
         except Exception as error:
             self.error_handler(error)
         else:
-            self.log.warning(f"{self.name} :Reached time: {wait_time_in_s} s")
+            self.log.warning("%s :Reached time: %s s", self.name, wait_time_in_s)
             self.position += 1
             if end_machine:
                 self.switch_state(MainState.END)
@@ -173,6 +170,6 @@ class Conveyor(Machine):
         Raises:
             Exception: Exceptions that a thrown in thread function.
         '''
-        self.thread.join()
+        wait((self.thread,))
         if self.exception_msg:
             raise self.exception_msg
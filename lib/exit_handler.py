@@ -13,6 +13,7 @@ from revpimodio2 import RevPiModIO
 import signal
 
 from lib.logger import log
+from lib.simulator import SimRevPiModIO
 
 class ExitHandler:
     '''Stops the factory, and handles CTRL+C.'''
@@ -48,11 +49,15 @@ class ExitHandler:
         log.critical("Program aborted: ")
         self.revpi.cleanup() # stop API access for factory
 
-        try:
-            exit_revpi = RevPiModIO(autorefresh=True)
-        except:
-            # load simulation if not connected to factory
-            exit_revpi = RevPiModIO(autorefresh=True, configrsc="../RevPi/right.rsc", procimg="../RevPi/right.img")
+        if isinstance(self.revpi, SimRevPiModIO):
+            # the simulated process image only exists in this object
+            exit_revpi = self.revpi
+        else:
+            try:
+                exit_revpi = RevPiModIO(autorefresh=True)
+            except:
+                # load simulation if not connected to factory
+                exit_revpi = RevPiModIO(autorefresh=True, configrsc="../RevPi/right.rsc", procimg="../RevPi/right.img")
 
         log.critical("Setting all outputs to false: ")
 
@@ -7,10 +7,10 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.02.02"
 
-import threading
 from time import sleep
 
 from lib.logger import log
+from lib.machine import submit
 from lib.sensor import Sensor, SensorType
 from lib.actuator import Actuator, SensorTimeoutError, EncoderOverflowError
 from lib.robot_3d import Robot3D, Position, State, GetProductError, ObstructionError
@@ -60,8 +60,7 @@ class GripRobot(Robot3D):
             as_thread (bool): Runs the function as a thread.
         '''
         if as_thread:
-            self.thread = threading.Thread(target=self.grip, args=(False,), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.grip, False)
             return
 
         try:
@@ -84,8 +83,7 @@ class GripRobot(Robot3D):
             as_thread (bool): Runs the function as a thread.
         '''
         if as_thread:
-            self.thread = threading.Thread(target=self.release, args=(with_check_sens, False,), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.release, with_check_sens, False)
             return
 
         try:
@@ -112,8 +110,7 @@ class GripRobot(Robot3D):
             as_thread (bool): Runs the function as a thread.
         '''
         if as_thread:
-            self.thread = threading.Thread(target=self.reset_claw, args=(gripper_opened, False,), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.reset_claw, gripper_opened, False)
             return
 
         gripper_opened = self.GRIPPER_OPENED if gripper_opened == None else gripper_opened
@@ -7,11 +7,10 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.01.12"
 
-import threading
 from enum import Enum
 
 from lib.logger import log
-from lib.machine import Machine, MainState
+from lib.machine import Machine, MainState, changes, submit
 from lib.sensor import Sensor, SensorTimeoutError
 from lib.actuator import Actuator
 from lib.conveyor import Conveyor
@@ -47,7 +46,7 @@ class IndexLine(Machine):
         '''
         super().__init__(revpi, name, line_name)
         
-        self.start_next_machine = False
+        self.__start_next_machine = False
         global log
         self.log = log.getChild(f"{self.line_name}(Indx)")
 
@@ -56,6 +55,18 @@ class IndexLine(Machine):
         self.log.debug(f"Created {type(self).__name__}: {self.name}")
 
 
+    @property
+    def start_next_machine(self) -> bool:
+        '''Is set to True if next machine should be started, wakes the factory loop on change.'''
+        return self.__start_next_machine
+
+    @start_next_machine.setter
+    def start_next_machine(self, start_next_machine: bool):
+        if start_next_machine != self.__start_next_machine:
+            changes.wake()
+        self.__start_next_machine = start_next_machine
+
+
     def run(self, with_mill=False, with_drill=False, as_thread=True):
         '''Runs the Index Line routine.
         
@@ -65,8 +76,7 @@ class IndexLine(Machine):
             as_thread (bool): Runs the function as a thread.
         '''      
         if as_thread == True:
-            self.thread = threading.Thread(target=self.run, args=(with_mill, with_drill, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.run, with_mill, with_drill, False)
             return
 
         self.switch_state(State.START)
@@ -7,54 +7,240 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2023.02.01"
 
-import logging
 import argparse
+import atexit
+import gzip
+import logging
 import os
-from pathlib import Path
+import queue
+import re
+import shutil
+import time
+from collections import deque
+from logging.handlers import BaseRotatingHandler, QueueHandler, QueueListener
 
-log = None
+log = logging.getLogger()
 
 STD_LEVEL_CONSOLE = "WARNING"
 LEVEL_FILE = logging.DEBUG
 LOG_DIR = "log"
 MAX_NUM_OF_LOGS = 20
+MAX_LOG_SIZE = 50 * 1024 * 1024 # in bytes
+MAX_LOG_AGE = 24 * 3600 # in seconds
+# max number of records that wait for the writer, the oldest are dropped if more arrive
+LOG_BUFFER_SIZE = 10000
 
-# sort all the logs by creation time
-logs = sorted(Path(LOG_DIR).iterdir(), key=os.path.getmtime)
+# queue and listener that writes the records, None until setup_logging() is called
+log_queue: "DropOldestQueue" = None
+log_listener: QueueListener = None
 
-# if there are more than 20 log delete the oldest
-if logs.__len__() >= MAX_NUM_OF_LOGS:
-    os.remove(f"{logs[0]}")
+# level of every subsystem that is not logged completely, {subsystem: level}
+subsystem_levels: "dict[str, int]" = {}
 
-if logs.__len__() == 0:
-    log_file_path = f"{LOG_DIR}/plc1.log"
-else:   
-    # get the new file by getting the number of the latest logfile an adding 1.
-    log_file_path = f"{LOG_DIR}/plc{(int(logs[-1].stem[3:]) + 1):02}.log"
+def get_subsystem(name: str) -> str:
+    '''Returns the subsystem of a logger, the part in brackets (Line1(Act) -> Act) or the whole name.
 
-# enable command line arguments
-parser = argparse.ArgumentParser()
-parser.add_argument("--log", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default=STD_LEVEL_CONSOLE, help="change output of consol")
-log_level: str = parser.parse_args().log
+    Args:
+        name (str): Name of the logger.
+    Returns:
+        str: Name of the subsystem.
+    '''
+    if name.endswith(")") and "(" in name:
+        return name[name.rindex("(") + 1:-1]
+    return name
 
-log_formatter_file = logging.Formatter("%(asctime)s.%(msecs)03d; %(levelname)-8s; %(name)-12s %(message)-70s; %(threadName)s; %(module)s; %(funcName)s(%(lineno)d); ", datefmt='%H:%M:%S')
 
-# Setup File handler, change mode tp 'a' to keep the log after relaunch
-file_handler = logging.FileHandler(log_file_path, mode='a')
-file_handler.setFormatter(log_formatter_file)
-file_handler.setLevel(LEVEL_FILE)
+def set_subsystem_level(subsystem: str, level):
+    '''Sets the level of every logger of the subsystem, also of the loggers created later.
+    Messages below the level are dropped before they are formatted.
 
-# Setup Stream Handler (i.e. console)
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(log_formatter_file)
-stream_handler.setLevel(getattr(logging, log_level.upper(), None))
+    Args:
+        subsystem (str): Name of the subsystem (Act, Sens, Rob, Mqtt, ...).
+        level: Level name (DEBUG, INFO, WARNING, ERROR) or number.
+    '''
+    level = logging.getLevelName(level) if type(level) == str else level
+    subsystem_levels[subsystem] = level
+    for logger in list(logging.root.manager.loggerDict.values()):
+        if isinstance(logger, logging.Logger) and get_subsystem(logger.name) == subsystem:
+            logger.setLevel(level)
 
-# Get our logger
-log = logging.getLogger()
-log.setLevel(logging.DEBUG)
 
-# Add both Handlers
-log.addHandler(stream_handler)
-log.addHandler(file_handler)
+class SubsystemLogger(logging.Logger):
+    '''Logger that starts with the level of its subsystem.'''
+
+    def __init__(self, name: str, level=logging.NOTSET):
+        super().__init__(name, subsystem_levels.get(get_subsystem(name), level))
+
+
+class LazyQueueHandler(QueueHandler):
+    '''Puts the records into the queue as they are, the message is formatted in the writer thread.
+    The arguments of a log call are formatted later, so they must not be changed after the call.
+    '''
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class DropOldestQueue(queue.Queue):
+    '''Queue that never blocks, if it is full the oldest item is dropped.'''
+    '''
+    Attributes:
+        dropped (int): Number of dropped items.
+    '''
+
+    def _init(self, maxsize: int):
+        self.queue = deque(maxlen=maxsize)
+        self.maxsize = 0
+        self.dropped = 0
+
+
+    def _put(self, item):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(item)
+
+
+class LogFileHandler(BaseRotatingHandler):
+    '''Writes to LOG_DIR/plcNN.log and continues in the next file if the file is too big or too old.'''
+    '''
+    Methodes:
+        shouldRollover(): Returns True if the next file should be started.
+        doRollover(): Closes the file, compresses it and starts the next file.
+    Attributes:
+        max_size (int): Max size of a file in bytes.
+        max_age (float): Max time a file is written to in seconds.
+        compress (bool): Compresses the finished files with gzip.
+        __opened (float): Time the current file was opened.
+    '''
+
+    def __init__(self, max_size: int=MAX_LOG_SIZE, max_age: float=MAX_LOG_AGE, compress=False):
+        '''Initializes LogFileHandler, starts a new file.
+
+        Args:
+            max_size (int): Max size of a file in bytes.
+            max_age (float): Max time a file is written to in seconds.
+            compress (bool): Compresses the finished files with gzip.
+        '''
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compress = compress
+        self.__opened = time.time()
+        super().__init__(get_next_log_file(), mode="a", encoding="utf-8")
+
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.stream == None:
+            return False
+        return self.stream.tell() >= self.max_size or time.time() - self.__opened >= self.max_age
+
+
+    def doRollover(self):
+        self.stream.close()
+        self.stream = None
+        if self.compress:
+            with open(self.baseFilename, "rb") as src, gzip.open(self.baseFilename + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.baseFilename)
+        self.baseFilename = os.path.abspath(get_next_log_file())
+        self.__opened = time.time()
+        self.stream = self._open()
+
+
+def get_log_files() -> "list[tuple]":
+    '''Returns the log files in LOG_DIR sorted by their number.
+
+    Returns:
+        list: [(number, path)] of every plcNN.log and plcNN.log.gz.
+    '''
+    files = []
+    for name in os.listdir(LOG_DIR):
+        match = re.fullmatch(r"plc(\d+)\.log(\.gz)?", name)
+        if match:
+            files.append((int(match.group(1)), os.path.join(LOG_DIR, name)))
+    return sorted(files)
+
+
+def get_next_log_file() -> str:
+    '''Returns the path of the next log file and deletes the oldest files, so that at most MAX_NUM_OF_LOGS are kept.
+
+    Returns:
+        str: Path of the next log file.
+    '''
+    files = get_log_files()
+    # keep room for the new file
+    for number, path in files[:max(len(files) - MAX_NUM_OF_LOGS + 1, 0)]:
+        os.remove(path)
+    number = files[-1][0] + 1 if files else 1
+    return f"{LOG_DIR}/plc{number:02}.log"
+
+
+def get_args(argv: "list[str]"=None) -> argparse.Namespace:
+    '''Parses the command line arguments.
+
+    Args:
+        argv (list): Arguments, defaults to sys.argv.
+    Returns:
+        Namespace: log, log_subsystem, log_gzip, sim, replay and bench.
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default=STD_LEVEL_CONSOLE, help="change output of consol")
+    parser.add_argument("--log-subsystem", action="append", default=[], metavar="SUBSYSTEM=LEVEL", help="change the level of a subsystem (Act, Sens, Rob, Mqtt, ...) for file and console, e.g. Sens=WARNING")
+    parser.add_argument("--log-gzip", action="store_true", help="compress the finished log files")
+    parser.add_argument("--sim", type=float, nargs="?", const=1.0, default=None, metavar="TIME_SCALE", help="run with the simulated factory, TIME_SCALE > 1 runs faster than real time")
+    parser.add_argument("--replay", default=None, metavar="RECORDING", help="replay the commands of a recorded mqtt session (log_mqtt/...) instead of connecting to the broker")
+    parser.add_argument("--bench", default="benchmark.json", metavar="OUTPUT", help="file for the benchmark results of --replay")
+    return parser.parse_args(argv)
+
+
+def setup_logging(console_level: str=STD_LEVEL_CONSOLE, subsystems: "list[str]"=[], compress=False):
+    '''Starts logging to the console and to the next file in LOG_DIR.
+    The records are put into a bounded queue and written by the thread of the listener, so logging never waits for the console or the file.
+
+    Args:
+        console_level (str): Level of the console (DEBUG, INFO, WARNING, ERROR).
+        subsystems (list): Levels of subsystems, ["SUBSYSTEM=LEVEL"].
+        compress (bool): Compresses the finished log files with gzip.
+    '''
+    global log_queue, log_listener
+    if log_listener != None:
+        return
+
+    # loggers created from now on start with the level of their subsystem, set_subsystem_level() updates the existing ones
+    logging.setLoggerClass(SubsystemLogger)
+    for switch in subsystems:
+        subsystem, _, level = switch.partition("=")
+        set_subsystem_level(subsystem, level.upper())
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_formatter_file = logging.Formatter("%(asctime)s.%(msecs)03d; %(levelname)-8s; %(name)-12s %(message)-70s; %(threadName)s; %(module)s; %(funcName)s(%(lineno)d); ", datefmt='%H:%M:%S')
+
+    # Setup File handler, a new file is started on every start
+    file_handler = LogFileHandler(compress=compress)
+    file_handler.setFormatter(log_formatter_file)
+    file_handler.setLevel(LEVEL_FILE)
+
+    # Setup Stream Handler (i.e. console)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(log_formatter_file)
+    stream_handler.setLevel(getattr(logging, console_level.upper(), None))
+
+    log.setLevel(logging.DEBUG)
+    log_queue = DropOldestQueue(LOG_BUFFER_SIZE)
+    log.addHandler(LazyQueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    log_listener.start()
+    # write the remaining records when the program ends
+    atexit.register(stop_logging)
+
+    log.critical("PROGRAM START\n####################################################################################################")
+
 
-log.critical("PROGRAM START\n####################################################################################################")
+def stop_logging():
+    '''Writes the remaining records and stops the listener.'''
+    global log_listener
+    if log_listener == None:
+        return
+    if log_queue.dropped > 0:
+        log.warning("Log buffer was full, %s records were dropped", log_queue.dropped)
+    log_listener.stop()
+    log_listener = None
@@ -8,6 +8,7 @@ __license__ = "GPL"
 __version__ = "2024.01.19"
 
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from time import time, sleep
 from enum import Enum
@@ -15,6 +16,173 @@ from revpimodio2 import RevPiModIO
 
 from lib.logger import log
 
+MACHINE_WORKERS = 32
+CHILD_WORKERS = 32
+ACTUATOR_WORKERS = 32
+
+# Shared worker pools for functions that are called with as_thread=True.
+# Machines and actuators use separate pools, so a machine that waits for its axes can't block them.
+# Machines that are run by another machine (for example the conveyors of the IndexLine) use the child pool,
+# so a machine that joins them can't wait for a worker of its own pool.
+machine_executor = ThreadPoolExecutor(max_workers=MACHINE_WORKERS, thread_name_prefix="Machine")
+child_executor = ThreadPoolExecutor(max_workers=CHILD_WORKERS, thread_name_prefix="Child")
+actuator_executor = ThreadPoolExecutor(max_workers=ACTUATOR_WORKERS, thread_name_prefix="Actuator")
+# in_machine is True in the workers that run a machine
+workers = threading.local()
+
+def submit(name: str, function, *args, executor: ThreadPoolExecutor=machine_executor) -> Future:
+    '''Runs function in a worker of the shared pool, the worker is named after the caller while running.
+    Machines submitted from a machine worker run in child_executor, an error that escapes function is logged.
+
+    Args:
+        name (str): Name of the worker thread while running function (shown in the log).
+        function: Function to run.
+        *args: Arguments passed to function.
+        executor (ThreadPoolExecutor): Pool that runs the function, defaults to the machine pool.
+    Returns:
+        Future: Future of the function call.
+    '''
+    is_machine = executor == machine_executor
+    if is_machine and getattr(workers, "in_machine", False):
+        executor = child_executor
+
+    def task():
+        thread = threading.current_thread()
+        worker_name = thread.name
+        thread.name = name
+        workers.in_machine = is_machine
+        try:
+            return function(*args)
+        finally:
+            workers.in_machine = False
+            thread.name = worker_name
+
+    def log_error(done: Future):
+        if not done.cancelled() and done.exception() != None:
+            log.error("Error in %s: %s", name, done.exception(), exc_info=done.exception())
+
+    future = executor.submit(task)
+    future.add_done_callback(log_error)
+    if executor == machine_executor:
+        # the factory loop checks the machine again as soon as the future is done
+        future.add_done_callback(changes.wake)
+    return future
+
+
+class ChangeTracker():
+    '''Holds the names of states and lines whose status changed since the last status update.
+    The names are only added and popped, so it can be used from all threads without a lock.
+    Every change wakes the factory loop that waits with wait().
+    '''
+    '''
+    Methodes:
+        mark_state(): Mark the state as changed.
+        mark_line(): Mark the line as changed.
+        mark_config(): Mark the configs as changed.
+        pop_states(): Returns and removes all changed states.
+        pop_lines(): Returns and removes all changed lines.
+        pop_config(): Returns and resets if the configs changed.
+        wake(): Wakes the factory loop.
+        wait(): Waits until the factory loop is woken.
+    Attributes:
+        __states (set): Names of the changed states.
+        __lines (set): Names of the changed lines.
+        __config (bool): True if the configs changed.
+        __event (Event): Set to wake the factory loop.
+    '''
+
+    def __init__(self):
+        '''Initializes ChangeTracker.'''
+        self.__states: "set[str]" = set()
+        self.__lines: "set[str]" = set()
+        self.__config = False
+        self.__event = threading.Event()
+
+
+    def mark_state(self, state_name: str):
+        '''Mark the state as changed.
+
+        Args:
+            state_name (str): Name of the changed state.
+        '''
+        self.__states.add(state_name)
+        self.__event.set()
+
+
+    def mark_line(self, line_name: str):
+        '''Mark the line as changed.
+
+        Args:
+            line_name (str): Name of the changed line.
+        '''
+        self.__lines.add(line_name)
+        self.__event.set()
+
+
+    def mark_config(self):
+        '''Mark the configs as changed, for a new Set message.'''
+        self.__config = True
+        self.__event.set()
+
+
+    def pop_states(self) -> "list[str]":
+        '''Returns and removes all changed states.
+
+        Returns:
+            list: Names of the changed states.
+        '''
+        return self.__pop_all(self.__states)
+
+
+    def pop_lines(self) -> "list[str]":
+        '''Returns and removes all changed lines.
+
+        Returns:
+            list: Names of the changed lines.
+        '''
+        return self.__pop_all(self.__lines)
+
+
+    def pop_config(self) -> bool:
+        '''Returns and resets if the configs changed.
+
+        Returns:
+            bool: True if the configs changed since the last call.
+        '''
+        config, self.__config = self.__config, False
+        return config
+
+
+    def wake(self, *_):
+        '''Wakes the factory loop, the arguments are ignored so it can be used as callback.'''
+        self.__event.set()
+
+
+    def wait(self, timeout: float) -> bool:
+        '''Waits until the factory loop is woken. The changes before the wake are done, so they are seen by the next loop.
+
+        Args:
+            timeout (float): Max time to wait in seconds.
+        Returns:
+            bool: True if woken, False after the timeout.
+        '''
+        woken = self.__event.wait(timeout)
+        self.__event.clear()
+        return woken
+
+
+    def __pop_all(self, names: "set[str]") -> "list[str]":
+        '''Pops every name from names, pop is atomic so no mark gets lost.'''
+        popped = []
+        while True:
+            try:
+                popped.append(names.pop())
+            except KeyError:
+                return popped
+
+# changes of all states and lines, read by Setup to publish the status
+changes = ChangeTracker()
+
 class MainState(Enum):
     '''Main State enum'''
     INIT = 0
@@ -36,11 +204,11 @@ class Machine:
         revpi (RevPiModIO): RevPiModIO Object to control the motors and sensors.
         name (str): Exact name of the sensor in PiCtory (everything before first '_').
         line_name (str): Name of current line.
-        thread (Thread): Thread object if a function is called as thread.
+        thread (Future): Future of the function if a function is called as thread.
         __time_start (float): Time of machine start.
         __state_time_start (float): Time of current state start.
         end_machine (bool): True if machine should end.
-        position (int): Counts up the positions of the machine.
+        position (int): Counts up the positions of the machine, wakes the factory loop on change.
         state (State): Current state of machine.
         log (Logger): Log object to print to log.
     '''
@@ -60,11 +228,11 @@ class Machine:
         self.__time_start = time()
         self.__state_time_start = time()
 
-        self.thread: threading.Thread = None
+        self.thread: Future = None
 
         self.exception_msg: str = None
 
-        self.position = 0
+        self.__position = 0
         self.state = None
 
         global log
@@ -72,7 +240,19 @@ class Machine:
 
     
     def __del__(self):
-        self.log.debug(f"Destroyed {type(self).__name__}: {self.name}")
+        self.log.debug("Destroyed %s: %s", type(self).__name__, self.name)
+
+
+    @property
+    def position(self) -> int:
+        '''Counts up the positions of the machine, wakes the factory loop on change.'''
+        return self.__position
+
+    @position.setter
+    def position(self, position: int):
+        if position != self.__position:
+            changes.wake()
+        self.__position = position
 
 
     def get_run_time(self) -> int:
@@ -92,7 +272,7 @@ class Machine:
             int: Run time of state.
         '''
         state_time = round(time() - self.__state_time_start)
-        self.log.info(f"{self.state} time: + {state_time}")
+        self.log.info("%s time: + %s", self.state, state_time)
         return state_time
 
 
@@ -107,8 +287,9 @@ class Machine:
             input(f"Press any key to go to switch: {self.name} to state: {state.name}...\n")
         self.__state_time_start = datetime.now()
         self.state = state
+        changes.mark_line(self.line_name)
 
-        self.log.warning(self.name + ": Switching state to: " + str(state.name))
+        self.log.warning("%s: Switching state to: %s", self.name, state.name)
 
     
     def is_position(self, position: int) -> bool:
@@ -119,12 +300,9 @@ class Machine:
         Returns:
             bool: True if no thread is running and at position.
         '''
-        try:
-            # False, if current thread is active
-            if self.thread.is_alive():
-                return False
-        except AttributeError:
-            pass
+        # False, if current thread is active
+        if self.thread and not self.thread.done():
+            return False
         # False, if given position is not current position
         if position != self.position:
             return False
@@ -139,7 +317,7 @@ class Machine:
         '''
         self.exception_msg = warning_msg
         self.switch_state(MainState.WARNING)
-        self.log.error(f"WARNING: {self.exception_msg}")
+        self.log.error("WARNING: %s", self.exception_msg)
         sleep(0.1)
 
     def problem_handler(self, problem_msg):
@@ -153,7 +331,7 @@ class Machine:
         if self.name.find("_") != -1 and self.thread == None:
             # If called in another machine
             raise
-        self.log.exception(f"PROBLEM: {self.exception_msg}")
+        self.log.exception("PROBLEM: %s", self.exception_msg)
 
     def error_handler(self, error_msg):
         '''Handler for errors.
@@ -166,4 +344,4 @@ class Machine:
         if self.name.find("_") != -1 and self.thread == None:
             # If called in another machine
             raise
-        self.log.exception(f"ERROR: {self.exception_msg}")
+        self.log.exception("ERROR: %s", self.exception_msg)
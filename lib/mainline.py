@@ -9,19 +9,13 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.01.19"
 
-from enum import Enum
+from time import perf_counter
 
 from lib.logger import log
-from lib.machine import Machine, MainState
-
-class Status(Enum):
-    NONE = 0
-    FREE = 1
-    RUNNING = 2
-    BLOCKED = 3
-    WAITING = 4
-    PROBLEM = 888
-    ERROR = 999
+from lib.machine import Machine, MainState, changes
+from lib.profiler import loop_profiler
+from lib.route_graph import RouteGraph
+from lib.resource_manager import Status, get_state_groups, get_resource_manager
 
 class MainLine(Machine):
     '''Controls the MiniFactory.'''
@@ -30,20 +24,31 @@ class MainLine(Machine):
         update(): Updates the line
         line_config(): Config functionality
         mainloop(): Calls the different states
+        get_path(): Returns the states the line passes from the current state.
+        get_held_ahead(): Returns the machines the line holds without its product.
+        yield_machines(): Gives up machines the line holds without its product to resolve a deadlock.
         state_is_free(): Check if given state is FREE or used by current line.
         is_end_state: Check if current state is the end state of current line.
         switch_state(): Switches state to given state if not BLOCKED or RUNNING
         switch_status(): Switch status in states
         end(): Waits for any machines left running.
     Attributes:
+        routes (RouteGraph): Run function and next states of every state, set by the Subclass.
         config (dict): Config for the line.
         states (State): States from Subclass.
+        state_groups (dict): States grouped by machine prefix.
+        resources (ResourceManager): Manager for status and owner of the states, shared by all lines.
         machines (dict): All active machines.
         product_at (bool): Name of machine where product is at. 
         waiting_for_state (State): If line is waiting for machine, holds the state of that machine.
         running (bool): True if line is currently running.
         status_dict (dict): Status of line.
+        __yielding (set): Prefixes of the yielded machines that are freed as soon as they stopped moving.
+        __line_timer (PhaseTimer): Timer of the update of the line.
+        __config_timer (PhaseTimer): Timer of line_config, shared by all lines.
+        __mainloop_timer (PhaseTimer): Timer of mainloop, shared by all lines.
     '''
+    routes: RouteGraph = None
 
     def __init__(self, revpi, config: dict, states):
         '''Initializes MiniFactory control loop.
@@ -57,15 +62,46 @@ class MainLine(Machine):
 
         self.config = config
         self.states = states
+        self.state_groups = get_state_groups(states)
+        self.resources = get_resource_manager(states)
 
         self.machines: "dict[str, Machine]" = {}
-        self.product_at: str = None
-        self.waiting_for_state = None
+        self.__yielding: "set[str]" = set()
+        self.__product_at: str = None
+        self.__waiting_for_state = None
         self.running = False
         self.end_line = False
+        self.__line_timer = loop_profiler.timer(f"line.{self.name}")
+        self.__config_timer = loop_profiler.timer("line_config")
+        self.__mainloop_timer = loop_profiler.timer("mainloop")
 
         global log
         self.log = log.getChild(f"{self.line_name}")
+        changes.mark_line(self.name)
+
+
+    @property
+    def product_at(self) -> str:
+        '''Name of machine where product is at, marks the line as changed on set.'''
+        return self.__product_at
+
+    @product_at.setter
+    def product_at(self, product_at: str):
+        if product_at != self.__product_at:
+            changes.mark_line(self.name)
+        self.__product_at = product_at
+
+
+    @property
+    def waiting_for_state(self):
+        '''If line is waiting for machine, holds the state of that machine, marks the line as changed on set.'''
+        return self.__waiting_for_state
+
+    @waiting_for_state.setter
+    def waiting_for_state(self, state):
+        if state != self.__waiting_for_state:
+            changes.mark_line(self.name)
+        self.__waiting_for_state = state
 
 
     def update(self, run: bool):
@@ -74,9 +110,19 @@ class MainLine(Machine):
         Args:
             run: Only run the line if True.
         '''
+        sampling = loop_profiler.sampling
         try:
-            if self.line_config() and run:
+            if sampling:
+                line_start = perf_counter()
+            configured = self.line_config()
+            if sampling:
+                start = self.__config_timer.record(line_start)
+            if configured and run:
                 self.mainloop()
+                if sampling:
+                    self.__mainloop_timer.record(start)
+            if sampling:
+                self.__line_timer.record(line_start)
         except Exception as error:
             self.error_handler(error)
 
@@ -105,19 +151,26 @@ class MainLine(Machine):
                 self.log.info(f"Ended: {machine.name}")
                 self.switch_status(machine.name, Status.FREE)
                 self.machines.pop(machine.name)
+                changes.mark_line(self.name)
                 break        
+
+        if self.__yielding:
+            self.__release_yielded()
         
-        if self.waiting_for_state != None:
-        # waiting for running or blocked machines
-            if self.waiting_for_state.value[1] == Status.FREE:
+        # waiting for running or blocked machines, the resource manager wakes the line if the machine was freed
+        if self.waiting_for_state != None and self.resources.pop_woken(self.name):
+            if self.state_is_free(self.waiting_for_state):
                 self.log.critical(f"Continuing to: {self.waiting_for_state}")
                 self.switch_state(self.waiting_for_state)
                 self.waiting_for_state = None
+            else:
+                # another line was faster
+                self.resources.wait_for(self.waiting_for_state, self.name)
 
         if self.config["run"] == False:
             tmp_end_line = True
             for machine in self.machines.values():
-                if self.thread and self.thread.is_alive():
+                if self.thread and not self.thread.done():
                     tmp_end_line = False
             self.end_line = tmp_end_line
 
@@ -127,12 +180,11 @@ class MainLine(Machine):
         if self.state == MainState.ERROR or self.state == MainState.PROBLEM:
             if self.state == MainState.PROBLEM:
                 for machine in self.machines.values():
-                    if self.thread and self.thread.is_alive():
+                    if self.thread and not self.thread.done():
                         return False
             self.end_line = True
-            for state in self.states:
-                if state.value[2] == self.name:
-                    self.switch_status(state, Status.FREE)
+            # free every machine used by this line
+            self.resources.release_all(self.name)
 
             return False
         # no error occurred
@@ -140,9 +192,68 @@ class MainLine(Machine):
 
         
     def mainloop(self):
-        '''Abstract function should never be called'''
-        raise Exception("Abstract function called")
-    
+        '''Runs the function of the current state and switches to the next state of the route graph if it returns True.'''
+        if self.routes == None:
+            raise Exception("Abstract function called")
+        # if line is waiting for the next machine
+        if self.waiting_for_state != None:
+            return
+
+        route = self.routes.get_route(self.state)
+        if route == None:
+            return
+        if getattr(self, route.run)():
+            next_state = self.routes.get_next_state(self.state, self.config)
+            if next_state != None:
+                self.switch_state(next_state)
+
+
+    def get_path(self) -> list:
+        '''Returns the states the line passes from the current state, computed from the route graph and the config.
+
+        Returns:
+            list: States from the current state to MainState.END.
+        '''
+        return self.routes.get_path(self.config, self.state)
+
+
+    def get_held_ahead(self) -> "set[str]":
+        '''Returns the machines the line holds without its product, the machines a run function initialized in advance.
+
+        Returns:
+            set: Prefixes of the machines.
+        '''
+        current_prefix = None if isinstance(self.state, MainState) else self.state.name.split('_')[0]
+        held = {machine.name for machine in self.machines.values() if machine.name in self.state_groups and machine.name not in (self.product_at, current_prefix)}
+        return held - self.__yielding
+
+
+    def yield_machines(self, prefixes: "set[str]"):
+        '''Gives up machines the line holds without its product, so a line it blocks in a deadlock can take them.
+        A machine that is still moving is freed as soon as its thread is done.
+        The line stays queued for the machine it waits for and initializes the yielded machines again when it needs them.
+
+        Args:
+            prefixes (set): Prefixes of the machines from get_held_ahead().
+        '''
+        self.log.warning("%s: Yielding %s", self.name, sorted(prefixes))
+        self.__yielding.update(prefixes)
+        self.__release_yielded()
+
+
+    def __release_yielded(self):
+        '''Frees the yielded machines that stopped moving, their waiters are woken by the resource manager.'''
+        for prefix in list(self.__yielding):
+            machine = self.machines.get(prefix)
+            if machine != None:
+                if machine.thread and not machine.thread.done():
+                    continue
+                self.machines.pop(prefix)
+            self.__yielding.discard(prefix)
+            if self.resources.owner(self.state_groups[prefix][0]) == self.name:
+                self.switch_status(prefix, Status.FREE)
+            changes.mark_line(self.name)
+
 
     def state_is_free(self, state):
         '''Check if given state is FREE or used by current line.
@@ -154,11 +265,7 @@ class MainLine(Machine):
         '''
         if isinstance(state, MainState):
             return True
-        if state.value[1] == Status.FREE or state.value[2] == self.name:
-            # self.log.debug(f"State: {state.name} is free")
-            return True
-        else:
-            return False
+        return self.resources.is_free(state, self.name)
         
     
     def is_end_state(self):
@@ -185,19 +292,32 @@ class MainLine(Machine):
         if self.state == self.config["end_at"] and not isinstance(state, MainState):
             self.switch_status(self.state, Status.FREE)
             self.switch_state(MainState.END, wait)
-        elif self.state_is_free(state):
+        elif isinstance(state, MainState) or self.__acquire(state):
+            # acquire is atomic and queues the line as waiter if the state is used
             if wait:
                 input(f"Press any key to go to switch: {self.name} to state: {state.name}...\n")
             self.log.critical(self.name + ": Switching state to: " + str(state.name))
             self.state = state
-            if not isinstance(state, MainState) or state != self.states.WAITING:
-                self.switch_status(state, Status.RUNNING)
+            changes.mark_line(self.name)
         else:
             self.log.critical(f"{self.name}: Waiting for: {state}")
             self.switch_status(self.state, Status.WAITING)
             self.waiting_for_state = state
 
 
+    def __acquire(self, state) -> bool:
+        '''Acquires state for the line, if not possible the line is queued with its priority and remaining route for the arbitration.
+
+        Args:
+            state (State): State Enum to acquire.
+        Returns:
+            bool: True if acquired.
+        '''
+        remaining = len(self.routes.get_path(self.config, state)) if self.routes != None else 0
+        self.resources.set_rank(self.name, self.config.get("priority", 0), remaining)
+        return self.resources.acquire(state, self.name)
+
+
     def switch_status(self, state_name, status: Status):
         '''Switch status in states, if name switches all to a machine belonging states.
         
@@ -205,27 +325,7 @@ class MainLine(Machine):
             state (State | str): Can be a State Enum or a string of to switching state.
             status (Status): Status that the state should be switched to.
         '''
-        if isinstance(state_name, MainState):
-            return
-        # get the used_by tag
-        name_tag = "None" if status == Status.FREE else self.name
-
-        if type(state_name) != str:
-            state_name = state_name.name
-        
-        for state in self.states:
-            if state.name == state_name:
-                # set status
-                state.value[1] = status
-                # set the used_by tag
-                state.value[2] = name_tag
-                self.log.debug(f"{self.name}: Switching status of: {state_name} to [{status}, {name_tag}]")
-            elif state.name.split('_')[0] == state_name.split('_')[0]:
-                # set status
-                state.value[1] = Status.FREE if status == Status.FREE else Status.BLOCKED
-                # set the used_by tag
-                state.value[2] = name_tag
-                self.log.debug(f"{self.name}: Switching status of other: {state.name} to [{Status.FREE if status == Status.FREE else Status.BLOCKED}, {name_tag}]")
+        self.resources.set_status(state_name, status, self.name)
 
 
     def get_machine(self, machine_name: str, machine_class, *args) -> Machine:
@@ -242,6 +342,7 @@ class MainLine(Machine):
         if machine == None:
             machine = machine_class(self.revpi, machine_name, self.name, *args)
             self.machines[machine_name] = machine
+            changes.mark_line(self.name)
             if self.state.name.split('_')[0] != machine_name:
                 self.switch_status(machine_name, Status.RUNNING)
         return machine
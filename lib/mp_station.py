@@ -7,12 +7,11 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.01.12"
 
-import threading
 from time import sleep
 from enum import Enum, auto
 
 from lib.logger import log
-from lib.machine import Machine, MainState
+from lib.machine import Machine, MainState, submit
 from lib.actuator import Actuator, SensorTimeoutError
 from lib.conveyor import Conveyor
 
@@ -66,8 +65,7 @@ class MPStation(Machine):
             as_thread (bool): Runs the function as a thread.
         '''
         if as_thread == True:
-            self.thread = threading.Thread(target=self.init, args=(False,), name=self.name+"_INIT")
-            self.thread.start()
+            self.thread = submit(self.name+"_INIT", self.init, False)
             return
         try:
             self.switch_state(State.INIT)
@@ -90,8 +88,7 @@ class MPStation(Machine):
         '''
         # call this function again as a thread
         if as_thread == True:
-            self.thread = threading.Thread(target=self.run, args=(with_oven, with_saw, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.run, with_oven, with_saw, False)
             return
         
         self.switch_state(State.START)
@@ -194,8 +191,7 @@ class MPStation(Machine):
         '''
         # call this function again as a thread
         if as_thread == True:
-            self.thread = threading.Thread(target=self.run_to_out, args=(False, ), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.run_to_out, False)
             return
         
         try:
@@ -9,13 +9,25 @@ __license__ = "GPL"
 __version__ = "2024.01.19"
 
 import json
+import threading
 import paho.mqtt.client as mqtt
-from time import sleep
+from collections import OrderedDict
+from time import time
 
 try:
     from lib.logger import log
+    from lib.machine import changes
+    from lib.payload import PayloadEncoder
+    from lib.profiler import loop_profiler
+    from lib.resource_manager import get_wait_stats
+    from lib.wh_content import get_wh_content
 except ModuleNotFoundError:
     from logger import log
+    from machine import changes
+    from payload import PayloadEncoder
+    from profiler import loop_profiler
+    from resource_manager import get_wait_stats
+    from wh_content import get_wh_content
 
 class Configs():
     '''Holds config and commands for factory and production lines.'''
@@ -37,15 +49,106 @@ class Status():
     line_status = {}
 
 
+class PublishCoalescer():
+    '''Merges the updates of a topic until they are sent, so a topic is sent once per window as one delta message.'''
+    '''
+    Methodes:
+        add(): Merges data into the pending update of the topic.
+        pop(): Returns the pending updates if the window is over.
+        discard(): Discards the pending update of the topic.
+        next_seq(): Returns the next sequence number of the topic.
+    Attributes:
+        window (float): Time the updates are merged in seconds, with 0 they are sent after every loop of the factory.
+        __pending (dict): Merged updates, {topic: data}.
+        __first_update (float): Time of the oldest pending update.
+        __seq (dict): Last sequence number of every topic.
+        __lock (Lock): Lock for the pending updates and the sequence numbers.
+    '''
+
+    def __init__(self, window: float=0):
+        '''Initializes PublishCoalescer.
+
+        Args:
+            window (float): Time the updates are merged in seconds, with 0 they are sent after every loop of the factory.
+        '''
+        self.window = window
+        self.__pending: "dict[str, dict]" = {}
+        self.__first_update: float = None
+        self.__seq: "dict[str, int]" = {}
+        self.__lock = threading.Lock()
+
+
+    def add(self, topic: str, data: dict):
+        '''Merges data into the pending update of the topic, newer values of a key replace older ones.
+
+        Args:
+            topic (str): Topic of the data.
+            data (dict): Update of the topic.
+        '''
+        with self.__lock:
+            if self.__first_update == None:
+                self.__first_update = time()
+            self.__pending.setdefault(topic, {}).update(data)
+
+
+    def pop(self, force=False) -> "list[tuple]":
+        '''Returns the pending updates and removes them if the window is over.
+
+        Args:
+            force (bool): Returns the pending updates even if the window is not over.
+        Returns:
+            list: [(topic, data)] of every pending update.
+        '''
+        with self.__lock:
+            if not self.__pending or (not force and time() - self.__first_update < self.window):
+                return []
+            pending = list(self.__pending.items())
+            self.__pending.clear()
+            self.__first_update = None
+            return pending
+
+
+    def discard(self, topic: str):
+        '''Discards the pending update of the topic, if the complete data of the topic is sent.
+
+        Args:
+            topic (str): Topic of the update.
+        '''
+        with self.__lock:
+            self.__pending.pop(topic, None)
+
+
+    def next_seq(self, topic: str) -> int:
+        '''Returns the next sequence number of the topic, clients can detect missed updates with it.
+
+        Args:
+            topic (str): Topic of the message.
+        Returns:
+            int: Sequence number.
+        '''
+        with self.__lock:
+            self.__seq[topic] = self.__seq.get(topic, 0) + 1
+            return self.__seq[topic]
+
+
 class MqttHandler():
     '''Handles Communication with mqtt broker.
     
     Attributes:
         configs (Configs): Object where all config data can be saved.
+        COALESCE_TOPICS (tuple): Topics whose updates are merged, their messages are sent as {SEQ_KEY: sequence number, DATA_KEY: data}.
+        COALESCE_WINDOW (float): Default time the updates are merged in seconds, with 0 they are sent after every loop of the factory.
+        SEQ_KEY (str): Key of the sequence number in the messages of COALESCE_TOPICS.
+        DATA_KEY (str): Key of the data in the messages of COALESCE_TOPICS.
+        OFFLINE_QUEUE_SIZE (int): Max number of topics whose last message is kept while the broker is not connected.
+        PAYLOAD_TOPICS (tuple): Topics whose Data can be switched to a binary format with PayloadFormat/Set.
     '''
 
     __BROKER_ADDR = "MiniFactory"
     __PORT = 1883
+    # the delay between connection attempts doubles up to the max delay
+    __RECONNECT_MIN_DELAY = 1 # in seconds
+    __RECONNECT_MAX_DELAY = 32 # in seconds
 
     TOPIC_LINE_CONFIG = "LineConfig"
     TOPIC_FACTORY_CONFIG = "FactoryConfig"
@@ -55,16 +158,26 @@ class MqttHandler():
     TOPIC_MACHINE_STATUS = "MachineStatus"
     TOPIC_FACTORY_STATUS = "FactoryStatus"
     TOPIC_LINE_STATUS = "LineStatus"
-    
-    
-
-    def __init__(self, factory_name: str, configs: Configs, status: Status) -> None:
+    TOPIC_PAYLOAD_FORMAT = "PayloadFormat"
+    TOPIC_LOOP_PROFILE = "LoopProfile"
+    TOPIC_WAIT_TIMES = "WaitTimes"
+
+    COALESCE_TOPICS = (TOPIC_MACHINE_STATUS, TOPIC_LINE_STATUS)
+    COALESCE_WINDOW = 0 # in seconds
+    SEQ_KEY = "seq"
+    DATA_KEY = "data"
+    OFFLINE_QUEUE_SIZE = 100
+    PAYLOAD_TOPICS = (TOPIC_MACHINE_STATUS, TOPIC_LINE_STATUS, TOPIC_FACTORY_STATUS, TOPIC_WH_CONTENT)
+
+    def __init__(self, factory_name: str, configs: Configs, status: Status, states=None, coalesce_window: float=COALESCE_WINDOW) -> None:
         '''Init MqttInterface.
         
         Args:
             factory_name (str): Name of the factory (for example Right).
             configs (Configs): Object where all config data can be saved.
             status (Status): Holds the current status of the different factory parts.
+            states (State): All possible States of the line, their IDs are used in the binary format.
+            coalesce_window (float): Time the updates of COALESCE_TOPICS are merged in seconds.
         '''
 
         # self.__BROKER_ADDR = "test.mosquitto.org"
@@ -76,6 +189,12 @@ class MqttHandler():
         self.__wh_content_file = f"wh_content.json"
         self.__configs = configs
         self.__status = status
+        self.__coalescer = PublishCoalescer(coalesce_window)
+        self.__encoder = PayloadEncoder(states, self.PAYLOAD_TOPICS)
+        self.__connected = False
+        # last message of every topic while not connected, {topic: payload}
+        self.__offline_queue: "OrderedDict[str, str | bytes]" = OrderedDict()
+        self.__offline_lock = threading.Lock()
 
         self.__topics = {
             self.TOPIC_LINE_CONFIG: self.__configs.line_configs,
@@ -83,7 +202,8 @@ class MqttHandler():
             self.TOPIC_FACTORY_COMMANDS: self.__configs.factory_commands,
 
             self.TOPIC_MACHINE_STATUS: self.__status.machine_status,
-            self.TOPIC_LINE_STATUS: self.__status.line_status
+            self.TOPIC_LINE_STATUS: self.__status.line_status,
+            self.TOPIC_PAYLOAD_FORMAT: self.__encoder.schema
         }
 
 
@@ -94,6 +214,7 @@ class MqttHandler():
         self.__client.message_callback_add(f"{self.__topic_start}/{self.TOPIC_FACTORY_CONFIG}/Set", self.__on_message_factory_config_set)
         self.__client.message_callback_add(f"{self.__topic_start}/{self.TOPIC_FACTORY_COMMANDS}/Set", self.__on_message_factory_command_set)
         self.__client.message_callback_add(f"{self.__topic_start}/{self.TOPIC_WH_CONTENT}/Set", self.__on_message_wh_content_set)
+        self.__client.message_callback_add(f"{self.__topic_start}/{self.TOPIC_PAYLOAD_FORMAT}/Set", self.__on_message_payload_format_set)
 
 
         self.__client.message_callback_add(f"{self.__topic_start}/+/Get", self.__on_message_get)
@@ -101,44 +222,57 @@ class MqttHandler():
         self.__client.on_message = self.__on_message_fallback
 
         self.__client.on_disconnect = self.__on_disconnect
+        self.__client.on_connect_fail = self.__on_connect_fail
 
-        while (True):
-            try:
-                self.__client.connect(self.__BROKER_ADDR, self.__PORT)
-            except Exception as error:
-                log.error(f"Error while connecting trying again: {error}")
-                sleep(2)
-            else:
-                break
-
+        # connects in the network thread, so the factory also starts while the broker is down
+        self.__client.reconnect_delay_set(self.__RECONNECT_MIN_DELAY, self.__RECONNECT_MAX_DELAY)
+        self.__client.connect_async(self.__BROKER_ADDR, self.__PORT)
         self.__client.loop_start()
 
 # Methodes for mqtt config
 ###################################################################################################
     def disconnect(self):
         '''Disconnect from MQTT broker.'''
+        self.flush(force=True)
         self.__client.loop_stop()
         self.__client.disconnect()
 
 
     def __on_disconnect(self, client, userdata, rc):
         '''Disconnection callback.'''
+        with self.__offline_lock:
+            self.__connected = False
         log.warning("Connection to MQTT-Broker disconnected")
 
 
+    def __on_connect_fail(self, _client, _userdata):
+        '''Callback for a failed connection attempt, the client tries again after the reconnect delay.'''
+        log.error("Error while connecting to MQTT-Broker, trying again")
+
+
     def __on_connect(self, client: mqtt.Client, _userdata, _flags, rc):
-        '''Connection callback.
+        '''Connection callback, publishes the messages of the offline queue.
         
         Args:
             client(mqtt.Client): connection client.
         '''
         log.warning(f"Connected to MQTT-Broker. Result code: {rc}")
+        if rc != mqtt.CONNACK_ACCEPTED:
+            return
 
         client.subscribe("Debug")
         client.subscribe("Status")
         client.subscribe(f"{self.__topic_start}/+/Get")
         client.subscribe(f"{self.__topic_start}/+/Set")
 
+        with self.__offline_lock:
+            self.__connected = True
+            if len(self.__offline_queue) > 0:
+                log.warning("Publishing %s messages of the offline queue", len(self.__offline_queue))
+            while len(self.__offline_queue) > 0:
+                topic, payload = self.__offline_queue.popitem(last=False)
+                client.publish(topic, payload)
+
 
     def __on_message_fallback(self, _client, _userdata, msg: mqtt.MQTTMessage):
         '''Callback for new message that couldn't be filtered in other callbacks.'''
@@ -160,6 +294,7 @@ class MqttHandler():
         else:
             decoded_msg.update({"changed": True})
         self.__configs.line_configs.update({decoded_msg["name"]: decoded_msg})
+        changes.mark_config()
 
 
     def __on_message_factory_config_set(self, _client, _userdata, msg: mqtt.MQTTMessage):
@@ -171,6 +306,7 @@ class MqttHandler():
         decoded_msg = json.loads(msg.payload)
         log.warning(f"{msg.topic.removeprefix(self.__topic_start)}: {decoded_msg}")
         self.__configs.factory_config.update(decoded_msg)
+        changes.mark_config()
 
 
     def __on_message_factory_command_set(self, _client, _userdata, msg: mqtt.MQTTMessage):
@@ -182,6 +318,7 @@ class MqttHandler():
         decoded_msg = json.loads(msg.payload)
         log.warning(f"{msg.topic.removeprefix(self.__topic_start)}: {decoded_msg}")
         self.__configs.factory_commands.update(decoded_msg)
+        changes.mark_config()
 
 
     def __on_message_wh_content_set(self, _client, _userdata, msg: mqtt.MQTTMessage):
@@ -193,15 +330,27 @@ class MqttHandler():
         decoded_msg = json.loads(msg.payload)
         log.warning(f"{msg.topic.removeprefix(self.__topic_start)}: {decoded_msg}")
         try:
-            with open(self.__wh_content_file, "r+") as fp:
-                json_str = json.load(fp)
-                json_str["content"] = decoded_msg
-                fp.seek(0)
-                json.dump(json_str, fp, indent=4)
-                fp.truncate()
+            get_wh_content(self.__wh_content_file).set_content(decoded_msg)
         except Exception as e:
             log.error(e)
 
+
+    def __on_message_payload_format_set(self, _client, _userdata, msg: mqtt.MQTTMessage):
+        '''Callback for new massage under the PayloadFormat/Set topic, sets the format of the Data of the given topics.
+        Publishes the PayloadFormat/Data afterwards, so the clients know the current formats.
+        
+        Args:
+            msg: The received MQTTMessage, {topic: format}.
+        '''
+        decoded_msg: dict = json.loads(msg.payload)
+        log.warning(f"{msg.topic.removeprefix(self.__topic_start)}: {decoded_msg}")
+        for topic, payload_format in decoded_msg.items():
+            try:
+                self.__encoder.set_format(topic, payload_format)
+            except ValueError as e:
+                log.error(e)
+        self.send_data(self.TOPIC_PAYLOAD_FORMAT)
+
 # Methodes for sending Data or handling data requests
 ###################################################################################################
     def __on_message_get(self, _client, _userdata, msg: mqtt.MQTTMessage):
@@ -215,37 +364,92 @@ class MqttHandler():
         self.log.info(f"Get /{topic_end}/Data")
         if topic_end == self.TOPIC_WH_CONTENT:
             self.send_wh_content_data()
+        elif topic_end == self.TOPIC_LOOP_PROFILE:
+            self.send_data(self.TOPIC_LOOP_PROFILE, loop_profiler.get_summary())
+        elif topic_end == self.TOPIC_WAIT_TIMES:
+            self.send_data(self.TOPIC_WAIT_TIMES, get_wait_stats())
         else:
             try:
                 data = self.__topics[topic_end]
             except Exception:
                 data = f"ERROR: cant get data for topic: {topic}"
             try:
-                self.__client.publish(f"{topic}/Data", json.dumps(data))
+                self.__publish(topic_end, data)
             except TypeError as e:
                 self.log.error(f"Error for publish of {topic_end}/Data: {e}")
 
 
     def send_data(self, topic, data:dict=None):
-        '''Send data to given topic, if data==None default data for the given topic will be sent
+        '''Send data to given topic, if data==None default data for the given topic will be sent.
+        Updates of COALESCE_TOPICS are merged and sent by flush(), the other topics are sent directly.
 
         Args:
             topic: The topic of the data to send.
             data(dict): The data to send, if None the default data for the given topic will be sent.
         '''
-        self.log.info(f"Send {topic}/Data")
+        if data != None and topic in self.COALESCE_TOPICS:
+            self.__coalescer.add(topic, data)
+            return
+        # keep the order of the messages
+        self.flush(force=True)
+        self.log.info("Send %s/Data", topic)
         if data == None:
             data = self.__topics[topic]
-        self.__client.publish(f"{self.__topic_start}/{topic}/Data", json.dumps(data))
+            # the complete data contains the pending update
+            self.__coalescer.discard(topic)
+        self.__publish(topic, data)
+
+
+    def flush(self, force=False):
+        '''Sends the merged updates of COALESCE_TOPICS, is called after every loop of the factory.
+
+        Args:
+            force (bool): Sends the updates even if the window is not over.
+        '''
+        for topic, data in self.__coalescer.pop(force):
+            self.log.info("Send %s/Data with %s updates", topic, len(data))
+            self.__publish(topic, data)
+
+
+    def __publish(self, topic: str, data):
+        '''Publishes data to the Data topic in the format of the topic, data of COALESCE_TOPICS is sent together with the next sequence number.
+
+        Args:
+            topic (str): The topic of the data without /Data.
+            data: The data to send.
+        '''
+        if topic in self.COALESCE_TOPICS and type(data) == dict:
+            if not self.__connected:
+                # only the last message is kept in the offline queue, the complete data contains the older updates
+                data = self.__topics[topic]
+            data = {self.SEQ_KEY: self.__coalescer.next_seq(topic), self.DATA_KEY: data}
+        self.__send(f"{self.__topic_start}/{topic}/Data", self.__encoder.encode(topic, data))
+
+
+    def __send(self, topic: str, payload: "str | bytes"):
+        '''Publishes the payload, keeps it in the offline queue if the broker is not connected.
+        The offline queue keeps the last payload of every topic and drops the oldest topic if it is full.
+
+        Args:
+            topic (str): Complete topic of the message.
+            payload (str | bytes): Payload of the message.
+        '''
+        with self.__offline_lock:
+            if self.__connected and self.__client.publish(topic, payload).rc == mqtt.MQTT_ERR_SUCCESS:
+                return
+            self.__offline_queue.pop(topic, None)
+            self.__offline_queue[topic] = payload
+            if len(self.__offline_queue) > self.OFFLINE_QUEUE_SIZE:
+                dropped_topic, _ = self.__offline_queue.popitem(last=False)
+                self.log.warning("Offline queue full, dropped message of %s", dropped_topic)
 
 
     def send_wh_content_data(self):
         '''Publishes the current wh_content.
         '''
         try:
-            with open(self.__wh_content_file, "r") as fp:
-                content = json.load(fp)["content"]
-                self.__client.publish(f"{self.__topic_start}/{self.TOPIC_WH_CONTENT}/Data", json.dumps(content))
+            content = get_wh_content(self.__wh_content_file).get_content()
+            self.__publish(self.TOPIC_WH_CONTENT, content)
         except Exception as e:
             log.error(e)
 
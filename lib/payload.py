@@ -0,0 +1,186 @@
+'''This module encodes the payload of the mqtt Data messages as json or as compact binary (CBOR, RFC 8949)'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+import json
+import struct
+
+FORMAT_JSON = "json"
+FORMAT_CBOR = "cbor"
+FORMATS = (FORMAT_JSON, FORMAT_CBOR)
+# CBOR tag "identifier", a state name is sent as this tag with the ID of the state
+ID_TAG = 39
+
+def get_state_ids(states) -> "dict[str, int]":
+    '''Returns the ID of every state.
+
+    Args:
+        states (State): All possible States of the line, NAME = [ID, Status, Used_by].
+    Returns:
+        dict: {name: ID}, empty if states is None.
+    '''
+    if states == None:
+        return {}
+    return {state.name: state.value[0] for state in states}
+
+
+class PayloadEncoder():
+    '''Encodes the payload of the Data messages in the format of their topic.'''
+    '''
+    Methodes:
+        encode(): Encodes data in the format of the topic.
+        encode_cbor(): Encodes data as CBOR.
+        set_format(): Sets the format of a topic.
+        get_format(): Returns the format of a topic.
+    Attributes:
+        schema (dict): Formats, ID tag, state IDs and the format of every topic, sent as PayloadFormat/Data.
+        __ids (dict): {name: ID} of the states.
+        __topic_formats (dict): {topic: format} of every topic that can be switched.
+    '''
+    # major types of CBOR
+    __UNSIGNED = 0
+    __NEGATIVE = 1
+    __BYTES = 2
+    __TEXT = 3
+    __ARRAY = 4
+    __MAP = 5
+    __TAG = 6
+
+    def __init__(self, states, topics: "list[str]"):
+        '''Initializes PayloadEncoder, every topic starts with json.
+
+        Args:
+            states (State): All possible States of the line, None if no IDs are used.
+            topics (list): Topics whose format can be switched.
+        '''
+        self.__ids = get_state_ids(states)
+        self.__topic_formats = {topic: FORMAT_JSON for topic in topics}
+        self.schema = {
+            "formats": list(FORMATS),
+            "id_tag": ID_TAG,
+            "ids": self.__ids,
+            "topics": self.__topic_formats
+        }
+
+
+    def encode(self, topic: str, data) -> "str | bytes":
+        '''Encodes data in the format of the topic, topics that can't be switched are json.
+
+        Args:
+            topic (str): Topic of the data without /Data.
+            data: Data to encode.
+        Returns:
+            str | bytes: json string or CBOR bytes.
+        Raises:
+            TypeError: data contains an object that can't be encoded.
+        '''
+        if self.__topic_formats.get(topic) == FORMAT_CBOR:
+            return self.encode_cbor(data)
+        return json.dumps(data)
+
+
+    def encode_cbor(self, data) -> bytes:
+        '''Encodes data as CBOR, state names are encoded as ID_TAG with the ID of the state.
+
+        Args:
+            data: Data like for json.dumps (dict, list, tuple, str, int, float, bool, None).
+        Returns:
+            bytes: Encoded data.
+        Raises:
+            TypeError: data contains an object that can't be encoded.
+        '''
+        out = bytearray()
+        self.__encode_item(data, out)
+        return bytes(out)
+
+
+    def set_format(self, topic: str, payload_format: str):
+        '''Sets the format of a topic.
+
+        Args:
+            topic (str): Topic without /Data.
+            payload_format (str): One of FORMATS.
+        Raises:
+            ValueError: Topic can't be switched or format is unknown.
+        '''
+        if topic not in self.__topic_formats:
+            raise ValueError(f"Format of {topic} can't be set")
+        if payload_format not in FORMATS:
+            raise ValueError(f"Unknown format {payload_format} for {topic}, possible are {FORMATS}")
+        self.__topic_formats[topic] = payload_format
+
+
+    def get_format(self, topic: str) -> str:
+        '''Returns the format of a topic.
+
+        Args:
+            topic (str): Topic without /Data.
+        Returns:
+            str: One of FORMATS, json for topics that can't be switched.
+        '''
+        return self.__topic_formats.get(topic, FORMAT_JSON)
+
+
+    def __write_head(self, out: bytearray, major: int, value: int):
+        '''Writes the head of a CBOR item with the shortest length.'''
+        if value < 24:
+            out.append(major << 5 | value)
+        elif value < 0x100:
+            out.append(major << 5 | 24)
+            out.append(value)
+        elif value < 0x10000:
+            out.append(major << 5 | 25)
+            out += value.to_bytes(2, "big")
+        elif value < 0x100000000:
+            out.append(major << 5 | 26)
+            out += value.to_bytes(4, "big")
+        else:
+            out.append(major << 5 | 27)
+            out += value.to_bytes(8, "big")
+
+
+    def __encode_item(self, data, out: bytearray):
+        '''Appends the CBOR encoding of data to out.'''
+        # bool before int, bool is a subclass of int
+        if data is None:
+            out.append(0xf6)
+        elif data is True:
+            out.append(0xf5)
+        elif data is False:
+            out.append(0xf4)
+        elif isinstance(data, int):
+            if data >= 0:
+                self.__write_head(out, self.__UNSIGNED, data)
+            else:
+                self.__write_head(out, self.__NEGATIVE, -1 - data)
+        elif isinstance(data, float):
+            out.append(0xfb)
+            out += struct.pack(">d", data)
+        elif isinstance(data, str):
+            state_id = self.__ids.get(data)
+            if state_id != None:
+                self.__write_head(out, self.__TAG, ID_TAG)
+                self.__write_head(out, self.__UNSIGNED, state_id)
+            else:
+                text = data.encode()
+                self.__write_head(out, self.__TEXT, len(text))
+                out += text
+        elif isinstance(data, (bytes, bytearray)):
+            self.__write_head(out, self.__BYTES, len(data))
+            out += data
+        elif isinstance(data, (list, tuple)):
+            self.__write_head(out, self.__ARRAY, len(data))
+            for item in data:
+                self.__encode_item(item, out)
+        elif isinstance(data, dict):
+            self.__write_head(out, self.__MAP, len(data))
+            for key, value in data.items():
+                self.__encode_item(key, out)
+                self.__encode_item(value, out)
+        else:
+            raise TypeError(f"Object of type {type(data).__name__} is not CBOR serializable")
@@ -0,0 +1,271 @@
+'''This module measures the run time of every phase of the factory loop in latency histograms'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+from array import array
+from time import perf_counter
+
+from lib.logger import log
+
+# sub buckets of every power of two, the values of a bucket differ by at most 1/(SUB_BUCKETS/2) (about 3%)
+SUB_BUCKETS = 64
+# longest run time that is recorded exactly, longer ones are recorded as this value
+MAX_VALUE_US = 60 * 1000 * 1000
+# seconds between the summary log lines
+SUMMARY_SECONDS = 60
+# only every SAMPLE_TICKS-th tick is measured, the other ticks only check LoopProfiler.sampling
+SAMPLE_TICKS = 32
+# percentiles in the summary
+PERCENTILES = (50, 90, 99, 99.9)
+
+class LatencyHistogram():
+    '''Counts run times in buckets whose width grows with the value like a HDR histogram, recording is constant time.'''
+    '''
+    Methodes:
+        record(): Records a run time.
+        get_percentile(): Returns the run time below which the given percent of the run times are.
+        get_summary(): Returns count, mean, percentiles and max in ms.
+        reset(): Removes all recorded run times.
+    Attributes:
+        count (int): Number of recorded run times.
+        total (int): Sum of the recorded run times in us.
+        max (int): Longest recorded run time in us.
+        __counts (array): Count of every bucket.
+    '''
+    __SHIFT_BITS = SUB_BUCKETS.bit_length() - 1
+    __HALF = SUB_BUCKETS // 2
+
+    def __init__(self):
+        '''Initializes LatencyHistogram.'''
+        self.__counts = array("L", bytes(array("L").itemsize * (self.__get_index(MAX_VALUE_US) + 1)))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+    def record(self, seconds: float):
+        '''Records a run time.
+
+        Args:
+            seconds (float): Run time in s.
+        '''
+        value = min(int(seconds * 1000000), MAX_VALUE_US)
+        self.__counts[self.__get_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+    def get_percentile(self, percent: float) -> int:
+        '''Returns the run time below which the given percent of the run times are.
+
+        Args:
+            percent (float): Percent of the run times.
+        Returns:
+            int: Upper bound of the bucket in us, at most the longest run time.
+        '''
+        if self.count == 0:
+            return 0
+        rank = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index, bucket_count in enumerate(self.__counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.__get_upper_bound(index), self.max)
+        return self.max
+
+
+    def get_summary(self) -> dict:
+        '''Returns count, mean, percentiles and max of the run times.
+
+        Returns:
+            dict: {"count", "mean", "p50", "p90", "p99", "p99.9", "max"}, run times in ms.
+        '''
+        summary = {"count": self.count, "mean": round(self.total / self.count / 1000, 3) if self.count else 0}
+        for percent in PERCENTILES:
+            summary[f"p{percent:g}"] = round(self.get_percentile(percent) / 1000, 3)
+        summary["max"] = round(self.max / 1000, 3)
+        return summary
+
+
+    def reset(self):
+        '''Removes all recorded run times.'''
+        for index in range(len(self.__counts)):
+            self.__counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+    def __get_index(self, value: int) -> int:
+        '''Returns the bucket of a value in us, values below SUB_BUCKETS have their own bucket.'''
+        if value < SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - self.__SHIFT_BITS
+        return SUB_BUCKETS + (shift - 1) * self.__HALF + (value >> shift) - self.__HALF
+
+
+    def __get_upper_bound(self, index: int) -> int:
+        '''Returns the highest value in us of a bucket.'''
+        if index < SUB_BUCKETS:
+            return index
+        shift = (index - SUB_BUCKETS) // self.__HALF + 1
+        sub_bucket = (index - SUB_BUCKETS) % self.__HALF + self.__HALF
+        return ((sub_bucket + 1) << shift) - 1
+
+
+class PhaseTimer():
+    '''Records the run time of a phase in its histogram.
+    The caller keeps the start time, so a phase can be nested or timed by several callers at once.
+    '''
+    '''
+    Methodes:
+        record(): Records the run time since start.
+    Attributes:
+        histogram (LatencyHistogram): Histogram of the phase.
+    '''
+
+    def __init__(self, histogram: LatencyHistogram):
+        '''Initializes PhaseTimer.
+
+        Args:
+            histogram (LatencyHistogram): Histogram of the phase.
+        '''
+        self.histogram = histogram
+
+
+    def record(self, start: float) -> float:
+        '''Records the run time since start.
+
+        Args:
+            start (float): Start of the phase from perf_counter().
+        Returns:
+            float: End of the phase, can be used as the start of the next phase.
+        '''
+        now = perf_counter()
+        self.histogram.record(now - start)
+        return now
+
+
+class LoopProfiler():
+    '''Measures the run time of every phase and of the ticks of the factory loop.
+    Only every SAMPLE_TICKS-th tick is measured, so the profiler stays below 1% of a tick of the event driven loop.
+    The phases are timed by the caller while sampling is True:
+
+        if loop_profiler.sampling:
+            start = perf_counter()
+        do_phase()
+        if loop_profiler.sampling:
+            timer.record(start)
+    '''
+    '''
+    Methodes:
+        timer(): Returns the timer of a phase, create the timers once and keep them.
+        start_tick(): Starts a tick of the loop.
+        end_tick(): Ends the tick and writes the summary log line if it is due.
+        get_summary(): Returns the summary of every phase.
+        get_summary_line(): Returns the summary as one line.
+        reset(): Removes all recorded run times.
+    Attributes:
+        enabled (bool): Only measures if True.
+        sampling (bool): True while the current tick is measured.
+        __timers (dict): {phase: PhaseTimer}.
+        __tick (LatencyHistogram): Run time of the measured ticks.
+        __tick_start (float): Start of the current tick.
+        __ticks (int): Number of started ticks.
+        __last_summary (float): Time of the last summary log line.
+    '''
+
+    def __init__(self, enabled=True):
+        '''Initializes LoopProfiler.
+
+        Args:
+            enabled (bool): Only measures if True.
+        '''
+        self.enabled = enabled
+        self.sampling = False
+        self.__timers: "dict[str, PhaseTimer]" = {}
+        self.__tick = LatencyHistogram()
+        self.__tick_start = 0.0
+        self.__ticks = 0
+        self.__last_summary = perf_counter()
+
+        global log
+        self.log = log.getChild("Profiler")
+
+
+    def timer(self, name: str) -> PhaseTimer:
+        '''Returns the timer of a phase, the timers of the same name share their histogram.
+
+        Args:
+            name (str): Name of the phase.
+        Returns:
+            PhaseTimer: Timer of the phase.
+        '''
+        timer = self.__timers.get(name)
+        if timer == None:
+            timer = self.__timers[name] = PhaseTimer(LatencyHistogram())
+        return timer
+
+
+    def start_tick(self) -> bool:
+        '''Starts a tick of the loop, every SAMPLE_TICKS-th tick is measured.
+
+        Returns:
+            bool: True if the tick is measured.
+        '''
+        self.__ticks += 1
+        self.sampling = self.enabled and self.__ticks % SAMPLE_TICKS == 0
+        if self.sampling:
+            self.__tick_start = perf_counter()
+        return self.sampling
+
+
+    def end_tick(self):
+        '''Ends the tick and writes the summary log line every SUMMARY_SECONDS.'''
+        if not self.sampling:
+            return
+        self.sampling = False
+        now = perf_counter()
+        self.__tick.record(now - self.__tick_start)
+        if now - self.__last_summary >= SUMMARY_SECONDS:
+            self.__last_summary = now
+            self.log.info("Loop profile: %s", self.get_summary_line())
+
+
+    def get_summary(self) -> "dict[str, dict]":
+        '''Returns the summary of every phase and of the tick.
+
+        Returns:
+            dict: {phase: LatencyHistogram.get_summary()}, "tick" is the whole tick.
+        '''
+        summary = {"tick": self.__tick.get_summary()}
+        for name, timer in list(self.__timers.items()):
+            summary[name] = timer.histogram.get_summary()
+        return summary
+
+
+    def get_summary_line(self) -> str:
+        '''Returns p50, p99 and max of every phase as one line.
+
+        Returns:
+            str: For example "tick 0.51/0.92/3.1ms, config 0.01/0.02/0.05ms, ...".
+        '''
+        return ", ".join(f"{name} {phase['p50']:g}/{phase['p99']:g}/{phase['max']:g}ms" for name, phase in self.get_summary().items())
+
+
+    def reset(self):
+        '''Removes all recorded run times.'''
+        self.__tick.reset()
+        for timer in list(self.__timers.values()):
+            timer.histogram.reset()
+
+
+# profiler of the factory loop, used by Setup and MainLine
+loop_profiler = LoopProfiler()
@@ -7,11 +7,10 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.01.12"
 
-import threading
 from enum import Enum
 
 from lib.logger import log
-from lib.machine import Machine, MainState
+from lib.machine import Machine, MainState, changes, submit
 from lib.actuator import Actuator, SensorTimeoutError
 from lib.conveyor import Conveyor
 
@@ -40,7 +39,7 @@ class PunchMach(Machine):
         '''
         super().__init__(revpi, name, line_name)
         self.position = 1
-        self.ready_for_transport = False
+        self.__ready_for_transport = False
 
         global log
         self.log = log.getChild(f"{self.line_name}(Pun)")
@@ -48,6 +47,18 @@ class PunchMach(Machine):
         self.log.debug(f"Created {type(self).__name__}: {self.name}")
 
 
+    @property
+    def ready_for_transport(self) -> bool:
+        '''If True then the next machine can transport the product, wakes the factory loop on change.'''
+        return self.__ready_for_transport
+
+    @ready_for_transport.setter
+    def ready_for_transport(self, ready_for_transport: bool):
+        if ready_for_transport != self.__ready_for_transport:
+            changes.wake()
+        self.__ready_for_transport = ready_for_transport
+
+
     def run(self, out_stop_sensor: str, as_thread=True):
         '''Runs the Punching Machine routine.
         
@@ -56,8 +67,7 @@ class PunchMach(Machine):
             as_thread (bool): Runs the function as a thread.
         '''
         if as_thread == True:
-            self.thread = threading.Thread(target=self.run, args=(out_stop_sensor, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.run, out_stop_sensor, False)
             return
         
         self.switch_state(State.START)
@@ -0,0 +1,398 @@
+'''Replays recorded mqtt sessions into the factory and measures the throughput'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+import ast
+import json
+import threading
+from time import time
+
+from lib.logger import log
+from lib.machine import changes
+from lib.mqtt_handler import Configs, Status, MqttHandler, PublishCoalescer
+from lib.profiler import loop_profiler
+from lib.resource_manager import get_wait_stats
+from lib.simulator import SimProduct
+from lib.sim_layout import fill_wh
+from lib.telemetry import get_axis_stats
+from lib.wh_content import get_wh_content
+
+# the replay is stopped if it runs TIMEOUT_FACTOR times longer than the recording, but not before MIN_TIMEOUT
+TIMEOUT_FACTOR = 2
+MIN_TIMEOUT = 300 # in seconds
+
+def read_recording(file: str) -> "list[tuple]":
+    '''Reads a recorded mqtt session, a line looks like "15:25:41.951; 3; LineConfig/Set; {...}".
+
+    Args:
+        file (str): Path of the recording.
+    Returns:
+        list: (time since start of recording in s, topic, data) for every message.
+    '''
+    messages = []
+    start_time = None
+    with open(file, "r") as fp:
+        for line in fp:
+            parts = line.rstrip("\n").split("; ", 3)
+            if len(parts) < 3:
+                continue
+            hours, minutes, seconds = parts[0].split(":")
+            msg_time = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            if start_time == None:
+                start_time = msg_time
+            # recording over midnight
+            if msg_time < start_time:
+                msg_time += 24 * 3600
+            data = parts[3] if len(parts) > 3 else None
+            try:
+                data = ast.literal_eval(data) if data != None else None
+            except (ValueError, SyntaxError):
+                pass
+            messages.append((msg_time - start_time, parts[2], data))
+    return messages
+
+
+def get_percentiles(values: "list[float]", percentiles=(50, 90, 99)) -> dict:
+    '''Returns the percentiles of the values (nearest rank).
+
+    Args:
+        values (list): The values.
+        percentiles (tuple): The percentiles to return.
+    Returns:
+        dict: {"p50": value, ..., "max": value}, empty if there are no values.
+    '''
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {f"p{p}": values[min(len(values) - 1, int(len(values) * p / 100))] for p in percentiles}
+    result["max"] = values[-1]
+    return result
+
+
+class CycleTimes():
+    '''Measures how long every machine state is used, from leaving FREE until FREE again.'''
+    '''
+    Methodes:
+        update(): Updates with new machine status data.
+        get_stats(): Returns count, mean, min and max of every state.
+    Attributes:
+        __started (dict): Start time of every used state, {state: time}.
+        __times (dict): Cycle times of every state, {state: [time]}.
+    '''
+
+    def __init__(self):
+        '''Initializes CycleTimes.'''
+        self.__started: "dict[str, float]" = {}
+        self.__times: "dict[str, list[float]]" = {}
+
+
+    def update(self, msg_time: float, machine_status: dict):
+        '''Updates with new machine status data.
+
+        Args:
+            msg_time (float): Time of the data in s.
+            machine_status (dict): MachineStatus/Data, {state: [status, used_by]}.
+        '''
+        for state_name, (status, _) in machine_status.items():
+            if status != "FREE":
+                self.__started.setdefault(state_name, msg_time)
+            elif state_name in self.__started:
+                self.__times.setdefault(state_name, []).append(msg_time - self.__started.pop(state_name))
+
+
+    def get_stats(self) -> dict:
+        '''Returns count, mean, min and max of the cycle times of every state in s.'''
+        return {state_name: {
+            "count": len(times),
+            "mean": round(sum(times) / len(times), 3),
+            "min": round(min(times), 3),
+            "max": round(max(times), 3)
+            } for state_name, times in sorted(self.__times.items())}
+
+
+class ReplayHandler(MqttHandler):
+    '''Replaces the MqttHandler, sets the configs and commands of a recorded session at the recorded time and writes the benchmark results as json.
+    With the simulator the simulated time is used, so the results don't depend on the time scale.
+    '''
+    '''
+    Methodes:
+        on_loop(): Is called after every loop of the factory, replays the due messages.
+        get_results(): Returns the benchmark results.
+    Attributes:
+        recording (str): Path of the recording.
+        output (str): Path of the results json.
+        finished (bool): True if every message was replayed.
+        __messages (list): Messages that are replayed, (time, topic, data).
+        __next_msg (int): Index of the next message to replay.
+        __duration (float): Duration of the recording in s.
+        __timeout (float): Time after which the factory is stopped in s.
+        __revpi (RevPiModIO): Simulator, the simulated time is used if it has sim_time.
+        __wall_start_time (float): Real time of the start.
+        __loop_times (list): Run time of every loop in s.
+        __thread_counts (list): Number of threads after every loop.
+        __cycle_times (CycleTimes): Cycle times of the replay.
+        __recorded_cycle_times (CycleTimes): Cycle times of the recording.
+        __lines (dict): Start and end time of every line, {line: {"started": time, "at": start state, "ended": time}}.
+        __errors (list): Every error of the factory.
+        __problems (list): Every problem of a machine.
+        __published (int): Number of published messages.
+        __updates (int): Number of updates, more than one update of COALESCE_TOPICS is merged into one message.
+        __coalescer (PublishCoalescer): Merges the updates like the MqttHandler.
+        __timed_out (bool): True if the factory was stopped by the timeout.
+    '''
+
+    def __init__(self, factory_name: str, configs: Configs, status: Status, recording: str, output: str, revpi=None):
+        '''Initializes the ReplayHandler and reads the recording, does not connect to the broker.
+
+        Args:
+            factory_name (str): Name of the factory (for example Right).
+            configs (Configs): Object where all config data can be saved.
+            status (Status): Holds the current status of the different factory parts.
+            recording (str): Path of the recording.
+            output (str): Path of the results json.
+            revpi (RevPiModIO): Simulator, products are put on conveyors where lines start.
+        '''
+        global log
+        self.log = log.getChild("Replay")
+
+        self.factory_name = factory_name
+        self.recording = recording
+        self.output = output
+        self.finished = False
+        self.__configs = configs
+        self.__status = status
+        self.__revpi = revpi
+        self.__wh_content_file = "wh_content.json"
+
+        messages = read_recording(recording)
+        self.__messages = [msg for msg in messages if msg[1].endswith("/Set")]
+        self.__next_msg = 0
+        self.__duration = messages[-1][0] if messages else 0
+        self.__timeout = max(self.__duration * TIMEOUT_FACTOR, MIN_TIMEOUT)
+
+        self.__recorded_cycle_times = CycleTimes()
+        for msg_time, topic, data in messages:
+            if topic == f"{self.TOPIC_MACHINE_STATUS}/Data" and type(data) == dict:
+                self.__recorded_cycle_times.update(msg_time, data)
+
+        self.__wall_start_time = time()
+        self.__loop_times: "list[float]" = []
+        self.__thread_counts: "list[int]" = []
+        self.__cycle_times = CycleTimes()
+        self.__lines: "dict[str, dict]" = {}
+        self.__errors: "list[str]" = []
+        self.__problems: "list[str]" = []
+        self.__published = 0
+        self.__updates = 0
+        self.__coalescer = PublishCoalescer(self.COALESCE_WINDOW)
+        self.__timed_out = False
+
+        self.log.warning(f"Replaying {len(self.__messages)} messages of {recording} ({self.__duration:.1f}s)")
+
+# Methodes for replaying
+###################################################################################################
+    def on_loop(self, loop_run_time: float):
+        '''Is called after every loop of the factory, replays the due messages and stops the factory if every line has ended or after the timeout.
+
+        Args:
+            loop_run_time (float): Run time of the loop in s.
+        '''
+        self.__loop_times.append(loop_run_time)
+        self.__thread_counts.append(threading.active_count())
+
+        now = self.__get_time()
+        # the next message waits until new lines are added, the factory only adds lines every second
+        while self.__next_msg < len(self.__messages) and self.__messages[self.__next_msg][0] <= now and not self.__is_line_pending():
+            _, topic, data = self.__messages[self.__next_msg]
+            self.__next_msg += 1
+            self.__set(topic.removesuffix("/Set"), data)
+
+        if not self.finished and self.__next_msg >= len(self.__messages) and not self.__is_line_pending():
+            # exit the factory when every line has been removed
+            self.finished = True
+            self.__configs.factory_config.update({"exit_if_end": True})
+            self.log.warning(f"Replay finished after {now:.1f}s")
+
+        if self.__configs.factory_commands.get("stop"):
+            return
+        if self.finished and self.__have_lines_ended():
+            # lines whose machines don't end are not removed
+            self.log.warning(f"Every line has ended after {now:.1f}s")
+            self.__configs.factory_commands.update({"stop": True})
+        elif now > self.__timeout:
+            self.__timed_out = True
+            self.log.error(f"Replay timed out after {now:.1f}s")
+            self.__configs.factory_commands.update({"stop": True})
+
+
+    def __is_line_pending(self) -> bool:
+        '''Returns True if a new line config was not yet added by the factory.'''
+        return any(config.get("new") for config in self.__configs.line_configs.values())
+
+
+    def __have_lines_ended(self) -> bool:
+        '''Returns True if every running line has ended.'''
+        for name, config in self.__configs.line_configs.items():
+            if config.get("run") and "ended" not in self.__lines.get(name, {}):
+                return False
+        return True
+
+
+    def __set(self, topic_end: str, data):
+        '''Sets the data of a Set message like the MqttHandler.
+
+        Args:
+            topic_end (str): Topic without factory and Set (for example LineConfig).
+            data: The data of the message.
+        '''
+        self.log.warning(f"/{topic_end}: {data}")
+        if topic_end == self.TOPIC_LINE_CONFIG:
+            data = dict(data)
+            if self.__configs.line_configs.get(data["name"]) == None:
+                data.update({"new": True})
+            else:
+                data.update({"changed": True})
+            self.__configs.line_configs.update({data["name"]: data})
+            self.__add_start_product(data)
+        elif topic_end == self.TOPIC_FACTORY_CONFIG:
+            self.__configs.factory_config.update(data)
+        elif topic_end == self.TOPIC_FACTORY_COMMANDS:
+            self.__configs.factory_commands.update(data)
+        elif topic_end == self.TOPIC_WH_CONTENT:
+            get_wh_content(self.__wh_content_file).set_content(data)
+            if "WH_SLOTS" in getattr(self.__revpi, "parts", {}):
+                fill_wh(self.__revpi, data)
+        changes.mark_config()
+
+
+    def __add_start_product(self, config: dict):
+        '''Puts a product on the conveyor of the simulator where the line starts, like the operator did in the recording.'''
+        parts: dict = getattr(self.__revpi, "parts", {})
+        conveyor = parts.get(str(config.get("start_at")).upper())
+        if conveyor != None and hasattr(conveyor, "add_product"):
+            conveyor.add_product(SimProduct(config.get("color", "COLOR_UNKNOWN")), 10)
+
+
+    def get_wait_time(self) -> float:
+        '''Returns the real time until the next message is due, the factory loop waits at most this long.
+
+        Returns:
+            float: Time in s, None if every message is replayed.
+        '''
+        if self.__next_msg >= len(self.__messages):
+            return None
+        wait_time = self.__messages[self.__next_msg][0] - self.__get_time()
+        return max(wait_time, 0) / getattr(self.__revpi, "time_scale", 1)
+
+
+    def __get_time(self) -> float:
+        '''Returns the time since the start in s, simulated if the simulator is used.'''
+        sim_time = getattr(self.__revpi, "sim_time", None)
+        if sim_time != None:
+            return sim_time
+        return time() - self.__wall_start_time
+
+# Methodes replacing the MqttHandler
+###################################################################################################
+    def disconnect(self):
+        '''Writes the benchmark results.'''
+        self.flush(force=True)
+        results = self.get_results()
+        with open(self.output, "w") as fp:
+            json.dump(results, fp, indent=4)
+        self.log.critical(f"Benchmark results written to {self.output}: {results['products']} products, {results['products_per_hour']} products/h")
+
+
+    def send_data(self, topic, data: dict=None):
+        '''Evaluates the data instead of publishing it.
+
+        Args:
+            topic: The topic of the data to send.
+            data(dict): The data to send, if None the default data for the given topic is used.
+        '''
+        self.__updates += 1
+        if data != None and topic in self.COALESCE_TOPICS:
+            self.__coalescer.add(topic, data)
+        else:
+            self.flush(force=True)
+            self.__published += 1
+        if data == None:
+            return
+        now = self.__get_time()
+        if topic == self.TOPIC_MACHINE_STATUS:
+            self.__cycle_times.update(now, data)
+        elif topic == self.TOPIC_FACTORY_STATUS:
+            if "line_started" in data:
+                self.__lines.setdefault(data["line_started"]["name"], {}).update({"started": now, "at": data["line_started"]["at"]})
+            if "line_ended" in data:
+                self.__lines.setdefault(data["line_ended"]["name"], {}).update({"ended": now})
+            if "ERROR" in data:
+                self.__errors.append(data["ERROR"])
+        elif topic == self.TOPIC_LINE_STATUS:
+            for line_name, line_status in data.items():
+                for machine_name, machine_status in line_status.items():
+                    if "PROBLEM" in machine_status:
+                        self.__problems.append(f"{line_name} {machine_name}: {machine_status['PROBLEM']}")
+
+
+    def flush(self, force=False):
+        '''Counts the merged updates as messages.
+
+        Args:
+            force (bool): Counts the updates even if the window is not over.
+        '''
+        self.__published += len(self.__coalescer.pop(force))
+
+
+    def send_wh_content_data(self):
+        '''Nothing to publish.'''
+        self.__published += 1
+
+# Methodes for the results
+###################################################################################################
+    def get_results(self) -> dict:
+        '''Returns the benchmark results.
+
+        Returns:
+            dict: Throughput, cycle time of every state, loop run time percentiles, thread counts and axis statistics.
+        '''
+        run_time = self.__get_time()
+        lines = {}
+        for name, times in self.__lines.items():
+            lines[name] = {key: round(value, 3) if type(value) == float else value for key, value in times.items()}
+            if "started" in times and "ended" in times:
+                lines[name]["time"] = round(times["ended"] - times["started"], 3)
+        # the init line moves no product
+        products = len([line for line in lines.values() if "ended" in line and line.get("at") != "INIT"])
+
+        return {
+            "recording": self.recording,
+            "factory": self.factory_name,
+            "time_scale": getattr(self.__revpi, "time_scale", None),
+            "recorded_time": round(self.__duration, 3),
+            "run_time": round(run_time, 3),
+            "wall_time": round(time() - self.__wall_start_time, 3),
+            "timed_out": self.__timed_out,
+            "errors": self.__errors,
+            "problems": self.__problems,
+            "products": products,
+            "products_per_hour": round(products / run_time * 3600, 2) if run_time > 0 else 0,
+            "lines": lines,
+            "cycle_times": self.__cycle_times.get_stats(),
+            "recorded_cycle_times": self.__recorded_cycle_times.get_stats(),
+            "loop_ms": {key: round(value * 1000, 3) for key, value in get_percentiles(self.__loop_times).items()},
+            "loops": len(self.__loop_times),
+            "threads": {
+                "max": max(self.__thread_counts, default=0),
+                "mean": round(sum(self.__thread_counts) / len(self.__thread_counts), 2) if self.__thread_counts else 0
+            },
+            "messages": {"replayed": self.__next_msg, "updates": self.__updates, "published": self.__published},
+            "axes": get_axis_stats(),
+            "phases_ms": loop_profiler.get_summary(),
+            "wait_times": get_wait_stats()
+        }
@@ -0,0 +1,468 @@
+'''Thread safe ownership of the machines and routes (states) that are shared between the lines'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+import threading
+from collections import deque
+from enum import Enum
+from time import time
+
+from lib.logger import log
+from lib.machine import MainState, changes
+
+class Status(Enum):
+    NONE = 0
+    FREE = 1
+    RUNNING = 2
+    BLOCKED = 3
+    WAITING = 4
+    PROBLEM = 888
+    ERROR = 999
+
+# policies that choose the waiter that gets a freed machine, the first is the default
+ARBITRATION_POLICIES = ("fifo", "priority", "shortest_route")
+# waiters that waited longer (in seconds) get the machine first with every policy, so no line starves
+STARVATION_TIME = 60
+
+# states grouped by machine prefix for every State enum, {State: {prefix: [states]}}
+state_groups: "dict[type, dict[str, list]]" = {}
+
+def get_state_groups(states) -> "dict[str, list]":
+    '''Returns the states grouped by the machine prefix (GR2: [GR2, GR2_CB1_TO_CB3, ...]), the groups are only built once per State enum.
+
+    Args:
+        states (State): States from Subclass.
+    Returns:
+        dict: All states that belong to a machine with the machine prefix as key.
+    '''
+    groups = state_groups.get(states)
+    if groups == None:
+        groups = {}
+        for state in states:
+            groups.setdefault(state.name.split('_')[0], []).append(state)
+        state_groups[states] = groups
+    return groups
+
+# resource manager for every State enum, {State: ResourceManager}
+resource_managers: "dict[type, ResourceManager]" = {}
+resource_managers_lock = threading.Lock()
+
+def get_resource_manager(states) -> "ResourceManager":
+    '''Returns the ResourceManager of the given State enum, all lines of a factory share it.
+
+    Args:
+        states (State): States from Subclass.
+    Returns:
+        ResourceManager: Manager for the states.
+    '''
+    with resource_managers_lock:
+        manager = resource_managers.get(states)
+        if manager == None:
+            manager = ResourceManager(states)
+            resource_managers[states] = manager
+        return manager
+
+
+def get_wait_stats() -> "dict[str, dict]":
+    '''Returns the wait times of every line of every resource manager.
+
+    Returns:
+        dict: {line: statistics}, see ResourceManager.get_wait_stats().
+    '''
+    with resource_managers_lock:
+        managers = list(resource_managers.values())
+    stats = {}
+    for manager in managers:
+        stats.update(manager.get_wait_stats())
+    return stats
+
+
+class ResourceManager():
+    '''Holds status and owner of every state, all states of a machine (same prefix) are acquired and released together.
+    Every change is done under one lock, the lists in State.value are only written here and mirror [ID, Status, Used_by].
+    A freed machine is given to one waiter chosen by the arbitration policy, the other lines can't acquire it until that waiter took it.
+    '''
+    '''
+    Methodes:
+        get(): Returns status and owner of a state.
+        status(): Returns the status of a state.
+        owner(): Returns the owner of a state.
+        is_free(): Returns True if state is FREE (and not given to another waiter) or used by owner.
+        acquire(): Acquires a state for owner, if not possible owner is queued as waiter.
+        wait_for(): Queues owner as waiter for state.
+        set_status(): Sets the status of a state, the other states of the machine are blocked.
+        release_all(): Frees all states used by owner.
+        pop_woken(): Returns True if a state the owner waited for was freed.
+        cancel_wait(): Removes owner from all waiter queues.
+        pop_deadlocks(): Returns the wait-for cycles found since the last call.
+        set_policy(): Sets the arbitration policy.
+        set_rank(): Sets priority and remaining route of owner for the arbitration.
+        get_wait_stats(): Returns the wait times of every owner.
+        snapshot(): Returns status and owner of all states.
+    Attributes:
+        states (State): States that are managed.
+        groups (dict): States grouped by machine prefix.
+        policy (str): Arbitration policy, one of ARBITRATION_POLICIES.
+        __lock (RLock): Lock for every change.
+        __waiters (dict): Owners waiting for a machine, {prefix: deque}.
+        __woken (dict): Owners that were woken for a freed machine, {owner: prefix}, one owner per machine.
+        __deadlocks (list): Wait-for cycles that were not popped yet.
+        __ranks (dict): {owner: (priority, remaining route)} for the arbitration.
+        __waiting_since (dict): {owner: time} of the waiting owners.
+        __wait_times (dict): {owner: [count, total, max]} of the finished waits in seconds.
+        log (Logger): Log object to print to log.
+    '''
+
+    def __init__(self, states):
+        '''Initializes ResourceManager.
+
+        Args:
+            states (State): States that are managed.
+        '''
+        self.states = states
+        self.groups = get_state_groups(states)
+        self.policy = ARBITRATION_POLICIES[0]
+
+        self.__lock = threading.RLock()
+        self.__waiters: "dict[str, deque[str]]" = {prefix: deque() for prefix in self.groups}
+        self.__woken: "dict[str, str]" = {}
+        self.__deadlocks: "list[dict[str, str]]" = []
+        self.__ranks: "dict[str, tuple[int, int]]" = {}
+        self.__waiting_since: "dict[str, float]" = {}
+        self.__wait_times: "dict[str, list]" = {}
+
+        global log
+        self.log = log.getChild("Res")
+
+
+    def get(self, state) -> tuple:
+        '''Returns status and owner of a state.
+
+        Args:
+            state (State | str): State or name of the state.
+        Returns:
+            tuple: (Status, owner), owner is "None" if FREE.
+        '''
+        state = self.__get_state(state)
+        with self.__lock:
+            return state.value[1], state.value[2]
+
+
+    def status(self, state) -> Status:
+        '''Returns the status of a state.
+
+        Args:
+            state (State | str): State or name of the state.
+        '''
+        return self.get(state)[0]
+
+
+    def owner(self, state) -> str:
+        '''Returns the owner of a state, "None" if FREE.
+
+        Args:
+            state (State | str): State or name of the state.
+        '''
+        return self.get(state)[1]
+
+
+    def is_free(self, state, owner: str=None) -> bool:
+        '''Returns True if state is FREE or used by owner, a FREE machine that was given to another waiter is not free.
+
+        Args:
+            state (State | str): State or name of the state.
+            owner (str): Name of the line that asks.
+        '''
+        state = self.__get_state(state)
+        with self.__lock:
+            if state.value[2] == owner:
+                return True
+            return state.value[1] == Status.FREE and not self.__is_granted(state.name.split('_')[0], owner)
+
+
+    def acquire(self, state, owner: str, status: Status=Status.RUNNING) -> bool:
+        '''Acquires a state for owner, the other states of the machine are blocked. If not possible owner is queued as waiter.
+
+        Args:
+            state (State | str): State or name of the state.
+            owner (str): Name of the line that acquires.
+            status (Status): Status for the acquired state.
+        Returns:
+            bool: True if acquired, False if owner was queued.
+        '''
+        state = self.__get_state(state)
+        prefix = state.name.split('_')[0]
+        with self.__lock:
+            if (state.value[1] == Status.FREE and not self.__is_granted(prefix, owner)) or state.value[2] == owner:
+                self.__set_group(prefix, state.name, status, owner)
+                self.__remove_waiter(state, owner)
+                since = self.__waiting_since.pop(owner, None)
+                if since != None:
+                    self.__add_wait_time(owner, time() - since)
+                return True
+            self.__add_waiter(state, owner)
+            return False
+
+
+    def wait_for(self, state, owner: str):
+        '''Queues owner as waiter for state, if state is already free owner is woken directly.
+
+        Args:
+            state (State | str): State or name of the state.
+            owner (str): Name of the waiting line.
+        '''
+        state = self.__get_state(state)
+        prefix = state.name.split('_')[0]
+        with self.__lock:
+            if (state.value[1] == Status.FREE and not self.__is_granted(prefix, owner)) or state.value[2] == owner:
+                self.__woken[owner] = prefix
+            else:
+                self.__add_waiter(state, owner)
+
+
+    def set_status(self, state, status: Status, owner: str):
+        '''Sets the status of a state, the other states of the machine are blocked. FREE releases the machine and wakes its waiters.
+
+        Args:
+            state (State | str): State or name of the state, names that are no state are ignored.
+            status (Status): Status the state should be switched to.
+            owner (str): Name of the line.
+        '''
+        if isinstance(state, MainState):
+            return
+        name = state if type(state) == str else state.name
+        prefix = name.split('_')[0]
+        if prefix not in self.groups:
+            return
+        with self.__lock:
+            self.__set_group(prefix, name, status, owner)
+            if status == Status.FREE:
+                self.__wake(prefix)
+
+
+    def release_all(self, owner: str):
+        '''Frees all states used by owner and removes owner from all waiter queues.
+
+        Args:
+            owner (str): Name of the line.
+        '''
+        with self.__lock:
+            for group in self.groups.values():
+                for state in group:
+                    if state.value[2] == owner:
+                        self.set_status(state, Status.FREE, owner)
+                        break
+            self.cancel_wait(owner)
+
+
+    def pop_woken(self, owner: str) -> bool:
+        '''Returns True if a state the owner waited for was freed since the last call and given to owner.
+
+        Args:
+            owner (str): Name of the waiting line.
+        '''
+        with self.__lock:
+            if owner not in self.__woken:
+                # the woken line didn't take the machine (for example it ended), give it to the next waiter
+                prefix = next((prefix for prefix, waiters in self.__waiters.items() if owner in waiters), None)
+                if prefix != None and self.groups[prefix][0].value[1] == Status.FREE and not self.__is_granted(prefix, None):
+                    self.__wake(prefix)
+            return self.__woken.pop(owner, None) != None
+
+
+    def cancel_wait(self, owner: str):
+        '''Removes owner from all waiter queues.
+
+        Args:
+            owner (str): Name of the line.
+        '''
+        with self.__lock:
+            for waiters in self.__waiters.values():
+                if owner in waiters:
+                    waiters.remove(owner)
+            self.__waiting_since.pop(owner, None)
+            self.__pop_grant(owner)
+
+
+    def pop_deadlocks(self) -> "list[dict[str, str]]":
+        '''Returns the wait-for cycles found since the last call, every line in a cycle waits for a machine of the next line.
+
+        Returns:
+            list: Every cycle as {line: prefix of the machine it waits for}.
+        '''
+        with self.__lock:
+            deadlocks = self.__deadlocks
+            self.__deadlocks = []
+            return deadlocks
+
+
+    def set_policy(self, policy: str):
+        '''Sets the arbitration policy, unknown policies are used like "fifo".
+        "fifo": the line that waits longest, "priority": the line with the highest priority of the line config,
+        "shortest_route": the line with the fewest states left until its end. Lines that wait longer than STARVATION_TIME go first.
+
+        Args:
+            policy (str): One of ARBITRATION_POLICIES.
+        '''
+        if policy not in ARBITRATION_POLICIES:
+            self.log.warning("Unknown arbitration policy %s, possible are %s", policy, ARBITRATION_POLICIES)
+        self.log.info("Arbitration policy: %s", policy)
+        with self.__lock:
+            self.policy = policy
+
+
+    def set_rank(self, owner: str, priority: int, remaining: int):
+        '''Sets priority and remaining route of owner, used if owner waits for a machine.
+
+        Args:
+            owner (str): Name of the line.
+            priority (int): Priority of the line, the highest wins with the "priority" policy.
+            remaining (int): Number of states left until the end of the line, the fewest wins with the "shortest_route" policy.
+        '''
+        with self.__lock:
+            self.__ranks[owner] = (priority, remaining)
+
+
+    def get_wait_stats(self) -> "dict[str, dict]":
+        '''Returns the wait times of every owner that waited for a machine.
+
+        Returns:
+            dict: {owner: {"waits", "wait_mean", "wait_max", "wait_total", "waiting"}}, times in seconds, waiting is the current wait.
+        '''
+        with self.__lock:
+            now = time()
+            stats = {}
+            for owner in sorted(self.__wait_times.keys() | self.__waiting_since.keys()):
+                count, total, longest = self.__wait_times.get(owner, (0, 0.0, 0.0))
+                stats[owner] = {
+                    "waits": count,
+                    "wait_mean": round(total / count, 3) if count else 0,
+                    "wait_max": round(longest, 3),
+                    "wait_total": round(total, 3),
+                    "waiting": round(now - self.__waiting_since[owner], 3) if owner in self.__waiting_since else 0
+                }
+            return stats
+
+
+    def snapshot(self) -> "dict[str, list]":
+        '''Returns status and owner of all states.
+
+        Returns:
+            dict: {state name: [status name, owner]}
+        '''
+        with self.__lock:
+            return {state.name: [state.value[1].name, state.value[2]] for state in self.states}
+
+
+    def __set_group(self, prefix: str, name: str, status: Status, owner: str):
+        '''Sets the state name to status and blocks (or frees) the other states of the machine prefix, needs the lock.'''
+        name_tag = "None" if status == Status.FREE else owner
+        for group_state in self.groups[prefix]:
+            if group_state.name == name:
+                group_state.value[1] = status
+            else:
+                group_state.value[1] = Status.FREE if status == Status.FREE else Status.BLOCKED
+            group_state.value[2] = name_tag
+            changes.mark_state(group_state.name)
+        self.log.debug(f"{owner}: Switching status of: {name} to [{status}, {name_tag}]")
+
+
+    def __wake(self, prefix: str):
+        '''Wakes the waiter of the machine prefix that is chosen by the policy, needs the lock.'''
+        waiters = self.__waiters[prefix]
+        if waiters:
+            owner = self.__choose_waiter(waiters)
+            waiters.remove(owner)
+            self.__woken[owner] = prefix
+
+
+    def __choose_waiter(self, waiters: "deque[str]") -> str:
+        '''Returns the waiter that gets the machine, on a tie the one that waits longest, needs the lock.'''
+        now = time()
+        for owner in waiters:
+            if now - self.__waiting_since.get(owner, now) >= STARVATION_TIME:
+                return owner
+        if self.policy == "priority":
+            return max(waiters, key=lambda owner: self.__ranks.get(owner, (0, 0))[0])
+        if self.policy == "shortest_route":
+            return min(waiters, key=lambda owner: self.__ranks.get(owner, (0, 0))[1])
+        return waiters[0]
+
+
+    def __pop_grant(self, owner: str):
+        '''Removes the wake up of owner, the next waiter is woken if the machine is still free, needs the lock.'''
+        prefix = self.__woken.pop(owner, None)
+        if prefix != None and self.groups[prefix][0].value[1] == Status.FREE:
+            self.__wake(prefix)
+
+
+    def __add_wait_time(self, owner: str, wait_time: float):
+        '''Adds a finished wait of owner to the wait times, needs the lock.'''
+        times = self.__wait_times.setdefault(owner, [0, 0.0, 0.0])
+        times[0] += 1
+        times[1] += wait_time
+        times[2] = max(times[2], wait_time)
+
+
+    def __add_waiter(self, state, owner: str):
+        '''Queues owner as waiter for the machine of state, needs the lock.'''
+        waiters = self.__waiters[state.name.split('_')[0]]
+        if owner not in waiters:
+            waiters.append(owner)
+            self.__waiting_since.setdefault(owner, time())
+            # only a new wait-for edge can close a cycle, so it is enough to search from owner
+            cycle = self.__find_cycle(owner)
+            if cycle != None:
+                self.log.error("Deadlock, waiting for: %s", cycle)
+                self.__deadlocks.append(cycle)
+                changes.wake()
+
+
+    def __remove_waiter(self, state, owner: str):
+        '''Removes owner from the waiters of the machine of state, needs the lock.'''
+        waiters = self.__waiters[state.name.split('_')[0]]
+        if owner in waiters:
+            waiters.remove(owner)
+        self.__pop_grant(owner)
+
+
+    def __is_granted(self, prefix: str, owner: str) -> bool:
+        '''Returns True if another line than owner was woken for the machine prefix and didn't take it yet, needs the lock.'''
+        for woken_owner, woken_prefix in self.__woken.items():
+            if woken_prefix == prefix and woken_owner != owner:
+                return True
+        return False
+
+
+    def __find_cycle(self, owner: str) -> "dict[str, str]":
+        '''Follows the wait-for graph (waiter -> used_by of the machine) from owner, needs the lock.
+
+        Returns:
+            dict: {line: prefix of the machine it waits for} of the cycle back to owner, None if there is none.
+        '''
+        cycle = {}
+        line = owner
+        while line not in cycle:
+            prefix = next((prefix for prefix, waiters in self.__waiters.items() if line in waiters), None)
+            if prefix == None:
+                return None
+            cycle[line] = prefix
+            line = self.groups[prefix][0].value[2]
+        # a cycle without owner was found before
+        return cycle if line == owner else None
+
+
+    def __get_state(self, state):
+        '''Returns the State for a State or a state name.'''
+        if type(state) == str:
+            return self.states[state]
+        return state
+
+
+class DeadlockError(RuntimeError):
+    '''Lines wait for each other's machines in a cycle.'''
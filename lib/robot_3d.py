@@ -7,12 +7,11 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.02.02"
 
-import threading
 from enum import Enum
 from time import sleep
 
 from lib.logger import log
-from lib.machine import Machine, MainState
+from lib.machine import Machine, MainState, submit
 from lib.sensor import Sensor
 from lib.actuator import Actuator, EncoderOverflowError, SensorTimeoutError
 
@@ -59,13 +58,18 @@ class Robot3D(Machine):
     Methodes:
         init(): Move to init position.
         move_to_position(): Moves to given position.
+        __move_overlapped(): Moves to given position over the moving position, the axes start as soon as it is save.
+        __is_in_safe_zone(): Checks if all axes with a moving position are in their safe zone.
         move_all_axes(): Makes linear move to give position.
+        __move_axis(): Starts the move of one axis as thread.
     Attributes:
         __MOVE_THRESHOLD_ROT (int): Only moves the rotation axis if movement is more.
         __MOVE_THRESHOLD_HOR (int): Only moves the horizontal axis if movement is more.
         __MOVE_THRESHOLD_VER (int): Only moves the vertical axis if movement is more.
         __MAX_PICKUP_TRIES (int): Max tries the robot can use to pickup a product.
+        __OVERLAP_MOVES (bool): If True the phases of a move overlap, if False each phase waits for the last one.
         __moving_position (Position): Position where the axes should be to allow save moving.
+        safe_zone (Position): Range above the moving position of every axis, in which the axis counts as at the moving position.
         __encoder_rot (Sensor): Encoder for rotation axis.
         __encoder_hor (Sensor): Encoder for horizontal axis.
         __encoder_ver (Sensor): Encoder for vertical axis.
@@ -80,6 +84,7 @@ class Robot3D(Machine):
     __MOVE_THRESHOLD_HOR = 40
     __MOVE_THRESHOLD_VER = 40
     __MAX_PICKUP_TRIES = 3
+    __OVERLAP_MOVES = True
 
     def __init__(self, revpi, name: str, line_name: str, moving_position: Position, move_threshold_rot: int = 40):
         '''Initializes the 3D Robot
@@ -116,14 +121,18 @@ class Robot3D(Machine):
         pwm_ver = None
 
         # get motors
-        self.__motor_rot = Actuator(self.revpi, self.name, self.line_name, pwm=pwm_rot, type="rotation")
+        # rotation and vg horizontal ramp the pwm down if the factory config enables it
+        self.__motor_rot = Actuator(self.revpi, self.name, self.line_name, pwm=pwm_rot, type="rotation", pwm_ramp=True)
         if self.name[:2] == "VG":
             # change pwm value for vg
-            self.__motor_hor = Actuator(self.revpi, self.name, self.line_name, pwm=pwm_hor, pwm_slow_value=30, type="horizontal")
+            self.__motor_hor = Actuator(self.revpi, self.name, self.line_name, pwm=pwm_hor, pwm_slow_value=30, type="horizontal", pwm_ramp=True)
         else:
             self.__motor_hor = Actuator(self.revpi, self.name, self.line_name, pwm=pwm_hor, type="horizontal")
         self.__motor_ver = Actuator(self.revpi, self.name, self.line_name, pwm=pwm_ver, type="vertical")
 
+        # an axis stops inside its move threshold, so it counts as at the moving position inside of it
+        self.safe_zone = Position(self.__move_threshold_rot, self.__MOVE_THRESHOLD_HOR, self.__MOVE_THRESHOLD_VER)
+
 
     def init(self, to_end=False, as_thread=True):
         '''Move to init position.
@@ -133,8 +142,7 @@ class Robot3D(Machine):
         '''
         # call this function again as a thread
         if as_thread:
-            self.thread = threading.Thread(target=self.init, args=(to_end, False), name=self.name + "_INIT")
-            self.thread.start()
+            self.thread = submit(self.name + "_INIT", self.init, to_end, False)
             return
 
         self.switch_state(State.INIT)
@@ -151,7 +159,7 @@ class Robot3D(Machine):
             if to_end:
                 self.switch_state(MainState.END)
             else:
-                self.log.warning(f"{self.name}: Initialized")
+                self.log.warning("%s: Initialized", self.name)
                 self.position += 1
 
 
@@ -165,8 +173,7 @@ class Robot3D(Machine):
         '''
         # call this function again as a thread
         if as_thread:
-            self.thread = threading.Thread(target=self.get_product, args=(vertical_position, sensor, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.get_product, vertical_position, sensor, False)
             return
         try: 
             self.switch_state(State.GET_PRODUCT)
@@ -229,19 +236,21 @@ class Robot3D(Machine):
         '''
         # call this function again as a thread
         if as_thread:
-            self.thread = threading.Thread(target=self.move_to_position, args=(position, ignore_moving_pos, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.move_to_position, position, ignore_moving_pos, False)
             return
 
         
-        end_position = position
-        self.log.warning(f"{self.name} :Moving to Position: {end_position}")
+        # position is changed while moving, the log is formatted later
+        end_position = Position(position.rotation, position.horizontal, position.vertical)
+        self.log.warning("%s :Moving to Position: %s", self.name, end_position)
 
         # ignore moving position if rotation and one other axis doesn't move
         if position.rotation == -1 and (position.horizontal == -1 or position.vertical == -1):
             ignore_moving_pos = True
         try:
-            if not ignore_moving_pos:
+            if not ignore_moving_pos and self.__OVERLAP_MOVES:
+                self.__move_overlapped(position)
+            elif not ignore_moving_pos:
                 # move to moving position
                 self.switch_state(State.TO_MOVING_POS)
                 if self.__encoder_ver.get_current_value() <= self.__moving_position.vertical:
@@ -272,21 +281,28 @@ class Robot3D(Machine):
                     vertical = -1
                 self.__move_all_axes(Position(rotation, horizontal, vertical))
 
-            # move to destination
-            self.switch_state(State.TO_DESTINATION)
-            self.__move_all_axes(position)
+                # move to destination
+                self.switch_state(State.TO_DESTINATION)
+                self.__move_all_axes(position)
+            else:
+                # move to destination
+                self.switch_state(State.TO_DESTINATION)
+                self.__move_all_axes(position)
         
         except (SensorTimeoutError, ValueError, EncoderOverflowError) as error:
             self.problem_handler(error)
         except Exception as error:
             self.error_handler(error)
         else:
-            self.log.warning(f"{self.name} :Position reached: {end_position}")
+            self.log.warning("%s :Position reached: %s", self.name, end_position)
             self.position += 1
 
 
-    def __move_all_axes(self, position: Position):
-        '''Makes linear move to given position, set a axis to -1 to not move that axis.
+    def __move_overlapped(self, position: Position):
+        '''Moves to given position over the moving position, the phases of the move overlap:
+        Axes with a moving position move to it, or directly to the position if it is above the moving position.
+        Axes without a moving position start as soon as every other axis is in its safe zone.
+        Axes below the moving position start as soon as their own move is done and the other axes have stopped.
 
         Args:
             position (Position): to move to (rotation, horizontal, vertical): int.
@@ -295,37 +311,122 @@ class Robot3D(Machine):
             ValueError: Counter jumped values.
             EncoderOverflowError: Encoder hat overflow, because value went lower than 0.
         '''
-        self.log.info(f"{self.name} :Moving axes to: {position}")
+        axes = ("rotation", "horizontal", "vertical")
+        motors = {"rotation": self.__motor_rot, "horizontal": self.__motor_hor, "vertical": self.__motor_ver}
+        safe_axes = [axis for axis in axes if getattr(self.__moving_position, axis) != -1]
+        free_axes = [axis for axis in axes if axis not in safe_axes]
+        # axes that go below the moving position after the other axes have stopped
+        dest_axes = []
+
+        self.switch_state(State.TO_MOVING_POS)
+        # if robot is higher than moving position rotate directly
+        is_safe = self.__moving_position.vertical != -1 and self.__encoder_ver.get_current_value() <= self.__moving_position.vertical
+        for axis in safe_axes:
+            value = getattr(position, axis)
+            moving_value = getattr(self.__moving_position, axis)
+            # moving past the moving position upwards is save, so go there directly
+            if value != -1 and value < moving_value:
+                self.__move_axis(axis, value)
+            else:
+                self.__move_axis(axis, moving_value)
+                if value != -1:
+                    dest_axes.append(axis)
+
+        # wait until the axes are in their safe zone or have stopped outside of it
+        while not is_safe and not self.__is_in_safe_zone():
+            if all(motors[axis].is_done() for axis in safe_axes):
+                for axis in safe_axes:
+                    motors[axis].join()
+                break
+            sleep(Sensor.CYCLE_TIME)
+
+        self.switch_state(State.MOVING)
+        for axis in free_axes:
+            self.__move_axis(axis, getattr(position, axis))
+
+        # start the moves below the moving position after the other axes have stopped
+        if dest_axes:
+            for axis in free_axes:
+                motors[axis].join()
+            self.switch_state(State.TO_DESTINATION)
+        while dest_axes:
+            for axis in dest_axes:
+                if motors[axis].is_done():
+                    motors[axis].join()
+                    self.__move_axis(axis, getattr(position, axis))
+                    dest_axes.remove(axis)
+                    break
+            else:
+                sleep(Sensor.CYCLE_TIME)
+
+        # wait for end of each move
+        for axis in axes:
+            motors[axis].join()
+
 
-        # get current position
+    def __is_in_safe_zone(self) -> bool:
+        '''Checks if all axes with a moving position are in their safe zone.
+
+        Returns:
+            bool: True if every axis is above its moving position plus its safe zone.
+        '''
         current_position = Position(
             self.__encoder_rot.get_current_value(),
             self.__encoder_hor.get_current_value(),
             self.__encoder_ver.get_current_value()
         )
+        for axis in ("rotation", "horizontal", "vertical"):
+            moving_value = getattr(self.__moving_position, axis)
+            if moving_value != -1 and getattr(current_position, axis) > moving_value + getattr(self.safe_zone, axis):
+                return False
+        return True
+
 
-        # get motor directions
-        dir_rot = "CCW"
-        dir_hor = "FWD"
-        dir_ver = "DOWN"
-        if position.rotation <= current_position.rotation:
-            dir_rot = "CW"
-        if position.horizontal <= current_position.horizontal:
-            dir_hor = "BWD"
-        if position.vertical <= current_position.vertical:
-            dir_ver = "UP"
+    def __move_all_axes(self, position: Position):
+        '''Makes linear move to given position, set a axis to -1 to not move that axis.
+
+        Args:
+            position (Position): to move to (rotation, horizontal, vertical): int.
+        Raises:
+            SensorTimeoutError: Timeout is reached (no detection happened).
+            ValueError: Counter jumped values.
+            EncoderOverflowError: Encoder hat overflow, because value went lower than 0.
+        '''
+        self.log.info("%s :Moving axes to: %s", self.name, position)
 
         # move to position
-        self.__motor_rot.move_axis(dir_rot, position.rotation, current_position.rotation, self.__move_threshold_rot, self.__encoder_rot, self.name + "_REF_SW_ROTATION", timeout_in_s=20, as_thread=True)
-        self.__motor_hor.move_axis(dir_hor, position.horizontal, current_position.horizontal, self.__MOVE_THRESHOLD_HOR, self.__encoder_hor, self.name + "_REF_SW_HORIZONTAL", as_thread=True)
-        self.__motor_ver.move_axis(dir_ver, position.vertical, current_position.vertical, self.__MOVE_THRESHOLD_VER, self.__encoder_ver, self.name + "_REF_SW_VERTICAL", timeout_in_s=15, as_thread=True)
+        self.__move_axis("rotation", position.rotation)
+        self.__move_axis("horizontal", position.horizontal)
+        self.__move_axis("vertical", position.vertical)
 
         # wait for end of each move
         self.__motor_rot.join()
         self.__motor_hor.join()
         self.__motor_ver.join()
 
-        self.log.info(f"{self.name} :Axes moved to: {position}")
+        self.log.info("%s :Axes moved to: %s", self.name, position)
+
+
+    def __move_axis(self, axis: str, value: int):
+        '''Starts the move of one axis as thread, join the motor to wait for the end of the move.
+
+        Args:
+            axis (str): Name of the axis (rotation, horizontal, vertical).
+            value (int): Encoder value to move to, -1 to not move the axis.
+        '''
+        if axis == "rotation":
+            current_value = self.__encoder_rot.get_current_value()
+            # get motor direction
+            direction = "CW" if value <= current_value else "CCW"
+            self.__motor_rot.move_axis(direction, value, current_value, self.__move_threshold_rot, self.__encoder_rot, self.name + "_REF_SW_ROTATION", timeout_in_s=20, as_thread=True)
+        elif axis == "horizontal":
+            current_value = self.__encoder_hor.get_current_value()
+            direction = "BWD" if value <= current_value else "FWD"
+            self.__motor_hor.move_axis(direction, value, current_value, self.__MOVE_THRESHOLD_HOR, self.__encoder_hor, self.name + "_REF_SW_HORIZONTAL", as_thread=True)
+        else:
+            current_value = self.__encoder_ver.get_current_value()
+            direction = "UP" if value <= current_value else "DOWN"
+            self.__motor_ver.move_axis(direction, value, current_value, self.__MOVE_THRESHOLD_VER, self.__encoder_ver, self.name + "_REF_SW_VERTICAL", timeout_in_s=15, as_thread=True)
 
 
     def grip(self, as_thread=True):
@@ -0,0 +1,153 @@
+'''This module holds the route graph of a line: the run function of every state and the transitions to the next states'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+from lib.machine import MainState
+
+def with_option(option: str):
+    '''Returns a guard that allows the transition if the option is set in the line config.
+
+    Args:
+        option (str): Name of the option (for example with_PM).
+    Returns:
+        function: Guard for a Transition.
+    '''
+    return lambda config: bool(config.get(option))
+
+
+def ends_at(state):
+    '''Returns a guard that allows the transition if the line ends at state.
+
+    Args:
+        state (State): End state of the line.
+    Returns:
+        function: Guard for a Transition.
+    '''
+    return lambda config: config.get("end_at") == state
+
+
+class Transition():
+    '''Transition to the next state, only used if the guard allows it for the line config.'''
+    '''
+    Methodes:
+        is_allowed(): Returns True if the transition is allowed for the line config.
+    Attributes:
+        target (State): Next state.
+        guard (function): Returns True for the line configs that use the transition, None for every config.
+    '''
+
+    def __init__(self, target, guard=None):
+        '''Initializes Transition.
+
+        Args:
+            target (State): Next state.
+            guard (function): Returns True for the line configs that use the transition, None for every config.
+        '''
+        self.target = target
+        self.guard = guard
+
+
+    def is_allowed(self, config: dict) -> bool:
+        '''Returns True if the transition is allowed for the line config.
+
+        Args:
+            config (dict): Config of the line.
+        Returns:
+            bool: True if there is no guard or the guard returns True.
+        '''
+        return self.guard == None or self.guard(config)
+
+
+class Route():
+    '''Run function of a state and the transitions to the next states, the first allowed transition is used.'''
+    '''
+    Attributes:
+        run (str): Name of the method of the line that runs the state, returns True if the state is done.
+        transitions (tuple): Transitions to the next states.
+    '''
+
+    def __init__(self, run: str, *transitions):
+        '''Initializes Route.
+
+        Args:
+            run (str): Name of the method of the line that runs the state, returns True if the state is done.
+            *transitions (Transition | State): Transitions to the next states in order, a state is a transition without guard.
+        '''
+        self.run = run
+        self.transitions = tuple(transition if isinstance(transition, Transition) else Transition(transition) for transition in transitions)
+
+
+class RouteGraph():
+    '''States of a line with their run functions and transitions, the route of a state is looked up in a dict.'''
+    '''
+    Methodes:
+        get_route(): Returns the route of a state.
+        get_next_state(): Returns the next state for the line config.
+        get_path(): Returns the states a line config passes.
+    Attributes:
+        __routes (dict): {state: Route}.
+    '''
+
+    def __init__(self, routes: dict):
+        '''Initializes RouteGraph.
+
+        Args:
+            routes (dict): {state: Route} of every state the line can be in.
+        '''
+        self.__routes: "dict[object, Route]" = routes
+
+
+    def get_route(self, state) -> Route:
+        '''Returns the route of a state.
+
+        Args:
+            state (State | MainState): Current state of the line.
+        Returns:
+            Route: Route of the state, None if the state has no route.
+        '''
+        return self.__routes.get(state)
+
+
+    def get_next_state(self, state, config: dict):
+        '''Returns the next state for the line config.
+
+        Args:
+            state (State | MainState): Current state of the line.
+            config (dict): Config of the line.
+        Returns:
+            State | MainState: Target of the first allowed transition, None if there is none.
+        '''
+        route = self.__routes.get(state)
+        if route == None:
+            return None
+        for transition in route.transitions:
+            if transition.is_allowed(config):
+                return transition.target
+        return None
+
+
+    def get_path(self, config: dict, start=None) -> list:
+        '''Returns the states a line config passes, the line ends after end_at like MainLine.switch_state().
+
+        Args:
+            config (dict): Config of the line with converted states.
+            start (State | MainState): State to start from, start_at of the config if None.
+        Returns:
+            list: States from start to MainState.END, without END if the route ends before.
+        '''
+        state = config["start_at"] if start == None else start
+        path = []
+        while state != None and state not in path:
+            path.append(state)
+            if state == MainState.END:
+                break
+            if state == config["end_at"] and not isinstance(state, MainState):
+                path.append(MainState.END)
+                break
+            state = self.get_next_state(state, config)
+        return path
@@ -7,13 +7,118 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2023.09.21"
 
+import threading
 import time
+from collections import deque
 from enum import Enum
-from revpimodio2 import RevPiModIO, BOTH
+from weakref import WeakKeyDictionary
+from revpimodio2 import RevPiModIO, BOTH, RISING, FALLING
 
 from lib.logger import log
+from lib.telemetry import AxisRecorder
+
+# resolved IO objects for every RevPiModIO, {revpi: {name: IO}}
+io_handles: "WeakKeyDictionary[RevPiModIO, dict]" = WeakKeyDictionary()
+# edge counters for every RevPiModIO, {revpi: {name: EdgeCounter}}
+edge_counters: "WeakKeyDictionary[RevPiModIO, dict]" = WeakKeyDictionary()
+edge_counters_lock = threading.Lock()
+
+def get_io(revpi: RevPiModIO, name: str):
+    '''Returns the IO object of the given name, the lookup in revpi.io is only done once per RevPiModIO.
+
+    Args:
+        revpi (RevPiModIO): RevPiModIO Object to control the motors and sensors.
+        name (str): Exact name of the IO in PiCtory.
+    Returns:
+        IO object from revpi.io.
+    '''
+    handles = io_handles.get(revpi)
+    if handles == None:
+        handles = io_handles.setdefault(revpi, {})
+    io = handles.get(name)
+    if io == None:
+        io = revpi.io[name]
+        handles[name] = io
+    return io
+
+def get_edge_counter(revpi: RevPiModIO, name: str) -> "EdgeCounter":
+    '''Returns the EdgeCounter of the given IO, the event for the counter is only registered once per RevPiModIO.
+
+    Args:
+        revpi (RevPiModIO): RevPiModIO Object to control the motors and sensors.
+        name (str): Exact name of the IO in PiCtory.
+    Returns:
+        EdgeCounter: Edge counter of the IO.
+    '''
+    counter = edge_counters.get(revpi, {}).get(name)
+    if counter != None:
+        return counter
+    with edge_counters_lock:
+        counters = edge_counters.setdefault(revpi, {})
+        counter = counters.get(name)
+        if counter == None:
+            counter = EdgeCounter()
+            get_io(revpi, name).reg_event(counter.on_edge, edge=BOTH)
+            counters[name] = counter
+    return counter
+
+
+class EdgeCounter():
+    '''Counts the edges of one IO with timestamps.
+    Only the revpimodio2 event callback writes to it, so reading needs no lock.
+    '''
+    '''
+    Methodes:
+        on_edge(): Event callback, saves the edge.
+        count_since(): Returns the number of edges since given time.
+    Attributes:
+        MAX_EDGES (int): Number of timestamps kept per edge.
+        rising (deque): Timestamps of the rising edges.
+        falling (deque): Timestamps of the falling edges.
+        count (int): Number of all edges since creation.
+    '''
+    MAX_EDGES = 100
+
+    def __init__(self):
+        '''Initializes EdgeCounter.'''
+        self.rising: "deque[float]" = deque(maxlen=self.MAX_EDGES)
+        self.falling: "deque[float]" = deque(maxlen=self.MAX_EDGES)
+        self.count = 0
+
+
+    def on_edge(self, io_name, value):
+        '''Event callback, saves the time of the edge.'''
+        (self.rising if value else self.falling).append(time.time())
+        self.count += 1
+        log.debug("%s :Edge %s", io_name, 'rising' if value else 'falling')
+
+
+    def count_since(self, since: float, edge=BOTH) -> int:
+        '''Returns the number of edges since given time.
+
+        Args:
+            since (float): Time (time.time()) from which the edges are counted.
+            edge: edge to count, can be BOTH, RISING, FALLING (from revpimodio2).
+        Returns:
+            int: Number of edges.
+        '''
+        count = 0
+        if edge != FALLING:
+            count += self.__count(self.rising, since)
+        if edge != RISING:
+            count += self.__count(self.falling, since)
+        return count
+
+
+    def __count(self, timestamps: "deque[float]", since: float) -> int:
+        '''Counts the timestamps newer than since, from the newest backwards.'''
+        count = 0
+        for timestamp in reversed(tuple(timestamps)):
+            if timestamp < since:
+                break
+            count += 1
+        return count
 
-detection = False
 
 class SensorType(Enum):
     LIGHT_BARRIER = 0
@@ -29,19 +134,27 @@ class Sensor():
         start_monitor(): Start monitoring sensor for detection.
         remove_monitor(): Stop monitoring sensor.
         is_detected(): Returns True if product was detected. If True removes monitor.
+        get_edges_since(): Returns the number of edges at the sensor since given time.
         wait_for_detect(): Waits for detection at sensor.
         wait_for_encoder(): Waits for the encoder/counter to reach the trigger_value.
+        __wait_for_encoder_event(): Waits for the encoder with events of the revpimodio2 mainloop.
         reset_encoder(): Resets the encoder or counter to 0.
     Attributes:
         CYCLE_TIME (int): how often encoder/counter ar checked for new values.
+        EVENT_DRIVEN (bool): If True encoders are checked in the revpimodio2 mainloop instead of polling, needs a running mainloop.
+        EVENT_FALLBACK_TIME (int): Max time between checks if no event arrives in event driven mode.
         __revpi (RevPiModIO): RevPiModIO Object to control the motors and sensors.
+        __io (IO): Cached IO object of the sensor.
         name (str): Exact name of the sensor in PiCtory.
         line_name (str): Name of current line.
         type (SensorType): Type of the sensor.
         counter_offset (int): Offset for counter so that counter can be used like encoder.
+        __monitor_start (float): Time the monitoring started, None if not monitoring.
         log (Logger): Log object to print to log.
     '''
     CYCLE_TIME = 0.005 # s
+    EVENT_DRIVEN = False
+    EVENT_FALLBACK_TIME = 0.1 # s
 
 
     def __init__(self, revpi: RevPiModIO, name: str, line_name: str, type: SensorType=None):
@@ -54,11 +167,13 @@ class Sensor():
             type (SensorType): Type of the sensor, if empty type is determined from name.
         '''
         self.__revpi = revpi
+        self.__io = get_io(revpi, name)
         self.name = name
         self.line_name = line_name
         self.type = type
 
         self.counter_offset = 0
+        self.__monitor_start: float = None
 
         if type == None:
             if self.name.find("SENS") != -1:
@@ -73,11 +188,11 @@ class Sensor():
         global log
         self.log = log.getChild(f"{self.line_name}(Sens)")
 
-        self.log.debug(f"Created Sensor({self.type.name}): {self.name}")
+        self.log.debug("Created Sensor(%s): %s", self.type.name, self.name)
 
 
     def __del__(self):
-        self.log.debug(f"Destroyed {type(self).__name__}({self.type.name}): {self.name}")
+        self.log.debug("Destroyed %s(%s): %s", type(self).__name__, self.type.name, self.name)
 
 
     def get_current_value(self, with_log=False):
@@ -92,20 +207,20 @@ class Sensor():
             Int value of ENCODER or COUNTER.
         '''
         if self.type == SensorType.ENCODER:
-            value = self.__revpi.io[self.name].value
+            value = self.__io.value
         
         elif self.type == SensorType.COUNTER:
-            value = self.__revpi.io[self.name].value - self.counter_offset
+            value = self.__io.value - self.counter_offset
         
         elif self.type == SensorType.LIGHT_BARRIER:
-            value = not self.__revpi.io[self.name].value
+            value = not self.__io.value
         
         else:
             # self.type == SensorType.REF_SWITCH
-            value = self.__revpi.io[self.name].value
+            value = self.__io.value
 
         if with_log:
-            self.log.debug(f"Got {self.name}({self.type.name}) value: {value}")
+            self.log.debug("Got %s(%s) value: %s", self.name, self.type.name, value)
         return value
 
 
@@ -115,10 +230,11 @@ class Sensor():
         Args:
             edge: trigger edge of the sensor, can be BOTH, RAISING, FALLING (from revpimodio2).
         '''
-        try:
-            self.__revpi.io[self.name].reg_event(event_det_at_sensor, edge=edge)
-        except RuntimeError:
-            self.log.debug(f"{self.name} already monitoring")
+        if self.__monitor_start != None:
+            self.log.debug("%s already monitoring", self.name)
+            return
+        get_edge_counter(self.__revpi, self.name)
+        self.__monitor_start = time.time()
 
 
     def remove_monitor(self, edge=BOTH):
@@ -127,9 +243,7 @@ class Sensor():
         Args:
             edge: trigger edge of the sensor, can be BOTH, RAISING, FALLING (from revpimodio2).
         '''
-        self.__revpi.io[self.name].unreg_event(event_det_at_sensor, edge=edge)
-        global detection
-        detection = False
+        self.__monitor_start = None
 
 
     def is_detected(self, edge=BOTH) -> bool:
@@ -140,13 +254,28 @@ class Sensor():
         Returns:
             True if product was detected, else false.
         '''
-        if detection:
+        if self.__monitor_start == None:
+            return False
+        if self.get_edges_since(self.__monitor_start, edge) > 0:
+            self.log.info("%s :Detection", self.name)
             self.remove_monitor(edge)
             return True
         else:
             return False
 
 
+    def get_edges_since(self, since: float, edge=BOTH) -> int:
+        '''Returns the number of edges at the sensor since given time, edges are only counted after the first monitor of the sensor.
+
+        Args:
+            since (float): Time (time.time()) from which the edges are counted.
+            edge: edge to count, can be BOTH, RAISING, FALLING (from revpimodio2).
+        Returns:
+            int: Number of edges.
+        '''
+        return get_edge_counter(self.__revpi, self.name).count_since(since, edge)
+
+
     def wait_for_detect(self, edge=BOTH, timeout_in_s=10):
         '''Waits for detection at sensor.
         
@@ -157,23 +286,25 @@ class Sensor():
             SensorTimeoutError: Timeout is reached (no detection happened)
         '''
         if self.get_current_value() == True:
-            self.log.info(f"{self.name} already detected")
+            self.log.info("%s already detected", self.name)
             return
 
-        if self.__revpi.io[self.name].wait(edge=edge, timeout=timeout_in_s*1000) == False:
+        if self.__io.wait(edge=edge, timeout=timeout_in_s*1000) == False:
             # sensor detected product
-            self.log.info(f"{self.name} detection") 
+            self.log.info("%s detection", self.name) 
         else:
             raise(SensorTimeoutError(f"{self.name} no detection in time"))
 
 
-    def wait_for_encoder(self, trigger_value: int, trigger_threshold: int, timeout_in_s=10) -> int:
+    def wait_for_encoder(self, trigger_value: int, trigger_threshold: int, timeout_in_s=10, event_driven: bool=None, recorder: AxisRecorder=None) -> int:
         '''Waits for the encoder/counter to reach the trigger_value.
         
         Args:
             trigger_value (int): The value the motor would end up if it started from reverence switch.
             trigger_threshold (int):  The value around the trigger_value where a trigger can happen.
             timeout_in_s (int): Time after which an exception is raised.
+            event_driven (bool): Use events instead of polling (only for ENCODER), defaults to EVENT_DRIVEN.
+            recorder (AxisRecorder): Records every checked value of the encoder.
         Returns:
             Reached encoder_value
         Raises:
@@ -184,12 +315,19 @@ class Sensor():
         old_value = self.get_current_value()
         if old_value > 10000:
             raise(EncoderOverflowError(f"{self.name} :Encoder had overflow"))
+
+        if event_driven == None:
+            event_driven = self.EVENT_DRIVEN
+        if event_driven and self.type == SensorType.ENCODER:
+            return self.__wait_for_encoder_event(trigger_value, trigger_threshold, timeout_in_s, old_value, recorder)
         
         start_time = time.time()
         lower = True if trigger_value < old_value else False
 
         while (time.time() <= start_time + timeout_in_s):
             new_value = self.get_current_value()
+            if recorder:
+                recorder.record(new_value)
 
             if self.type == SensorType.COUNTER:
                 # Handles counters, because they don't know the direction of the motor an offset is added if the motor is running backwards. This allows the use of counters as encoders
@@ -208,7 +346,7 @@ class Sensor():
 
             if abs(new_value - trigger_value) <= trigger_threshold:
 
-                self.log.info(f"{self.name} Value reached {new_value}")
+                self.log.info("%s Value reached %s", self.name, new_value)
                 return self.get_current_value() 
             
             # wait for next cycle
@@ -217,6 +355,72 @@ class Sensor():
         raise(SensorTimeoutError(f"{self.name} :Value {trigger_value} not reached in time"))
 
 
+    def __wait_for_encoder_event(self, trigger_value: int, trigger_threshold: int, timeout_in_s: int, start_value: int, recorder: AxisRecorder=None) -> int:
+        '''Waits for the encoder to reach the trigger_value, the value is checked on every value change in the revpimodio2 mainloop.
+        If the band around the trigger_value will be reached before the next cycle, the time is predicted from the current speed.
+
+        Args:
+            trigger_value (int): The value the motor would end up if it started from reverence switch.
+            trigger_threshold (int):  The value around the trigger_value where a trigger can happen.
+            timeout_in_s (int): Time after which an exception is raised.
+            start_value (int): Encoder value at the start of the wait.
+            recorder (AxisRecorder): Records every checked value of the encoder.
+        Returns:
+            Reached encoder_value
+        Raises:
+            SensorTimeoutError: Timeout is reached (no detection happened).
+        '''
+        if abs(start_value - trigger_value) <= trigger_threshold:
+            self.log.info("%s Value reached %s", self.name, start_value)
+            return start_value
+
+        reached = threading.Event()
+        lower = True if trigger_value < start_value else False
+        cycle_time = self.__revpi.cycletime / 1000
+        # [last value, time of last value change, predicted time to stop], the time is unknown until the first change
+        values = [start_value, None, 0]
+
+        def on_change(_io_name, value, predict=True):
+            now = time.time()
+            if recorder:
+                recorder.record(value)
+            # remaining distance to the trigger_value, negative if trigger_value was passed
+            distance = value - trigger_value if lower else trigger_value - value
+            if distance <= trigger_threshold:
+                # band reached or jumped over
+                reached.set()
+                return
+            if not predict:
+                return
+            # the wait can start at any time of a cycle, the speed is only known between two changes
+            speed = abs(value - values[0]) / (now - values[1]) if values[1] != None and now > values[1] else 0
+            values[0] = value
+            values[1] = now
+            if speed > 0 and (distance - trigger_threshold) / speed < cycle_time:
+                # band is reached before the next cycle
+                values[2] = now + (distance - trigger_threshold) / speed
+                reached.set()
+
+        end_time = time.time() + timeout_in_s
+        self.__io.reg_event(on_change, edge=BOTH)
+        try:
+            while not reached.wait(min(self.EVENT_FALLBACK_TIME, max(end_time - time.time(), 0))):
+                if time.time() > end_time:
+                    raise(SensorTimeoutError(f"{self.name} :Value {trigger_value} not reached in time"))
+                # check value if there where no events
+                on_change(self.name, self.get_current_value(), predict=False)
+        finally:
+            self.__io.unreg_event(on_change, edge=BOTH)
+
+        # wait for predicted time
+        if values[2] > time.time():
+            time.sleep(values[2] - time.time())
+
+        value = self.get_current_value()
+        self.log.info("%s Value reached %s", self.name, value)
+        return value
+
+
     def reset_encoder(self):
         '''Resets the encoder or counter to 0.
         
@@ -224,23 +428,16 @@ class Sensor():
             TimeoutError: Encoder/counter could not be reset in time")
         '''
         for i in range(30):
-            self.__revpi.io[self.name].reset()
+            self.__io.reset()
             # wait until the actuator has stopped
             time.sleep(0.06)
-            if self.__revpi.io[self.name].value == 0:
-                self.log.info(f"Reset encoder: {self.name}")
+            if self.__io.value == 0:
+                self.log.info("Reset encoder: %s", self.name)
                 self.counter_offset = 0
                 return
         raise(TimeoutError(f"{self.name} :Could not be reset in time"))
 
 
-def event_det_at_sensor(io_name, __):
-    '''Set detection to True'''
-    log.info(f"{io_name} :Detection")
-    global detection 
-    detection = True    
-
-
 class EncoderOverflowError(ValueError):
     '''Encoder had a 'negative' value.'''
 
@@ -9,14 +9,20 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.01.19"
 
-from time import sleep, time
+from time import perf_counter, sleep, time
 from revpimodio2 import RevPiModIO
 
+from lib.actuator import Actuator
 from lib.exit_handler import ExitHandler
 from lib.mqtt_handler import Configs, Status, MqttHandler
-from lib.logger import log
-from lib.machine import MainState
+from lib.logger import log, get_args, setup_logging
+from lib.machine import MainState, changes
 from lib.mainline import MainLine
+from lib.profiler import loop_profiler
+from lib.replay import ReplayHandler
+from lib.resource_manager import ARBITRATION_POLICIES, DeadlockError, get_resource_manager
+from lib.sensor import Sensor
+from lib.sim_layout import create_simulator
 
 
 class Setup():
@@ -24,12 +30,20 @@ class Setup():
 
     Methodes:
         run_factory(): Starts the factory, adds and updates the lines.
+        __wait_for_change(): Waits until something changed, if EVENT_DRIVEN.
         __update_factory(): Updates the factory and starts every line.
+        __resolve_deadlocks(): Lets one line of every deadlock yield.
+        __get_deadlock_victim(): Returns the line of a deadlock that yields.
         __save_status(): Puts the states, factory status and line status into output.
     Attributes:
-        LOOP_TIME (int): How often a new iteration is started (in seconds).
+        LOOP_TIME (int): How often a new iteration is started (in seconds), if not EVENT_DRIVEN. Max time between two iterations while a line is running if EVENT_DRIVEN.
+        EVENT_DRIVEN (bool): If True a new iteration is started as soon as something changed (machine done, status change, Set message).
+        IDLE_LOOP_TIME (float): Max time between two iterations if EVENT_DRIVEN and no line is running (in seconds).
+        MIN_LOOP_TIME (float): Min time between two iterations if EVENT_DRIVEN (in seconds).
+        DEADLOCK_POLICIES (tuple): Possible deadlock_policy of the factory config, the first is the default.
         revpi (RevPiModIO): RevPiModIO Object to control the motors and sensors.
         states (State): All possible States of the line.
+        resources (ResourceManager): Manager for status and owner of the states.
         line_class (Mainline): Class of the current line.
         factory_name (str): Name of the factory (for example Right).
         exception (bool): True if exception in factory.
@@ -38,8 +52,13 @@ class Setup():
         lines (dict): All Line objects currently active.
         exit_handler (ExitHandler): Object for Exit Handler.
         io_interface (IOInterface): Object for IO Interface.
+        replay_file (str): Recorded mqtt session that is replayed, None if connected to the broker.
     '''
     LOOP_TIME = 0.02 # in seconds
+    EVENT_DRIVEN = True
+    IDLE_LOOP_TIME = 0.5 # in seconds
+    MIN_LOOP_TIME = 0.002 # in seconds
+    DEADLOCK_POLICIES = ("youngest", "priority")
     
     def __init__(self, states, line_class: MainLine, factory_name: str):
         '''Init setup and setup of RevpiModIO.
@@ -49,17 +68,28 @@ class Setup():
             line_class (Mainline): Class of the current line.
             factory_name (str): Name of the factory (for example Right).
         '''
+        args = get_args()
+        setup_logging(args.log, args.log_subsystem, args.log_gzip)
+        self.replay_file: str = args.replay
+
         log.critical(f"Initializing {factory_name}-Factory")
         # setup RevpiModIO
-        try:
-            self.revpi = RevPiModIO(autorefresh=True)
-        except:
-            # load simulation if not connected to factory
-            self.revpi = RevPiModIO(autorefresh=True, configrsc="../RevPi/right.rsc", procimg="../RevPi/right.img")
+        if args.sim != None:
+            # run the simulated factory
+            self.revpi = create_simulator(factory_name, args.sim)
+        else:
+            try:
+                self.revpi = RevPiModIO(autorefresh=True)
+            except:
+                # load simulation if not connected to factory
+                self.revpi = RevPiModIO(autorefresh=True, configrsc="../RevPi/right.rsc", procimg="../RevPi/right.img")
         
         self.revpi.mainloop(blocking=False)
+        # mainloop is running, wait for encoders with its events
+        Sensor.EVENT_DRIVEN = True
 
         self.states = states
+        self.resources = get_resource_manager(states)
         self.line_class = line_class
         self.factory_name = factory_name
         
@@ -75,7 +105,11 @@ class Setup():
         self.status = Status()
 
         self.exit_handler = ExitHandler(self.revpi)
-        self.mqtt_handler = MqttHandler(self.factory_name, self.configs, self.status)
+        if self.replay_file != None:
+            # replay a recorded session instead of connecting to the broker
+            self.mqtt_handler = ReplayHandler(self.factory_name, self.configs, self.status, self.replay_file, args.bench, self.revpi)
+        else:
+            self.mqtt_handler = MqttHandler(self.factory_name, self.configs, self.status, self.states)
 
 
     def run_factory(self):
@@ -84,18 +118,26 @@ class Setup():
         self.mqtt_handler.send_data(self.mqtt_handler.TOPIC_FACTORY_STATUS, {"status": "Program started"})
         self.set_status_led(factory_led="green")
         # send all the machineStatus-Data
-        for state in self.states:
-            state_data = {state.name: [state.value[1].name, state.value[2]]}
-            self.status.machine_status.update(state_data)
+        self.status.machine_status.update(self.resources.snapshot())
         self.mqtt_handler.send_data(self.mqtt_handler.TOPIC_MACHINE_STATUS)
 
+        config_timer = loop_profiler.timer("config")
+        update_timer = loop_profiler.timer("update_factory")
+        save_timer = loop_profiler.timer("save_status")
+        flush_timer = loop_profiler.timer("mqtt_flush")
+        led_timer = loop_profiler.timer("status_led")
+
         while(True):
             self.loop_start_time = time()
+            # the phases are timed on the sampled ticks, the end of a phase is the start of the next one
+            sampling = loop_profiler.start_tick()
 
             try:
                 # update the config
-                if time() > self.last_config_update_time + 1:
+                if changes.pop_config() or time() > self.last_config_update_time + 1:
                     self.last_config_update_time = time()
+                    # runs at most once a second or on a change, so it is timed on every tick
+                    start = perf_counter()
 
                     config: dict
                     for config in self.configs.line_configs.values():
@@ -104,12 +146,32 @@ class Setup():
                             self.lines[config["name"]] = self.line_class(self.revpi, self.convert_to_states(config))
                             log.warning(f"Added new line: {config['name']}")
                             self.mqtt_handler.send_data(self.mqtt_handler.TOPIC_FACTORY_STATUS, {"line_added": config})
-            
+
+                    # which waiting line gets a freed machine
+                    policy = self.configs.factory_config.get("arbitration_policy", ARBITRATION_POLICIES[0])
+                    if policy != self.resources.policy:
+                        self.resources.set_policy(policy)
+                    # axes with a pwm ramp use it from their next move
+                    Actuator.PWM_RAMP = self.configs.factory_config.get("pwm_ramp", False) == True
+                    config_timer.record(start)
+
+                if sampling:
+                    start = perf_counter()
                 self.__update_factory()
+                self.__resolve_deadlocks()
+                if sampling:
+                    start = update_timer.record(start)
                 # save Status of factory, lines and every running machine
                 self.__save_status()
+                if sampling:
+                    start = save_timer.record(start)
+                self.mqtt_handler.flush()
+                if sampling:
+                    start = flush_timer.record(start)
 
                 self.set_status_led()
+                if sampling:
+                    led_timer.record(start)
             except Exception as error:
                 self.mqtt_handler.send_data(self.mqtt_handler.TOPIC_FACTORY_STATUS, {"ERROR": self.convert_exception_to_str(error)})
                 log.exception(f"ERROR: {error}")
@@ -124,11 +186,16 @@ class Setup():
 
 
             # wait the remaining runtime
+            loop_profiler.end_tick()
             loop_run_time = time() - self.loop_start_time
-            if loop_run_time < self.LOOP_TIME:
-                sleep(self.LOOP_TIME - loop_run_time)
-            else:
+            if self.replay_file != None:
+                self.mqtt_handler.on_loop(loop_run_time)
+            if loop_run_time >= self.LOOP_TIME:
                 log.debug(f"Long Loop run time: {(loop_run_time*1000).__round__()}ms")
+            if self.EVENT_DRIVEN:
+                self.__wait_for_change()
+            elif loop_run_time < self.LOOP_TIME:
+                sleep(self.LOOP_TIME - loop_run_time)
 
         if self.exception:
             self.set_status_led(factory_led="red")
@@ -140,6 +207,26 @@ class Setup():
         self.revpi.exit()
 
 
+    def __wait_for_change(self):
+        '''Waits until something changed or at most IDLE_LOOP_TIME, the changes during the loop wake it directly.
+        While a line is running the wait is at most LOOP_TIME, the lines also poll sensors (for example WH_SENS_OUT) that don't wake the loop.
+        '''
+        timeout = self.IDLE_LOOP_TIME
+        if any(line.running for line in self.lines.values()):
+            timeout = self.LOOP_TIME
+        if self.replay_file != None:
+            # wake up when the next recorded message is due
+            wait_time = self.mqtt_handler.get_wait_time()
+            if wait_time != None:
+                timeout = min(timeout, wait_time)
+        changes.wait(timeout)
+
+        # limits the loops if the lines change something in every loop
+        remaining_time = self.MIN_LOOP_TIME - (time() - self.loop_start_time)
+        if remaining_time > 0:
+            sleep(remaining_time)
+
+
     def __update_factory(self):
         '''Updates the factory and starts every line.'''
         # check for error in lines
@@ -148,6 +235,7 @@ class Setup():
             # update the line config with new data from mqtt_handler
             if self.configs.line_configs.get(line.name).pop("changed", False):
                 line.config = self.convert_to_states(self.configs.line_configs.get(line.name))
+                changes.mark_line(line.name)
                 log.warning(f"Changed line: {line.name}")
                 self.mqtt_handler.send_data(self.mqtt_handler.TOPIC_FACTORY_STATUS, {"line_changed": self.configs.line_configs.get(line.name)})
             # stop the line
@@ -231,14 +319,62 @@ class Setup():
             return
 
 
+    def __resolve_deadlocks(self):
+        '''Lets one line of every deadlock found by the resource manager yield, the other lines continue.
+        Only a line that holds a machine of the cycle without its product (initialized in advance by a run function) can yield,
+        it frees that machine and keeps waiting, so it retries after the line that got the machine.
+        If every machine of the cycle holds a product, only removing a product helps, so the victim stops with a PROBLEM.
+        '''
+        for cycle in self.resources.pop_deadlocks():
+            # in order of adding, the last is the youngest
+            lines: "list[MainLine]" = [line for line in self.lines.values() if line.name in cycle]
+            if lines.__len__() < cycle.__len__() or any(line.state == MainState.PROBLEM for line in lines):
+                # already resolved
+                continue
+            waited_for = set(cycle.values())
+            yieldable = {line.name: line.get_held_ahead() & waited_for for line in lines}
+            candidates = [line for line in lines if yieldable[line.name]]
+            victim = self.__get_deadlock_victim(candidates if candidates else lines)
+            msg = {"deadlock": {"waiting_for": cycle, "yields": victim.name, "frees": sorted(yieldable[victim.name])}}
+            log.error(msg)
+            self.mqtt_handler.send_data(self.mqtt_handler.TOPIC_FACTORY_STATUS, msg)
+
+            if candidates:
+                victim.yield_machines(yieldable[victim.name])
+                continue
+            others = ", ".join(line.name for line in lines if line != victim)
+            victim.exception_msg = DeadlockError(f"Waiting for {cycle[victim.name]} in a cycle with {others}, every machine holds a product")
+            victim.waiting_for_state = None
+            self.resources.cancel_wait(victim.name)
+            victim.switch_state(MainState.PROBLEM)
+
+
+    def __get_deadlock_victim(self, lines: "list[MainLine]") -> MainLine:
+        '''Returns the line of a deadlock that yields, chosen by the deadlock_policy of the factory config.
+        "youngest": the line added last yields, "priority": the line with the lowest priority of the line config yields (the youngest of them).
+
+        Args:
+            lines (list): Lines of the deadlock in order of adding.
+        Returns:
+            MainLine: Line that yields.
+        '''
+        policy = self.configs.factory_config.get("deadlock_policy", self.DEADLOCK_POLICIES[0])
+        if policy == "priority":
+            return min(reversed(lines), key=lambda line: line.config.get("priority", 0))
+        if policy != "youngest":
+            log.warning(f"Unknown deadlock_policy {policy}, possible are {self.DEADLOCK_POLICIES}")
+        return lines[-1]
+
+
     def __save_status(self):
-        '''Saves the machines status, factory status and line status.'''
+        '''Saves the machines status, factory status and line status, only changed states and lines are checked.'''
         
-        # get the machine states
-        for state in self.states:
-            state_data = {state.name: [state.value[1].name, state.value[2]]}
-            old_state_data = self.status.machine_status.get(state.name)
-            if old_state_data != state_data[state.name]:
+        # get the changed machine states
+        for state_name in changes.pop_states():
+            status, used_by = self.resources.get(state_name)
+            state_data = {state_name: [status.name, used_by]}
+            old_state_data = self.status.machine_status.get(state_name)
+            if old_state_data != state_data[state_name]:
                 # if state changed update status and send the state_data
                 self.status.machine_status.update(state_data)
                 # if state_data[state.name][0] == "BLOCKED" or (old_state_data[0] == "BLOCKED" and state_data[state.name][0] == "FREE"):
@@ -247,10 +383,11 @@ class Setup():
                 self.mqtt_handler.send_data(self.mqtt_handler.TOPIC_MACHINE_STATUS, state_data)
                 self.status.status_update_num += 1
         
-        # get the status of all lines
+        # get the status of the changed lines
         line: MainLine
-        for line in self.lines.values():
-            if line.config["run"] == False:
+        for line_name in changes.pop_lines():
+            line = self.lines.get(line_name)
+            if line == None or line.config["run"] == False:
                 continue
             line_status = {"self": {
                 "state": line.state.name if line.state else None, 
@@ -0,0 +1,279 @@
+'''Layouts of the right and left factory for the simulated process image'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+from lib.simulator import SimRevPiModIO, SimAxis, SimLinear, SimConveyor, SimStation, SimGripper, SimCompressor, SimValve, SimProduct
+from lib.wh_content import get_wh_content, EMPTY
+from lib.warehouse import POSITIONS
+
+# window around a robot position in which a station is reached
+STATION_WINDOW = 100
+# color of the products at the start of the factory
+START_COLOR = "COLOR_UNKNOWN"
+# vertical move of the extended WH arm that lifts or lowers a product, the encoder stops up to 40 values before the target
+WH_LIFT = 30
+
+def near(axis: SimAxis, value: float, window: float=STATION_WINDOW):
+    '''Returns a function that is True if the axis is near value.'''
+    return lambda: abs(axis.position - value) <= window
+
+
+def move_product(source, source_position: float, window: float, target, target_position: float):
+    '''Moves the product nearest to source_position from source to target, used by pushers and pistons.'''
+    product = source.take_product(source_position, window)
+    if product != None:
+        target.add_product(product, target_position)
+
+
+def add_conveyor(sim: SimRevPiModIO, name: str, sensors: "dict[str, float]", backwards=False, without_direction=False, **kwargs) -> SimConveyor:
+    '''Adds a conveyor with the outputs name_FWD (and name_BWD), a conveyor without direction uses the output name.'''
+    if without_direction:
+        return SimConveyor(sim, name, [name], sensors=sensors, **kwargs)
+    return SimConveyor(sim, name, [name + "_FWD"], [name + "_BWD"] if backwards else [], sensors=sensors, **kwargs)
+
+
+def add_robot(sim: SimRevPiModIO, name: str) -> tuple:
+    '''Adds the axes of a Robot3D (rotation, horizontal, vertical), GR have a horizontal counter and a claw, VG have a compressor.
+
+    Returns:
+        tuple: (rotation, horizontal, vertical, holding()) holding() is True if the robot holds a product.
+    '''
+    rotation = SimAxis(sim, name + "_ROTATION_ENCODER", name + "_CCW", name + "_CW", 600, 4000, name + "_REF_SW_ROTATION", name + "_ROTATION_PWM")
+    if name[:2] == "VG":
+        horizontal = SimAxis(sim, name + "_HORIZONTAL_ENCODER", name + "_FWD", name + "_BWD", 400, 1500, name + "_REF_SW_HORIZONTAL", name + "_HORIZONTAL_PWM")
+        SimCompressor(sim, name + "_COMPRESSOR")
+        valve = sim.add_io(name + "_VALVE_VACUUM")
+        holding = lambda: valve.value
+    else:
+        horizontal = SimAxis(sim, name + "_HORIZONTAL_COUNTER", name + "_FWD", name + "_BWD", 20, 100, name + "_REF_SW_HORIZONTAL", counter=True)
+        claw = SimAxis(sim, name + "_CLAW_COUNTER", name + "_CLOSE", name + "_OPEN", 10, 20, name + "_REF_SW_CLAW", counter=True)
+        # GripRobot.GRIPPER_CLOSED is 13, GRIPPER_OPENED is 9
+        holding = lambda: claw.position >= 11
+    vertical = SimAxis(sim, name + "_VERTICAL_ENCODER", name + "_DOWN", name + "_UP", 800, 4000, name + "_REF_SW_VERTICAL")
+    return rotation, horizontal, vertical, holding
+
+
+def add_mps(sim: SimRevPiModIO, cb1: SimConveyor) -> SimStation:
+    '''Adds the Multi Purpose Station, products go from the oven to the table with the vacuum gripper and are pushed to MPS_CB.
+
+    Returns:
+        SimStation: Oven tray.
+    '''
+    oven = SimStation(sim, "MPS_OVEN", "MPS_SENS_OVEN")
+    table = SimStation(sim, "MPS_TABLE")
+    cb = add_conveyor(sim, "MPS_CB", {"MPS_SENS_CB": 290})
+    cb.connect(cb1)
+
+    vg = SimLinear(sim, "MPS_VG_TO_OVEN", "MPS_VG_TO_TABLE", 2, {"MPS_REF_SW_VG_TABLE": 0, "MPS_REF_SW_VG_OVEN": 1})
+    SimLinear(sim, "MPS_OVEN_TRAY_IN", "MPS_OVEN_TRAY_OUT", 1.5, {"MPS_REF_SW_OVEN_TRAY_OUT": 0, "MPS_REF_SW_OVEN_TRAY_IN": 1})
+    table_motor = SimLinear(sim, "MPS_TABLE_CW", "MPS_TABLE_CCW", 3, {"MPS_REF_SW_TABLE_VG": 0, "MPS_REF_SW_TABLE_SAW": 0.5, "MPS_REF_SW_TABLE_CB": 1}, pwm="MPS_TABLE_PWM")
+    compressor = SimCompressor(sim, "MPS_COMPRESSOR")
+
+    vacuum = sim.add_io("MPS_VALVE_VG_VACUUM")
+    SimGripper(sim, "MPS_VG", lambda: vacuum.value, [(lambda: vg.at(1), oven, None), (lambda: vg.at(0), table, None)])
+    SimValve(sim, "MPS_VALVE_TABLE_PISTON", compressor, lambda: table_motor.at(1) and move_product(table, None, None, cb, 20))
+    return oven
+
+
+def add_pm(sim: SimRevPiModIO, cb2: SimConveyor):
+    '''Adds the Punch Machine, its conveyor is connected to the end of CB2.'''
+    cb = add_conveyor(sim, "PM_CB", {"PM_SENS_IN": 20, "PM_SENS_PM": 150}, backwards=True, length=200)
+    cb2.connect(cb)
+    SimLinear(sim, "PM_DOWN", "PM_UP", 1, {"PM_REF_SW_TOP": 0, "PM_REF_SW_BOTTOM": 1})
+
+
+def add_wh(sim: SimRevPiModIO) -> "tuple[SimConveyor, dict]":
+    '''Adds the Warehouse, the rack is filled from the content file.
+    The arm takes a product if it is lifted while extended and puts it down if it is lowered while extended.
+
+    Returns:
+        tuple: WH_CB and the slots of the rack, {(hor, ver): SimStation}.
+    '''
+    cb = add_conveyor(sim, "WH_CB", {"WH_SENS_OUT": 10, "WH_SENS_IN": 290}, backwards=True)
+    horizontal = SimAxis(sim, "WH_HORIZONTAL_ENCODER", "WH_CRANE_TO_RACK", "WH_CRANE_TO_CB", 400, 4000, "WH_REF_SW_HORIZONTAL")
+    vertical = SimAxis(sim, "WH_VERTICAL_ENCODER", "WH_ARM_DOWN", "WH_ARM_UP", 400, 1800, "WH_REF_SW_VERTICAL")
+    arm = SimLinear(sim, "WH_ARM_FWD", "WH_ARM_BWD", 2, {"WH_REF_SW_ARM_BACK": 0, "WH_REF_SW_ARM_FRONT": 1})
+
+    # [holding, vertical position when the arm was extended]
+    lift = [False, None]
+    def holding() -> bool:
+        if not arm.at(1):
+            lift[1] = None
+        elif lift[1] == None:
+            lift[1] = vertical.position
+        elif vertical.position < lift[1] - WH_LIFT:
+            lift[0] = True
+        elif vertical.position > lift[1] + WH_LIFT:
+            lift[0] = False
+        return lift[0]
+
+    content = get_wh_content("wh_content.json").get_content()
+    stations = [(lambda: horizontal.position < 300, cb, 290)]
+    slots = {}
+    for hor in range(3):
+        for ver in range(3):
+            slot_hor, slot_ver = POSITIONS[hor][ver]
+            products = [SimProduct(content[hor][ver])] if content[hor][ver] != EMPTY else []
+            slot = SimStation(sim, f"WH_SLOT_{hor}_{ver}", products=products)
+            slots[(hor, ver)] = slot
+            at = lambda slot_hor=slot_hor, slot_ver=slot_ver: abs(horizontal.position - slot_hor) <= 150 and slot_ver - 250 <= vertical.position <= slot_ver + 100
+            stations.append((at, slot, None))
+    SimGripper(sim, "WH", holding, stations)
+    return cb, slots
+
+
+def fill_wh(sim: SimRevPiModIO, content: "list[list[str]]"):
+    '''Replaces the products in the rack of the Warehouse.
+
+    Args:
+        content (list): Color at every slot, first array is the column nearest to the cb.
+    '''
+    for (hor, ver), slot in sim.parts["WH_SLOTS"].items():
+        slot.products = [SimProduct(content[hor][ver])] if content[hor][ver] != EMPTY else []
+
+
+def add_sl(sim: SimRevPiModIO) -> "tuple[SimConveyor, dict]":
+    '''Adds the Sorting Line, the pistons push the product in front of them into the bays.
+
+    Returns:
+        tuple: (SL_CB, {color: bay})
+    '''
+    cb = add_conveyor(sim, "SL_CB_FWD", {"SL_CB_SENS_PISTON": 60}, counter="SL_CB_COUNTER", without_direction=True)
+    compressor = SimCompressor(sim, "SL_COMPRESSOR")
+    bays = {}
+    # SortLine runs to the counter values 2, 7 and 12 after the piston sensor
+    for color, position in (("WHITE", 85), ("RED", 185), ("BLUE", 285)):
+        bays[color] = SimStation(sim, f"SL_{color}", f"SL_SENS_{color}")
+        SimValve(sim, f"SL_VALVE_PISTON_{color}", compressor, lambda position=position, bay=bays[color]: move_product(cb, position, 40, bay, None))
+    return cb, bays
+
+
+def add_indx(sim: SimRevPiModIO, cb5: SimConveyor) -> SimConveyor:
+    '''Adds the Index Line, the pushers move the product from CB_START to CB_MILL and from CB_DRILL to CB_END.
+
+    Returns:
+        SimConveyor: INDX_CB_END.
+    '''
+    cb_start = add_conveyor(sim, "INDX_CB_START", {"INDX_SENS_START": 10}, without_direction=True)
+    cb_mill = add_conveyor(sim, "INDX_CB_MILL", {"INDX_SENS_MILL": 150}, without_direction=True)
+    cb_drill = add_conveyor(sim, "INDX_CB_DRILL", {"INDX_SENS_DRILL": 20}, without_direction=True)
+    cb_end = add_conveyor(sim, "INDX_CB_END", {"INDX_SENS_END": 200}, without_direction=True)
+    cb5.connect(cb_start)
+    cb_mill.connect(cb_drill)
+
+    SimLinear(sim, "INDX_PUSH1_FWD", "INDX_PUSH1_BWD", 1, {"INDX_REF_SW_PUSH1_BACK": 0, "INDX_REF_SW_PUSH1_FRONT": 1},
+              on_switch={"INDX_REF_SW_PUSH1_FRONT": lambda: move_product(cb_start, 150, 150, cb_mill, 20)})
+    SimLinear(sim, "INDX_PUSH2_FWD", "INDX_PUSH2_BWD", 1, {"INDX_REF_SW_PUSH2_BACK": 0, "INDX_REF_SW_PUSH2_FRONT": 1},
+              on_switch={"INDX_REF_SW_PUSH2_FRONT": lambda: move_product(cb_drill, 150, 150, cb_end, 20)})
+    return cb_end
+
+
+def add_common(sim: SimRevPiModIO, positions: "dict[str, int]") -> dict:
+    '''Adds the machines both factories have, products start at the start plate of GR1.
+
+    Args:
+        positions (dict): Rotation of the robots at the stations, {station: rotation}.
+    Returns:
+        dict: Conveyors, stations and robots by name.
+    '''
+    parts = {}
+    parts["START"] = SimStation(sim, "START", source=START_COLOR)
+    parts["OUT"] = SimStation(sim, "OUT", sink=True)
+    for name, sensors in (("CB1", {"CB1_SENS_START": 10, "CB1_SENS_END": 290}),
+                          ("CB2", {"CB2_SENS_START": 10, "CB2_SENS_END": 290}),
+                          ("CB3", {"CB3_SENS_START": 10, "CB3_SENS_END": 290}),
+                          ("CB4", {"CB4_SENS_START": 10, "CB4_SENS_END": 290}),
+                          ("CB5", {"CB5_SENS_START": 10, "CB5_SENS_END": 290})):
+        parts[name] = add_conveyor(sim, name, sensors, backwards=(name == "CB2"))
+    parts["CB3"].connect(parts["CB4"])
+    parts["CB4"].connect(parts["CB5"])
+
+    oven = add_mps(sim, parts["CB1"])
+    add_pm(sim, parts["CB2"])
+    wh_cb, parts["WH_SLOTS"] = add_wh(sim)
+
+    for name in ("GR1", "GR2", "GR3", "VG1"):
+        parts[name] = add_robot(sim, name)
+
+    rotation, _, _, holding = parts["GR1"]
+    SimGripper(sim, "GR1", holding, [
+        (near(rotation, positions["GR1_START"]), parts["START"], None),
+        (near(rotation, positions["GR1_START_INT"]), parts["START"], None),
+        (near(rotation, positions["GR1_MPS"]), oven, None)])
+    rotation, _, _, holding = parts["GR2"]
+    SimGripper(sim, "GR2", holding, [
+        (near(rotation, positions["GR2_CB1"]), parts["CB1"], 290),
+        (near(rotation, positions["GR2_CB2"]), parts["CB2"], 10),
+        (near(rotation, positions["GR2_CB3"]), parts["CB3"], 10)])
+    rotation, _, _, holding = parts["VG1"]
+    SimGripper(sim, "VG1", holding, [
+        (near(rotation, 0), parts["CB4"], 10),
+        (near(rotation, positions["VG1_WH"]), wh_cb, 10)])
+    return parts
+
+
+def build_right(sim: SimRevPiModIO) -> dict:
+    '''Builds the right factory (MPS, PM, WH, SL).
+
+    Returns:
+        dict: Conveyors, stations and robots by name.
+    '''
+    parts = add_common(sim, {"GR1_START": 1925, "GR1_START_INT": 3260, "GR1_MPS": 535, "GR2_CB1": 150, "GR2_CB2": 3710, "GR2_CB3": 1970, "VG1_WH": 1800})
+    sl_cb, bays = add_sl(sim)
+
+    rotation, _, _, holding = parts["GR3"]
+    SimGripper(sim, "GR3", holding, [
+        (near(rotation, 145), parts["CB5"], 290),
+        (near(rotation, 1985), sl_cb, 20)])
+    rotation, _, _, holding = add_robot(sim, "VG2")
+    SimGripper(sim, "VG2", holding, [
+        (near(rotation, 890, 60), bays["WHITE"], None),
+        (near(rotation, 735, 60), bays["RED"], None),
+        (near(rotation, 615, 60), bays["BLUE"], None),
+        (near(rotation, 0), parts["OUT"], None),
+        (near(rotation, 2970), parts["START"], None)])
+    return parts
+
+
+def build_left(sim: SimRevPiModIO) -> dict:
+    '''Builds the left factory (MPS, PM, WH, INDX).
+
+    Returns:
+        dict: Conveyors, stations and robots by name.
+    '''
+    parts = add_common(sim, {"GR1_START": 1925, "GR1_START_INT": 3260, "GR1_MPS": 575, "GR2_CB1": 125, "GR2_CB2": 3715, "GR2_CB3": 1945, "VG1_WH": 1770})
+    indx_cb_end = add_indx(sim, parts["CB5"])
+
+    rotation, _, _, holding = parts["GR3"]
+    SimGripper(sim, "GR3", holding, [
+        (near(rotation, 9), indx_cb_end, 245),
+        (near(rotation, 3000), parts["OUT"], None),
+        (near(rotation, 2200), parts["START"], None)])
+    return parts
+
+
+# layout of every factory, {factory name: build function}
+layouts = {"Right": build_right, "Left": build_left}
+
+def create_simulator(factory_name: str, time_scale=1.0) -> SimRevPiModIO:
+    '''Returns a simulated RevPiModIO with the layout of the factory.
+
+    Args:
+        factory_name (str): Name of the factory (Right, Left).
+        time_scale (float): Simulated time per real time, > 1 runs faster than real time.
+    Returns:
+        SimRevPiModIO: Simulator with all models of the factory.
+    Raises:
+        ValueError: No layout for the factory.
+    '''
+    build = layouts.get(factory_name)
+    if build == None:
+        raise ValueError(f"No simulation layout for factory {factory_name}, use one of {list(layouts)}")
+    sim = SimRevPiModIO(time_scale=time_scale)
+    sim.parts = build(sim)
+    return sim
@@ -0,0 +1,838 @@
+'''Simulated process image for RevPiModIO, runs the lines without a factory'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+import threading
+import time
+from revpimodio2 import RISING, FALLING, BOTH, INP, OUT
+
+from lib.logger import log
+
+# words in the IO name that mark an input, every other IO is an output
+INPUT_WORDS = ("SENS", "REF_SW", "ENCODER", "COUNTER")
+
+class SimIO():
+    '''IO of the simulated process image, has the parts of the revpimodio2 IO that are used.'''
+    '''
+    Methodes:
+        reg_event(): Registers a function that is called if the value changes.
+        unreg_event(): Removes a registered function.
+        wait(): Waits for a change of the value.
+        reset(): Resets a counter or encoder to 0.
+    Attributes:
+        name (str): Name of the IO.
+        type (int): INP or OUT (from revpimodio2).
+        value: Value of the IO, light barriers are True if nothing is detected.
+        last_value: Value at the end of the last cycle.
+        on_reset (callable): Called by reset(), set by the model of the IO.
+        __sim (SimRevPiModIO): Simulator that holds the IO.
+        __events (list): Registered functions with edge.
+        __edges (dict): Number of edges since start, {RISING: int, FALLING: int}.
+    '''
+
+    def __init__(self, sim: "SimRevPiModIO", name: str, type: int, value=0):
+        '''Initializes SimIO.
+
+        Args:
+            sim (SimRevPiModIO): Simulator that holds the IO.
+            name (str): Name of the IO.
+            type (int): INP or OUT (from revpimodio2).
+            value: Start value.
+        '''
+        self.name = name
+        self.type = type
+        self.value = value
+        self.last_value = value
+        self.on_reset = None
+        self.__sim = sim
+        self.__events: "list[tuple]" = []
+        self.__edges = {RISING: 0, FALLING: 0}
+
+
+    def __str__(self) -> str:
+        return self.name
+
+
+    def reg_event(self, func, delay=0, edge=BOTH, as_thread=False, prefire=False):
+        '''Registers a function that is called with (name, value) if the value changes.
+
+        Args:
+            func (callable): Function to call.
+            edge: Trigger edge, can be BOTH, RISING, FALLING (from revpimodio2).
+        '''
+        self.__events.append((func, edge))
+
+
+    def unreg_event(self, func=None, edge=None):
+        '''Removes a registered function, without func all functions are removed.
+
+        Args:
+            func (callable): Function to remove.
+            edge: Only remove the function for this edge.
+        '''
+        self.__events = [(event_func, event_edge) for event_func, event_edge in self.__events
+                         if not ((func == None or event_func == func) and (edge == None or event_edge == edge))]
+
+
+    def wait(self, edge=BOTH, exitevent=None, okvalue=None, timeout=0) -> int:
+        '''Waits for a change of the value.
+
+        Args:
+            edge: Edge to wait for, can be BOTH, RISING, FALLING (from revpimodio2).
+            exitevent (Event): Stops the wait if set.
+            okvalue: Stops the wait if the IO has this value.
+            timeout (int): Time in ms after which the wait is stopped, 0 waits forever.
+        Returns:
+            int: 0 if the edge happened, 1 for exitevent, 2 for okvalue, 100 for timeout.
+        '''
+        start_edges = dict(self.__edges)
+        end_time = time.time() + timeout / 1000 if timeout else None
+        while True:
+            if self.__edges[RISING] > start_edges[RISING] and edge != FALLING:
+                return 0
+            if self.__edges[FALLING] > start_edges[FALLING] and edge != RISING:
+                return 0
+            if exitevent != None and exitevent.is_set():
+                return 1
+            if okvalue != None and self.value == okvalue:
+                return 2
+            if end_time != None and time.time() >= end_time:
+                return 100
+            self.__sim.wait_cycle(None if end_time == None else end_time - time.time())
+
+
+    def reset(self):
+        '''Resets a counter or encoder to 0.'''
+        if self.on_reset:
+            self.on_reset()
+        self.value = 0
+
+
+    def fire(self, old_value):
+        '''Counts the edge and calls the registered functions, called by the simulator after a cycle.
+
+        Args:
+            old_value: Value at the end of the cycle before.
+        '''
+        rising = self.value > old_value
+        self.__edges[RISING if rising else FALLING] += 1
+        for func, edge in list(self.__events):
+            if edge == BOTH or (edge == RISING) == rising:
+                try:
+                    func(self.name, self.value)
+                except Exception as e:
+                    log.exception(e)
+
+
+class SimIOs():
+    '''All IOs of the simulated process image, missing IOs are created on first access.'''
+
+    def __init__(self, sim: "SimRevPiModIO"):
+        self.__sim = sim
+        self.__ios: "dict[str, SimIO]" = {}
+
+
+    def __getitem__(self, name: str) -> SimIO:
+        io = self.__ios.get(name)
+        if io == None:
+            io = self.__sim.add_io(name)
+        return io
+
+
+    def __getattr__(self, name: str) -> SimIO:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__ios
+
+
+    def __iter__(self):
+        return iter(list(self.__ios.values()))
+
+
+    def add(self, io: SimIO):
+        self.__ios[io.name] = io
+
+
+class SimRevPiModIO():
+    '''Simulated RevPiModIO, the models of the factory are moved every cycle by the outputs and set the inputs.
+    The models are stepped in a fixed order with a fixed time step, the same outputs give the same inputs.
+    '''
+    '''
+    Methodes:
+        add_io(): Adds an IO to the process image.
+        add_model(): Adds a model that is stepped every cycle.
+        step(): Simulates one cycle.
+        wait_cycle(): Waits for the end of the next cycle.
+        mainloop(): Simulates cycles every cycletime.
+        exit(): Stops the mainloop.
+        cleanup(): Stops the mainloop.
+        finish(): Counts a product that left the factory.
+    Attributes:
+        io (SimIOs): All IOs.
+        cycletime (int): Time of a cycle in ms.
+        time_scale (float): Simulated time per real time, > 1 runs faster than real time.
+        sim_time (float): Simulated time since start in s.
+        cycles (int): Number of simulated cycles.
+        finished (list): Simulated time and product for every product that left the factory.
+        lost (list): Simulated time and product for every product that was dropped.
+        models (list): Models that are stepped every cycle.
+        parts (dict): Conveyors, stations and robots of the layout by name.
+        __lock (Lock): Lock for a cycle.
+        __cycle_done (Condition): Notified after every cycle.
+        __running (bool): True while the mainloop runs.
+        __thread (Thread): Thread of the mainloop.
+        log (Logger): Log object to print to log.
+    '''
+
+    def __init__(self, cycletime=20, time_scale=1.0):
+        '''Initializes SimRevPiModIO.
+
+        Args:
+            cycletime (int): Time of a cycle in ms.
+            time_scale (float): Simulated time per real time, > 1 runs faster than real time.
+        '''
+        self.io = SimIOs(self)
+        self.cycletime = cycletime
+        self.time_scale = time_scale
+        self.sim_time = 0.0
+        self.cycles = 0
+        self.finished: "list[tuple]" = []
+        self.lost: "list[tuple]" = []
+        self.models: "list[SimModel]" = []
+        self.parts: dict = {}
+
+        self.__lock = threading.Lock()
+        self.__cycle_done = threading.Condition()
+        self.__running = False
+        self.__thread: threading.Thread = None
+
+        global log
+        self.log = log.getChild("Sim")
+
+
+    def add_io(self, name: str, type: int=None, value=None) -> SimIO:
+        '''Adds an IO to the process image, an existing IO is returned.
+
+        Args:
+            name (str): Name of the IO.
+            type (int): INP or OUT (from revpimodio2), if None the type is determined from name.
+            value: Start value, if None light barriers are True and all others 0.
+        Returns:
+            SimIO: The IO.
+        '''
+        if name in self.io:
+            return self.io[name]
+        if type == None:
+            type = INP if any(word in name for word in INPUT_WORDS) else OUT
+        if value == None:
+            value = True if type == INP and "SENS" in name else 0
+        io = SimIO(self, name, type, value)
+        self.io.add(io)
+        return io
+
+
+    def add_model(self, model: "SimModel") -> "SimModel":
+        '''Adds a model that is stepped every cycle, models are stepped in the order they are added.
+
+        Args:
+            model (SimModel): The model.
+        Returns:
+            SimModel: The model.
+        '''
+        self.models.append(model)
+        return model
+
+
+    def step(self, cycles=1):
+        '''Simulates cycles, every cycle moves the models by cycletime * time_scale and calls the events of changed IOs.
+
+        Args:
+            cycles (int): Number of cycles.
+        '''
+        dt = self.cycletime / 1000 * self.time_scale
+        for _ in range(cycles):
+            with self.__lock:
+                self.sim_time += dt
+                self.cycles += 1
+                for model in self.models:
+                    model.step(dt)
+                changed = []
+                for io in self.io:
+                    if io.value != io.last_value:
+                        changed.append((io, io.last_value))
+                        io.last_value = io.value
+            for io, old_value in changed:
+                io.fire(old_value)
+            with self.__cycle_done:
+                self.__cycle_done.notify_all()
+
+
+    def wait_cycle(self, timeout: float=None):
+        '''Waits for the end of the next cycle.
+
+        Args:
+            timeout (float): Max time to wait in s.
+        '''
+        if timeout != None and timeout <= 0:
+            return
+        with self.__cycle_done:
+            self.__cycle_done.wait(timeout if timeout != None else self.cycletime / 1000 * 10)
+
+
+    def mainloop(self, blocking=True):
+        '''Simulates a cycle every cycletime.
+
+        Args:
+            blocking (bool): If False the cycles run in a thread.
+        '''
+        if self.__running:
+            return
+        self.__running = True
+        if not blocking:
+            self.__thread = threading.Thread(target=self.__loop, name="Sim", daemon=True)
+            self.__thread.start()
+            return
+        self.__loop()
+
+
+    def exit(self, full=True):
+        '''Stops the mainloop.'''
+        self.__running = False
+
+
+    def cleanup(self):
+        '''Stops the mainloop.'''
+        self.exit()
+
+
+    def finish(self, product: "SimProduct"):
+        '''Counts a product that left the factory.
+
+        Args:
+            product (SimProduct): The product.
+        '''
+        self.finished.append((self.sim_time, product))
+        self.log.info(f"{product} finished after {self.sim_time:.2f}s")
+
+
+    def __loop(self):
+        '''Simulates cycles until exit() is called, a cycle that takes too long is not repeated.'''
+        self.log.info(f"Simulation started, time scale: {self.time_scale}")
+        next_cycle = time.time()
+        while self.__running:
+            self.step()
+            next_cycle += self.cycletime / 1000
+            delay = next_cycle - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_cycle = time.time()
+
+
+class SimProduct():
+    '''Product that is moved through the simulated factory.'''
+
+    def __init__(self, color: str="COLOR_UNKNOWN"):
+        self.color = color
+
+
+    def __str__(self) -> str:
+        return f"Product({self.color})"
+
+
+class SimModel():
+    '''Model of a part of the factory, is stepped every cycle. Abstract class, see subclass.'''
+
+    def step(self, dt: float):
+        '''Moves the model by dt.
+
+        Args:
+            dt (float): Simulated time since the last cycle in s.
+        '''
+        pass
+
+
+class SimAxis(SimModel):
+    '''Axis moved by a motor with encoder or counter and a reference switch at 0.
+    A counter counts in both directions up, like the counters in the factory, and moves max one value per cycle.
+    '''
+    '''
+    Attributes:
+        position (float): Position of the axis, same unit as the encoder.
+        __plus (SimIO): Output that moves the axis to higher values.
+        __minus (SimIO): Output that moves the axis to lower values.
+        __pwm (SimIO): Output for the speed in percent.
+        __encoder (SimIO): Encoder or counter input.
+        __ref_sw (SimIO): Reference switch input.
+        __speed (float): Speed at full power in values per second.
+        __length (float): Max position.
+        __counter (bool): True if the input is a counter.
+        __offset (float): Position at the last reset.
+        __count (float): Counted values since the last reset.
+    '''
+
+    def __init__(self, sim: SimRevPiModIO, encoder: str, plus: str, minus: str, speed: float, length: float, ref_sw: str=None, pwm: str=None, counter=False, start=0.0):
+        '''Initializes SimAxis.
+
+        Args:
+            sim (SimRevPiModIO): Simulator.
+            encoder (str): Name of the encoder or counter.
+            plus (str): Name of the output that moves the axis to higher values.
+            minus (str): Name of the output that moves the axis to lower values.
+            speed (float): Speed at full power in values per second.
+            length (float): Max position.
+            ref_sw (str): Name of the reference switch at 0.
+            pwm (str): Name of the output for the speed in percent.
+            counter (bool): True if the input is a counter.
+            start (float): Start position.
+        '''
+        self.position = start
+        self.__plus = sim.add_io(plus, OUT)
+        self.__minus = sim.add_io(minus, OUT)
+        self.__pwm = sim.add_io(pwm, OUT) if pwm else None
+        self.__encoder = sim.add_io(encoder, INP)
+        self.__ref_sw = sim.add_io(ref_sw, INP) if ref_sw else None
+        self.__speed = speed
+        self.__length = length
+        self.__counter = counter
+        self.__offset = 0.0
+        self.__count = 0.0
+        self.__encoder.on_reset = self.__reset
+        self.__set_inputs()
+        sim.add_model(self)
+
+
+    def step(self, dt: float):
+        direction = bool(self.__plus.value) - bool(self.__minus.value)
+        if direction != 0:
+            power = self.__pwm.value / 100 if self.__pwm and self.__pwm.value else 1
+            distance = self.__speed * power * dt
+            if self.__counter:
+                # Sensor expects counters to count single steps
+                distance = min(distance, 1)
+            position = min(max(self.position + direction * distance, 0), self.__length)
+            self.__count += abs(position - self.position)
+            self.position = position
+        self.__set_inputs()
+
+
+    def __reset(self):
+        '''Sets the encoder value at the current position to 0.'''
+        self.__offset = self.position
+        self.__count = 0.0
+
+
+    def __set_inputs(self):
+        '''Sets encoder and reference switch, a negative encoder value overflows like the real encoder.'''
+        if self.__counter:
+            self.__encoder.value = int(self.__count)
+        else:
+            self.__encoder.value = int(self.position - self.__offset) % 65536
+        if self.__ref_sw:
+            self.__ref_sw.value = self.position <= 0
+
+
+class SimLinear(SimModel):
+    '''Motor that moves between reference switches, the position goes from 0 to 1.'''
+    '''
+    Attributes:
+        position (float): Position from 0 to 1.
+        __plus (SimIO): Output that moves to 1.
+        __minus (SimIO): Output that moves to 0.
+        __pwm (SimIO): Output for the speed in percent.
+        __travel_time (float): Time from 0 to 1 in s.
+        __switches (dict): Reference switch and position, {SimIO: position}.
+        __on_switch (dict): Called when a switch is reached, {name: callable}.
+    '''
+    WINDOW = 0.02
+
+    def __init__(self, sim: SimRevPiModIO, plus: str, minus: str, travel_time: float, switches: "dict[str, float]", pwm: str=None, on_switch: dict=None, start=0.0):
+        '''Initializes SimLinear.
+
+        Args:
+            sim (SimRevPiModIO): Simulator.
+            plus (str): Name of the output that moves to 1.
+            minus (str): Name of the output that moves to 0.
+            travel_time (float): Time from 0 to 1 in s.
+            switches (dict): Reference switches and their position, {name: position}.
+            pwm (str): Name of the output for the speed in percent.
+            on_switch (dict): Functions called when a switch is reached, {name: callable}.
+            start (float): Start position.
+        '''
+        self.position = start
+        self.__plus = sim.add_io(plus, OUT)
+        self.__minus = sim.add_io(minus, OUT)
+        self.__pwm = sim.add_io(pwm, OUT) if pwm else None
+        self.__travel_time = travel_time
+        self.__switches = {sim.add_io(name, INP): position for name, position in switches.items()}
+        self.__on_switch = on_switch if on_switch else {}
+        self.__set_inputs()
+        sim.add_model(self)
+
+
+    def at(self, position: float) -> bool:
+        '''Returns True if the motor is at position.'''
+        return abs(self.position - position) <= self.WINDOW
+
+
+    def step(self, dt: float):
+        direction = bool(self.__plus.value) - bool(self.__minus.value)
+        if direction != 0:
+            power = self.__pwm.value / 100 if self.__pwm and self.__pwm.value else 1
+            self.position = min(max(self.position + direction * power * dt / self.__travel_time, 0), 1)
+        self.__set_inputs()
+
+
+    def __set_inputs(self):
+        '''Sets the reference switches and calls on_switch for reached switches.'''
+        for switch, position in self.__switches.items():
+            value = self.at(position)
+            if value and not switch.value and switch.name in self.__on_switch:
+                self.__on_switch[switch.name]()
+            switch.value = value
+
+
+class SimConveyor(SimModel):
+    '''Conveyor belt that moves products between light barriers, products that leave the belt go to the next or previous belt.'''
+    '''
+    Methodes:
+        add_product(): Puts a product on the belt.
+        take_product(): Takes the product nearest to a position from the belt.
+        connect(): Connects the end of this belt with the start of the next belt.
+        get_direction(): Returns the direction of the belt.
+    Attributes:
+        PRODUCT_SIZE (float): Length of a product in mm.
+        HANDOVER (float): Distance a belt pushes a product onto the next belt.
+        name (str): Name of the conveyor.
+        length (float): Length of the belt in mm.
+        products (list): Position and product on the belt, [[position, SimProduct]].
+        next (SimConveyor): Belt after the end.
+        prev (SimConveyor): Belt before the start.
+        __sim (SimRevPiModIO): Simulator.
+        __plus (list): Outputs that move to the end.
+        __minus (list): Outputs that move to the start.
+        __speed (float): Speed in mm per second.
+        __sensors (dict): Light barriers and their position, {SimIO: position}.
+        __counter (SimIO): Counter that counts the belt movement.
+        __counter_step (float): mm per counted value.
+        __count (float): Belt movement since the last reset of the counter.
+    '''
+    PRODUCT_SIZE = 30
+    HANDOVER = 30
+
+    def __init__(self, sim: SimRevPiModIO, name: str, plus: "list[str]", minus: "list[str]"=(), length=300.0, speed=60.0, sensors: "dict[str, float]"=None, counter: str=None, counter_step=20.0):
+        '''Initializes SimConveyor.
+
+        Args:
+            sim (SimRevPiModIO): Simulator.
+            name (str): Name of the conveyor.
+            plus (list): Names of the outputs that move to the end.
+            minus (list): Names of the outputs that move to the start.
+            length (float): Length of the belt in mm.
+            speed (float): Speed in mm per second.
+            sensors (dict): Light barriers and their position in mm, {name: position}.
+            counter (str): Name of a counter that counts the belt movement.
+            counter_step (float): mm per counted value.
+        '''
+        self.name = name
+        self.length = length
+        self.products: "list[list]" = []
+        self.next: SimConveyor = None
+        self.prev: SimConveyor = None
+        self.__sim = sim
+        self.__plus = [sim.add_io(output, OUT) for output in plus]
+        self.__minus = [sim.add_io(output, OUT) for output in minus]
+        self.__speed = speed
+        self.__sensors = {sim.add_io(sensor, INP, True): position for sensor, position in (sensors if sensors else {}).items()}
+        self.__counter = sim.add_io(counter, INP) if counter else None
+        self.__counter_step = counter_step
+        self.__count = 0.0
+        if self.__counter:
+            self.__counter.on_reset = self.__reset_counter
+        sim.add_model(self)
+
+
+    def connect(self, next: "SimConveyor"):
+        '''Connects the end of this belt with the start of the next belt.
+
+        Args:
+            next (SimConveyor): Belt after the end.
+        '''
+        self.next = next
+        next.prev = self
+
+
+    def add_product(self, product: SimProduct, position: float):
+        '''Puts a product on the belt, a product on an other product (product on carrier) takes its place.
+
+        Args:
+            product (SimProduct): The product.
+            position (float): Position in mm.
+        '''
+        for entry in self.products:
+            if abs(entry[0] - position) < self.PRODUCT_SIZE:
+                entry[1] = product
+                return
+        self.products.append([position, product])
+
+
+    def take_product(self, position: float, window: float=None) -> SimProduct:
+        '''Takes the product nearest to a position from the belt.
+
+        Args:
+            position (float): Position in mm.
+            window (float): Max distance to the position, defaults to PRODUCT_SIZE.
+        Returns:
+            SimProduct: The product or None.
+        '''
+        window = self.PRODUCT_SIZE if window == None else window
+        entries = [entry for entry in self.products if abs(entry[0] - position) <= window]
+        if len(entries) == 0:
+            return None
+        entry = min(entries, key=lambda entry: abs(entry[0] - position))
+        self.products.remove(entry)
+        return entry[1]
+
+
+    def get_direction(self) -> int:
+        '''Returns 1 if the belt moves to the end, -1 if it moves to the start, else 0.'''
+        return any(output.value for output in self.__plus) - any(output.value for output in self.__minus)
+
+
+    def step(self, dt: float):
+        direction = self.get_direction()
+        if direction == 0:
+            self.__set_inputs()
+            return
+        distance = direction * self.__speed * dt
+        self.__count += abs(distance)
+        for entry in list(self.products):
+            entry[0] += distance
+            if entry[0] > self.length:
+                if self.next:
+                    self.products.remove(entry)
+                    self.next.add_product(entry[1], entry[0] - self.length)
+                else:
+                    entry[0] = self.length
+            elif entry[0] < 0:
+                if self.prev:
+                    self.products.remove(entry)
+                    self.prev.add_product(entry[1], self.prev.length + entry[0])
+                else:
+                    entry[0] = 0
+
+        # products that were handed over are pushed until they are on the other belt
+        if direction > 0 and self.next and self.next.get_direction() <= 0:
+            for entry in self.next.products:
+                if entry[0] < self.HANDOVER:
+                    entry[0] = min(entry[0] + distance, self.HANDOVER)
+        elif direction < 0 and self.prev and self.prev.get_direction() >= 0:
+            for entry in self.prev.products:
+                if entry[0] > self.prev.length - self.HANDOVER:
+                    entry[0] = max(entry[0] + distance, self.prev.length - self.HANDOVER)
+        self.__set_inputs()
+
+
+    def __reset_counter(self):
+        self.__count = 0.0
+
+
+    def __set_inputs(self):
+        '''Sets the light barriers, a light barrier is False if a product is in front of it.'''
+        for sensor, position in self.__sensors.items():
+            sensor.value = not any(abs(entry[0] - position) <= self.PRODUCT_SIZE / 2 for entry in self.products)
+        if self.__counter:
+            self.__counter.value = int(self.__count / self.__counter_step)
+
+
+class SimStation(SimModel):
+    '''Place that holds products (oven, table, bay, rack slot), can create products (source) or remove them (sink).'''
+    '''
+    Methodes:
+        add_product(): Puts a product on the station.
+        take_product(): Takes a product from the station.
+    Attributes:
+        name (str): Name of the station.
+        products (list): Products at the station.
+        __sim (SimRevPiModIO): Simulator.
+        __sensor (SimIO): Light barrier that detects a product.
+        __source (str): Color of the products that are created, None if no products are created.
+        __sink (bool): Products are removed and counted as finished.
+    '''
+
+    def __init__(self, sim: SimRevPiModIO, name: str, sensor: str=None, source: str=None, sink=False, products: "list[SimProduct]"=None):
+        '''Initializes SimStation.
+
+        Args:
+            sim (SimRevPiModIO): Simulator.
+            name (str): Name of the station.
+            sensor (str): Name of a light barrier that detects a product.
+            source (str): Color of created products, a product is created if one is taken.
+            sink (bool): Products are removed and counted as finished.
+            products (list): Products at the start.
+        '''
+        self.name = name
+        self.products: "list[SimProduct]" = list(products) if products else []
+        self.__sim = sim
+        self.__sensor = sim.add_io(sensor, INP, True) if sensor else None
+        self.__source = source
+        self.__sink = sink
+        sim.add_model(self)
+
+
+    def add_product(self, product: SimProduct, position: float=None):
+        if self.__sink:
+            self.__sim.finish(product)
+            return
+        if self.products:
+            # product on carrier
+            self.products[-1] = product
+            return
+        self.products.append(product)
+
+
+    def take_product(self, position: float=None, window: float=None) -> SimProduct:
+        if self.products:
+            return self.products.pop()
+        if self.__source:
+            return SimProduct(self.__source)
+        return None
+
+
+    def step(self, dt: float):
+        if self.__sensor:
+            self.__sensor.value = len(self.products) == 0
+
+
+class SimGripper(SimModel):
+    '''Gripper that takes a product from a station and puts it at an other station.
+    The product is taken when holding() becomes True and put down when it becomes False, at the first station whose at() is True.
+    '''
+    '''
+    Attributes:
+        name (str): Name of the gripper.
+        product (SimProduct): Held product.
+        __sim (SimRevPiModIO): Simulator.
+        __holding (callable): Returns True if the gripper should hold a product.
+        __stations (list): Stations the gripper reaches, [(at(), station, position)].
+        __last (bool): Last value of holding().
+    '''
+
+    def __init__(self, sim: SimRevPiModIO, name: str, holding, stations: "list[tuple]"):
+        '''Initializes SimGripper.
+
+        Args:
+            sim (SimRevPiModIO): Simulator.
+            name (str): Name of the gripper.
+            holding (callable): Returns True if the gripper should hold a product.
+            stations (list): Stations the gripper reaches, [(at(), SimConveyor | SimStation, position)].
+        '''
+        self.name = name
+        self.product: SimProduct = None
+        self.__sim = sim
+        self.__holding = holding
+        self.__stations = stations
+        self.__last = False
+        sim.add_model(self)
+
+
+    def step(self, dt: float):
+        holding = bool(self.__holding())
+        if holding == self.__last:
+            return
+        self.__last = holding
+        station, position = self.__get_station()
+        if holding and self.product == None and station != None:
+            self.product = station.take_product(position)
+        elif not holding and self.product != None:
+            if station == None:
+                self.__sim.lost.append((self.__sim.sim_time, self.product))
+                self.__sim.log.warning(f"{self.name} dropped {self.product}")
+            else:
+                station.add_product(self.product, position)
+            self.product = None
+
+
+    def __get_station(self) -> tuple:
+        '''Returns the first station and position whose at() is True.'''
+        for at, station, position in self.__stations:
+            if at():
+                return station, position
+        return None, None
+
+
+class SimCompressor(SimModel):
+    '''Compressor that builds up pressure while it runs, the pressure goes from 0 to 1.'''
+    '''
+    Attributes:
+        pressure (float): Pressure from 0 to 1.
+        __output (SimIO): Output of the compressor.
+        __rise_time (float): Time from 0 to full pressure in s.
+        __leak_time (float): Time from full pressure to 0 if the compressor is off in s.
+    '''
+
+    def __init__(self, sim: SimRevPiModIO, output: str, rise_time=0.3, leak_time=3.0):
+        '''Initializes SimCompressor.
+
+        Args:
+            sim (SimRevPiModIO): Simulator.
+            output (str): Name of the output of the compressor.
+            rise_time (float): Time from 0 to full pressure in s.
+            leak_time (float): Time from full pressure to 0 if the compressor is off in s.
+        '''
+        self.pressure = 0.0
+        self.__output = sim.add_io(output, OUT)
+        self.__rise_time = rise_time
+        self.__leak_time = leak_time
+        sim.add_model(self)
+
+
+    def step(self, dt: float):
+        if self.__output.value:
+            self.pressure = min(self.pressure + dt / self.__rise_time, 1)
+        else:
+            self.pressure = max(self.pressure - dt / self.__leak_time, 0)
+
+
+class SimValve(SimModel):
+    '''Valve of a pneumatic cylinder, action() is called once per opening when the compressor has enough pressure.'''
+    '''
+    Attributes:
+        __output (SimIO): Output of the valve.
+        __compressor (SimCompressor): Compressor for the valve.
+        __action (callable): Called when the cylinder moves.
+        __done (bool): True if action() was called for the current opening.
+    '''
+    MIN_PRESSURE = 0.3
+
+    def __init__(self, sim: SimRevPiModIO, output: str, compressor: SimCompressor, action):
+        '''Initializes SimValve.
+
+        Args:
+            sim (SimRevPiModIO): Simulator.
+            output (str): Name of the output of the valve.
+            compressor (SimCompressor): Compressor for the valve.
+            action (callable): Called when the cylinder moves.
+        '''
+        self.__output = sim.add_io(output, OUT)
+        self.__compressor = compressor
+        self.__action = action
+        self.__done = False
+        sim.add_model(self)
+
+
+    def step(self, dt: float):
+        if not self.__output.value:
+            self.__done = False
+        elif not self.__done and self.__compressor.pressure >= self.MIN_PRESSURE:
+            self.__done = True
+            self.__action()
@@ -7,12 +7,11 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.01.12"
 
-import threading
 from time import sleep
 from enum import Enum
 
 from lib.logger import log
-from lib.machine import Machine, MainState
+from lib.machine import Machine, MainState, changes, submit
 from lib.sensor import Sensor, SensorTimeoutError, EncoderOverflowError, NoDetectionError
 from lib.actuator import Actuator
 from lib.conveyor import Conveyor
@@ -44,7 +43,7 @@ class SortLine(Machine):
         super().__init__(revpi, name, line_name)
         self.position = 1
         self.color = "WHITE"
-        self.start_next_machine = False
+        self.__start_next_machine = False
 
         global log
         self.log = log.getChild(f"{self.line_name}(Sort)")
@@ -52,6 +51,18 @@ class SortLine(Machine):
         self.log.debug(f"Created {type(self).__name__}: {self.name}")
 
 
+    @property
+    def start_next_machine(self) -> bool:
+        '''Is set to True if next machine should be started, wakes the factory loop on change.'''
+        return self.__start_next_machine
+
+    @start_next_machine.setter
+    def start_next_machine(self, start_next_machine: bool):
+        if start_next_machine != self.__start_next_machine:
+            changes.wake()
+        self.__start_next_machine = start_next_machine
+
+
     def run(self, color: str=None, as_thread=True):
         '''Runs the Sorting Line routine.
         
@@ -60,8 +71,7 @@ class SortLine(Machine):
             as_thread (bool): Runs the function as a thread.
         '''      
         if as_thread == True:
-            self.thread = threading.Thread(target=self.run, args=(color, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.run, color, False)
             return
 
         self.switch_state(State.START)
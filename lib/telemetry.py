@@ -0,0 +1,252 @@
+'''This module records the motion of every axis in a ring buffer, to find out why a move was slow or timed out'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+import os
+import threading
+import time
+from array import array
+from collections import deque
+
+from lib.logger import log
+
+# number of samples every recorder holds
+RECORDER_SIZE = 4096
+# number of moves every recorder holds for the statistics
+MOVES_SIZE = 64
+# directory for the dumps after a timeout, not LOG_DIR because the logger expects only logs there
+TELEMETRY_DIR = "log_telemetry"
+# seconds that are dumped after a timeout, longer than the longest timeout of a move
+DUMP_SECONDS = 30
+# columns of every sample
+COLUMNS = ("time", "value", "pwm", "direction")
+
+# recorder of every axis, {name: AxisRecorder}
+recorders: "dict[str, AxisRecorder]" = {}
+recorders_lock = threading.Lock()
+
+def get_recorder(name: str) -> "AxisRecorder":
+    '''Returns the recorder of the axis, creates it on first use.
+
+    Args:
+        name (str): Name of the axis (actuator name and type).
+    Returns:
+        AxisRecorder: Recorder of the axis.
+    '''
+    with recorders_lock:
+        recorder = recorders.get(name)
+        if recorder == None:
+            recorder = recorders[name] = AxisRecorder(name)
+        return recorder
+
+
+def get_axis_stats() -> "dict[str, dict]":
+    '''Returns the speed and overshoot statistics of every axis that moved to an encoder value.
+
+    Returns:
+        dict: {name: statistics}, see AxisRecorder.get_stats().
+    '''
+    with recorders_lock:
+        axes = sorted(recorders.items())
+    stats = {name: recorder.get_stats() for name, recorder in axes}
+    return {name: axis_stats for name, axis_stats in stats.items() if axis_stats["moves"] > 0}
+
+
+class AxisRecorder():
+    '''Records timestamp, encoder value, pwm and direction of an axis in a preallocated ring buffer.'''
+    '''
+    Methodes:
+        set_drive(): Sets the pwm and direction that are recorded with the next samples.
+        start_move(): Starts a move to target, used for the statistics.
+        end_move(): Ends the last move.
+        record(): Records a sample.
+        get_arrays(): Returns the samples of the last seconds as arrays.
+        to_numpy(): Returns the samples of the last seconds as NumPy arrays.
+        to_csv(): Writes the samples of the last seconds to a csv file.
+        dump(): Writes the samples of the last DUMP_SECONDS to TELEMETRY_DIR.
+        get_stats(): Returns speed and overshoot statistics of the recorded moves.
+    Attributes:
+        name (str): Name of the axis.
+        size (int): Number of samples the recorder holds.
+        __columns (tuple): Arrays for time, value, pwm and direction.
+        __index (int): Index of the next sample.
+        __count (int): Number of recorded samples, at most size.
+        __pwm (float): Current pwm in percent.
+        __direction (float): Current direction, index in __directions plus 1, 0 if stopped.
+        __directions (list): Names of the directions of the axis.
+        __moves (deque): [start time, start value, target, end time, stop value] of the last moves, end time is None while moving.
+        __lock (Lock): Lock for writing and reading the buffer.
+    '''
+
+    def __init__(self, name: str, size: int=RECORDER_SIZE):
+        '''Initializes AxisRecorder.
+
+        Args:
+            name (str): Name of the axis.
+            size (int): Number of samples the recorder holds.
+        '''
+        self.name = name
+        self.size = size
+        self.__columns = tuple(array("d", bytes(8 * size)) for _ in COLUMNS)
+        self.__index = 0
+        self.__count = 0
+        self.__pwm = 0.0
+        self.__direction = 0.0
+        self.__directions: "list[str]" = []
+        self.__moves: "deque[tuple]" = deque(maxlen=MOVES_SIZE)
+        self.__lock = threading.Lock()
+
+        global log
+        self.log = log.getChild("Telemetry")
+
+
+    def set_drive(self, pwm: float, direction: str):
+        '''Sets the pwm and direction that are recorded with the next samples.
+
+        Args:
+            pwm (float): PWM in percent, 0 if stopped.
+            direction (str): Actuator direction, "" if stopped.
+        '''
+        if pwm == 0:
+            self.__direction = 0.0
+        else:
+            if direction not in self.__directions:
+                self.__directions.append(direction)
+            self.__direction = float(self.__directions.index(direction) + 1)
+        self.__pwm = float(pwm)
+
+
+    def start_move(self, start_value: int, target: int):
+        '''Starts a move to target, used for the speed and overshoot statistics.
+
+        Args:
+            start_value (int): Encoder value at the start.
+            target (int): Encoder value of the target.
+        '''
+        self.record(start_value)
+        self.__moves.append([time.time(), start_value, target, None, None])
+
+
+    def end_move(self, stop_value: int):
+        '''Ends the last move, only ended moves are used for the statistics.
+
+        Args:
+            stop_value (int): Encoder value at the stop.
+        '''
+        self.record(stop_value)
+        if self.__moves:
+            self.__moves[-1][3:] = [time.time(), stop_value]
+
+
+    def record(self, value: float):
+        '''Records a sample with the current time, pwm and direction.
+
+        Args:
+            value (float): Encoder value or sensor value.
+        '''
+        with self.__lock:
+            times, values, pwms, directions = self.__columns
+            index = self.__index
+            times[index] = time.time()
+            values[index] = value
+            pwms[index] = self.__pwm
+            directions[index] = self.__direction
+            self.__index = (index + 1) % self.size
+            if self.__count < self.size:
+                self.__count += 1
+
+
+    def get_arrays(self, seconds: float=None) -> "dict[str, array]":
+        '''Returns the samples of the last seconds as arrays, the oldest first.
+
+        Args:
+            seconds (float): Time span to return, all samples if None.
+        Returns:
+            dict: {column: array('d')} for every column of COLUMNS.
+        '''
+        with self.__lock:
+            start = (self.__index - self.__count) % self.size
+            columns = []
+            for column in self.__columns:
+                if start + self.__count <= self.size:
+                    columns.append(column[start:start + self.__count])
+                else:
+                    columns.append(column[start:] + column[:self.__index])
+
+        if seconds != None:
+            since = time.time() - seconds
+            first = next((i for i, timestamp in enumerate(columns[0]) if timestamp >= since), len(columns[0]))
+            columns = [column[first:] for column in columns]
+        return dict(zip(COLUMNS, columns))
+
+
+    def to_numpy(self, seconds: float=None) -> dict:
+        '''Returns the samples of the last seconds as NumPy arrays, needs numpy.
+
+        Args:
+            seconds (float): Time span to return, all samples if None.
+        Returns:
+            dict: {column: numpy.ndarray} for every column of COLUMNS.
+        Raises:
+            ImportError: numpy is not installed.
+        '''
+        import numpy
+        return {name: numpy.frombuffer(column, dtype=numpy.float64) for name, column in self.get_arrays(seconds).items()}
+
+
+    def to_csv(self, file: str, seconds: float=None):
+        '''Writes the samples of the last seconds to a csv file, the direction is written as name.
+
+        Args:
+            file (str): Path of the csv file.
+            seconds (float): Time span to write, all samples if None.
+        '''
+        columns = self.get_arrays(seconds)
+        directions = [""] + self.__directions
+        with open(file, "w") as fp:
+            fp.write(";".join(COLUMNS) + "\n")
+            for timestamp, value, pwm, direction in zip(*columns.values()):
+                fp.write(f"{timestamp:.3f};{value:g};{pwm:g};{directions[int(direction)]}\n")
+
+
+    def dump(self) -> str:
+        '''Writes the samples of the last DUMP_SECONDS to TELEMETRY_DIR.
+
+        Returns:
+            str: Path of the csv file.
+        '''
+        os.makedirs(TELEMETRY_DIR, exist_ok=True)
+        file = f"{TELEMETRY_DIR}/{self.name}_{time.strftime('%H%M%S')}.csv"
+        self.to_csv(file, DUMP_SECONDS)
+        self.log.warning(f"{self.name} :Telemetry written to {file}")
+        return file
+
+
+    def get_stats(self) -> dict:
+        '''Returns speed and overshoot statistics of the recorded moves.
+        The overshoot of a move is the distance the axis went past the target until the stop, negative if it stopped before.
+
+        Returns:
+            dict: {"moves", "speed_mean", "speed_max", "overshoot_mean", "overshoot_max"}, speeds in values per second.
+        '''
+        speeds = []
+        overshoots = []
+        for start_time, start_value, target, end_time, stop_value in list(self.__moves):
+            if end_time == None or end_time <= start_time:
+                continue
+            sign = 1 if target > start_value else -1
+            overshoots.append((stop_value - target) * sign)
+            speeds.append(abs(stop_value - start_value) / (end_time - start_time))
+
+        return {
+            "moves": len(overshoots),
+            "speed_mean": round(sum(speeds) / len(speeds), 1) if speeds else 0,
+            "speed_max": round(max(speeds), 1) if speeds else 0,
+            "overshoot_mean": round(sum(overshoots) / len(overshoots), 1) if overshoots else 0,
+            "overshoot_max": round(max(overshoots), 1) if overshoots else 0
+        }
@@ -7,10 +7,10 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.02.02"
 
-import threading
 from time import sleep
 
 from lib.logger import log
+from lib.machine import submit
 from lib.actuator import Actuator
 from lib.robot_3d import Robot3D, Position, State, GetProductError, ObstructionError
 
@@ -53,8 +53,7 @@ class VacRobot(Robot3D):
             as_thread (bool): Runs the function as a thread.
         '''
         if as_thread:
-            self.thread = threading.Thread(target=self.grip, args=(False,), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.grip, False)
             return
 
         try:
@@ -77,8 +76,7 @@ class VacRobot(Robot3D):
             as_thread (bool): Runs the function as a thread.
         '''
         if as_thread:
-            self.thread = threading.Thread(target=self.release, args=(with_check_sens, False,), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.release, with_check_sens, False)
             return
 
         try:
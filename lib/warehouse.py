@@ -7,15 +7,15 @@ __copyright__ = "Lukas Beck"
 __license__ = "GPL"
 __version__ = "2024.01.12"
 
-import threading
 from enum import Enum
-import json
 
 from lib.logger import log
-from lib.machine import Machine, MainState
+from lib.machine import Machine, MainState, submit
 from lib.sensor import Sensor, SensorTimeoutError, EncoderOverflowError
-from lib.actuator import Actuator
+from lib.actuator import Actuator, get_axis_speed
 from lib.conveyor import Conveyor
+from lib.wh_content import get_wh_content, EMPTY
+from lib.wh_slot_policy import get_slot_policy, get_travel_time
 
 class State(Enum):
     INIT = 0
@@ -44,6 +44,8 @@ POSITIONS: "list[list[tuple]]" = [
         (3865, 1650)
     ]
 ]
+# slot of every position, {position: (hor, ver)}
+SLOTS: "dict[tuple, tuple]" = {POSITIONS[hor][ver]: (hor, ver) for hor in range(3) for ver in range(3)}
 
 class Warehouse(Machine):
     '''Controls the Warehouse'''
@@ -52,14 +54,18 @@ class Warehouse(Machine):
         init(): Move to init Position
         store_product(): Stores a product at given position.
         retrieve_product(): Retrieves a product from given position.
+        __select_slot(): Returns the slot chosen by the slot policy.
+        __get_speeds(): Returns the measured speeds of both axes.
         __move_to_position(): Moves Crane given coordinates.
     Attributes:
+        SLOT_POLICY (str): Name of the policy that chooses the slots (nearest, balanced, abc).
         __POS_CB_HORIZONTAL (int): Horizontal position of conveyor belt.
         __POS_CB_VERTICAL (int): Vertical position of conveyor belt.
         __MOVE_THRESHOLD_HOR (int): Only moves the horizontal axis if movement is more.
         __MOVE_THRESHOLD_VER (int): Only moves the vertical axis if movement is more.
         __LIFT_VALUE_RACK (int): Value that the arm lifts a Carrier at rack.
         __LIFT_VALUE_CB (int): Value that the arm lifts a Carrier at cb.
+        __DEFAULT_SPEED (int): Speed of an axis in encoder values per second until it is measured.
         __ref_sw_arm_front (str): Reference switch name for arm in extended state.
         __ref_sw_arm_back (str): Reference switch name for arm in retracted state.
         __cb (Conveyor): Conveyor object for in-/output conveyor.
@@ -69,6 +75,7 @@ class Warehouse(Machine):
         __motor_hor (Actuator): Motor for horizontal axis.
         __motor_ver (Actuator): Motor for vertical axis.
         __color (str): Color of product.
+        __content (WHContent): Content of the rack.
     '''
     __POS_CB_HORIZONTAL = 85
     __POS_CB_VERTICAL = 1450
@@ -76,7 +83,9 @@ class Warehouse(Machine):
     __MOVE_THRESHOLD_VER = 40
     __LIFT_VALUE_RACK = 150
     __LIFT_VALUE_CB = 150
+    __DEFAULT_SPEED = 400
     __CONTENT_FILE = "wh_content.json"
+    SLOT_POLICY = "nearest"
 
     def __init__(self, revpi, name: str, line_name: str):
         '''Initializes the Warehouse.
@@ -106,6 +115,7 @@ class Warehouse(Machine):
         self.__motor_hor._Actuator__ENCODER_TRIGGER_THRESHOLD = 25
 
         self.__color = "COLOR_UNKNOWN"
+        self.__content = get_wh_content(self.__CONTENT_FILE)
 
         global log
         self.log = log.getChild(f"{self.line_name}(Ware)")
@@ -124,8 +134,7 @@ class Warehouse(Machine):
         '''
         # call this function again as a thread
         if as_thread:
-            self.thread = threading.Thread(target=self.init, args=(for_store, for_retrieve, to_end, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.init, for_store, for_retrieve, to_end, False)
             return
         
         self.switch_state(State.INIT)
@@ -175,8 +184,7 @@ class Warehouse(Machine):
         '''
         # call this function again as a thread
         if as_thread:
-            self.thread = threading.Thread(target=self.store_product, args=(position, color, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.store_product, position, color, False)
             return
 
         color = color if color != None else self.__color
@@ -186,21 +194,12 @@ class Warehouse(Machine):
                 raise(Exception("No Product to store found"))
             
             if position == None:
-                # find Empty bay
-                with open(self.__CONTENT_FILE, "r") as fp:
-                    positions = json.load(fp)["content"]
-
                 # find the nearest empty bay
-                for hor in range(3):
-                    for ver in range(3):
-                        if positions[hor][ver] == "Empty":
-                            position = POSITIONS[hor][ver]
-                            break
-                    else:
-                        continue
-                    break
-                else:
+                slot = self.__select_slot(color, store=True)
+                if slot == None:
                     raise LookupError(f"{self.name}: No empty spaces left.")
+                position = POSITIONS[slot[0]][slot[1]]
+            hor, ver = SLOTS[position]
             
             horizontal = position[0]
             vertical = position[1]
@@ -227,18 +226,7 @@ class Warehouse(Machine):
             self.__motor_loading.run_to_sensor("BWD", self.__ref_sw_arm_back)
             
             # save Product to file
-            for hor in range(3):
-                for ver in range(3):
-                    if POSITIONS[hor][ver] == position:
-                        break
-                else:
-                    continue
-                break
-            with open(self.__CONTENT_FILE, "r") as fp:
-                json_obj = json.load(fp)
-            json_obj["content"][hor][ver] = color
-            with open(self.__CONTENT_FILE, "w") as fp:
-                json.dump(json_obj, fp, indent=4)
+            self.__content.set(hor, ver, color)
 
         except (SensorTimeoutError, ValueError, EncoderOverflowError, LookupError) as error:
             self.problem_handler(error)
@@ -259,8 +247,7 @@ class Warehouse(Machine):
         '''
         # call this function again as a thread
         if as_thread:
-            self.thread = threading.Thread(target=self.retrieve_product, args=(position, color, False), name=self.name)
-            self.thread.start()
+            self.thread = submit(self.name, self.retrieve_product, position, color, False)
             return
 
         color = color if color != None else self.__color
@@ -268,20 +255,11 @@ class Warehouse(Machine):
         try:
             if position == None:
                 # find wanted color
-                with open(self.__CONTENT_FILE, "r") as fp:
-                    positions = json.load(fp)["content"]
-
-                # find the nearest empty bay
-                for hor in range(3):
-                    for ver in range(3):
-                        if positions[hor][ver] == color:
-                            position = POSITIONS[hor][ver]
-                            break
-                    else:
-                        continue
-                    break
-                else:
+                slot = self.__select_slot(color, store=False)
+                if slot == None:
                     raise LookupError(f"{self.name}: Color {color} not found.")
+                position = POSITIONS[slot[0]][slot[1]]
+            hor, ver = SLOTS[position]
             
             horizontal = position[0]
             vertical = position[1]
@@ -313,18 +291,8 @@ class Warehouse(Machine):
             self.__cb.run_to_stop_sensor("BWD", self.name + "_SENS_OUT", stop_delay_in_ms=200, as_thread=False)
 
             # save "empty" to file
-            for hor in range(3):
-                for ver in range(3):
-                    if POSITIONS[hor][ver] == position:
-                        break
-                else:
-                    continue
-                break
-            with open(self.__CONTENT_FILE, "r") as fp:
-                json_obj = json.load(fp)
-            json_obj["content"][hor][ver] = "Empty"
-            with open(self.__CONTENT_FILE, "w") as fp:
-                json.dump(json_obj, fp, indent=4)
+            self.__content.set(hor, ver, EMPTY)
+            get_slot_policy(self.SLOT_POLICY).on_retrieve(color)
             
         except (SensorTimeoutError, ValueError, EncoderOverflowError, LookupError) as error:
             self.problem_handler(error)
@@ -335,6 +303,48 @@ class Warehouse(Machine):
             self.position += 1
 
 
+    def __select_slot(self, color: str, store: bool) -> tuple:
+        '''Returns the slot chosen by the slot policy from the estimated travel times of the crane.
+        Storing starts at the cb, retrieving starts at the current position and ends at the cb.
+
+        Args:
+            color (str): Color of the Product.
+            store (bool): True if an empty slot for storing is needed, False if a slot with color is needed.
+        Returns:
+            tuple: (hor, ver) of the slot or None if there is none.
+        '''
+        slots = self.__content.get_slots(EMPTY if store else color)
+        if len(slots) == 0:
+            return None
+
+        speeds = self.__get_speeds()
+        position_cb = (self.__POS_CB_HORIZONTAL, self.__POS_CB_VERTICAL)
+        if store:
+            times = {slot: get_travel_time(position_cb, POSITIONS[slot[0]][slot[1]], speeds) for slot in slots}
+        else:
+            current = (self.__encoder_hor.get_current_value(), self.__encoder_ver.get_current_value())
+            times = {slot: get_travel_time(current, POSITIONS[slot[0]][slot[1]], speeds)
+                     + get_travel_time(POSITIONS[slot[0]][slot[1]], position_cb, speeds) for slot in slots}
+
+        slot = get_slot_policy(self.SLOT_POLICY).select(times, color, store, self.__content)
+        self.log.info(f"{self.name} :{self.SLOT_POLICY} chose slot: {slot}, estimated travel time: {times[slot]:.2f}s")
+        return slot
+
+
+    def __get_speeds(self) -> tuple:
+        '''Returns the measured speeds of both axes, the mean of both directions.
+
+        Returns:
+            tuple: (horizontal, vertical) speeds in encoder values per second.
+        '''
+        speeds = []
+        for motor, directions in ((self.__motor_hor, ("TO_RACK", "TO_CB")), (self.__motor_ver, ("UP", "DOWN"))):
+            measured = [get_axis_speed(f"{motor.name}_{direction}") for direction in directions]
+            measured = [speed for speed in measured if speed != None]
+            speeds.append(sum(measured) / len(measured) if measured else self.__DEFAULT_SPEED)
+        return tuple(speeds)
+
+
     def __move_to_position(self, horizontal: int, vertical: int):
         '''Moves Crane given coordinates, set a coordinate to -1 to not move that axis.
 
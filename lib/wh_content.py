@@ -0,0 +1,209 @@
+'''In memory content of the warehouse rack, saved to the content file in the background'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+import atexit
+import json
+import os
+import threading
+from copy import deepcopy
+
+try:
+    from lib.logger import log
+except ModuleNotFoundError:
+    from logger import log
+
+EMPTY = "Empty"
+
+# content of every content file, {file: WHContent}
+wh_contents: "dict[str, WHContent]" = {}
+wh_contents_lock = threading.Lock()
+
+def get_wh_content(file: str) -> "WHContent":
+    '''Returns the WHContent of the given file, the file is only read once.
+
+    Args:
+        file (str): Path of the content json file.
+    Returns:
+        WHContent: Content of the warehouse.
+    '''
+    with wh_contents_lock:
+        content = wh_contents.get(file)
+        if content == None:
+            content = WHContent(file)
+            wh_contents[file] = content
+        return content
+
+
+class WHContent():
+    '''Holds the content of the warehouse rack in memory with an index of the slots for every color.
+    Changes are written to the file by a background thread, the file is replaced atomically.
+    '''
+    '''
+    Methodes:
+        find(): Returns a slot with the given color.
+        get_slots(): Returns all slots with the given color.
+        get(): Returns the color at a slot.
+        set(): Sets the color at a slot.
+        get_content(): Returns a copy of the whole content.
+        set_content(): Replaces the whole content.
+        flush(): Writes the content to the file now.
+    Attributes:
+        file (str): Path of the content json file.
+        __json_obj (dict): Whole content of the file.
+        __content (list): Color at every slot, first array is the column nearest to the cb.
+        __index (dict): Slots for every color, {color: set((hor, ver))}.
+        __lock (RLock): Lock for every change.
+        __write_lock (Lock): Lock for writing the file.
+        __version (int): Counts the changes of the content.
+        __written_version (int): Version of the content in the file.
+        __changed (Event): Wakes the background thread if the content has to be written.
+        __writer (Thread): Background thread that writes the file.
+        log (Logger): Log object to print to log.
+    '''
+
+    def __init__(self, file: str):
+        '''Initializes WHContent and reads the content file.
+
+        Args:
+            file (str): Path of the content json file.
+        '''
+        self.file = file
+
+        global log
+        self.log = log.getChild("WHContent")
+
+        with open(self.file, "r") as fp:
+            self.__json_obj: dict = json.load(fp)
+        self.__content: "list[list[str]]" = self.__json_obj["content"]
+        self.__index: "dict[str, set[tuple]]" = {}
+        self.__lock = threading.RLock()
+        self.__write_lock = threading.Lock()
+        self.__version = 0
+        self.__written_version = 0
+        self.__build_index()
+
+        self.__changed = threading.Event()
+        self.__writer = threading.Thread(target=self.__write_loop, name="WHContent", daemon=True)
+        self.__writer.start()
+        atexit.register(self.flush)
+
+
+    def find(self, color: str) -> tuple:
+        '''Returns a slot with the given color, the first in column order.
+
+        Args:
+            color (str): Color of the slot (WHITE, RED, BLUE, COLOR_UNKNOWN, Carrier, Empty).
+        Returns:
+            tuple: (hor, ver) of the slot or None if there is none.
+        '''
+        with self.__lock:
+            slots = self.__index.get(color)
+            if not slots:
+                return None
+            return min(slots)
+
+
+    def get_slots(self, color: str) -> "list[tuple]":
+        '''Returns all slots with the given color.
+
+        Args:
+            color (str): Color of the slots.
+        Returns:
+            list: (hor, ver) of every slot.
+        '''
+        with self.__lock:
+            return list(self.__index.get(color, ()))
+
+
+    def get(self, hor: int, ver: int) -> str:
+        '''Returns the color at a slot.
+
+        Args:
+            hor (int): Column of the slot.
+            ver (int): Row of the slot.
+        '''
+        return self.__content[hor][ver]
+
+
+    def set(self, hor: int, ver: int, color: str):
+        '''Sets the color at a slot and saves it in the background.
+
+        Args:
+            hor (int): Column of the slot.
+            ver (int): Row of the slot.
+            color (str): Color of the slot (WHITE, RED, BLUE, COLOR_UNKNOWN, Carrier, Empty).
+        '''
+        with self.__lock:
+            old_color = self.__content[hor][ver]
+            self.__index[old_color].discard((hor, ver))
+            self.__content[hor][ver] = color
+            self.__index.setdefault(color, set()).add((hor, ver))
+            self.__version += 1
+        self.__changed.set()
+
+
+    def get_content(self) -> "list[list[str]]":
+        '''Returns a copy of the whole content.'''
+        with self.__lock:
+            return deepcopy(self.__content)
+
+
+    def set_content(self, content: "list[list[str]]"):
+        '''Replaces the whole content and saves it in the background.
+
+        Args:
+            content (list): Color at every slot, first array is the column nearest to the cb.
+        '''
+        with self.__lock:
+            self.__content = deepcopy(content)
+            self.__json_obj["content"] = self.__content
+            self.__build_index()
+            self.__version += 1
+        self.__changed.set()
+
+
+    def flush(self):
+        '''Writes the content to the file now if it has changed, waits for a running write of the background thread.'''
+        self.__write()
+
+
+    def __build_index(self):
+        '''Builds the index of the slots for every color.'''
+        self.__index = {}
+        for hor, column in enumerate(self.__content):
+            for ver, color in enumerate(column):
+                self.__index.setdefault(color, set()).add((hor, ver))
+
+
+    def __write_loop(self):
+        '''Writes the content every time it changed.'''
+        while True:
+            self.__changed.wait()
+            self.__changed.clear()
+            self.__write()
+
+
+    def __write(self):
+        '''Writes the content to a temporary file and replaces the content file with it, if it is newer than the file.'''
+        tmp_file = self.file + ".tmp"
+        with self.__write_lock:
+            with self.__lock:
+                version = self.__version
+                if version <= self.__written_version:
+                    return
+                json_str = json.dumps(self.__json_obj, indent=4)
+            try:
+                with open(tmp_file, "w") as fp:
+                    fp.write(json_str)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                os.replace(tmp_file, self.file)
+                self.__written_version = version
+            except Exception as e:
+                self.log.error(f"Could not save warehouse content: {e}")
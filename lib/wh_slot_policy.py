@@ -0,0 +1,150 @@
+'''Policies that choose the slot of the warehouse rack for storing and retrieving a product'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+from collections import Counter
+
+from lib.wh_content import WHContent, EMPTY
+
+def get_travel_time(start: tuple, end: tuple, speeds: tuple) -> float:
+    '''Returns the estimated travel time of the crane, both axes move at the same time.
+
+    Args:
+        start (tuple): (horizontal, vertical) encoder values of the start.
+        end (tuple): (horizontal, vertical) encoder values of the end.
+        speeds (tuple): (horizontal, vertical) speeds in encoder values per second.
+    Returns:
+        float: Travel time in seconds.
+    '''
+    return max(abs(end[0] - start[0]) / speeds[0], abs(end[1] - start[1]) / speeds[1])
+
+
+class SlotPolicy():
+    '''Nearest-first, chooses the slot with the shortest travel time.'''
+    '''
+    Methodes:
+        select(): Returns the slot that should be used.
+        on_retrieve(): Is called after a product was retrieved.
+    Attributes:
+        name (str): Name of the policy.
+    '''
+    name = "nearest"
+
+    def select(self, times: "dict[tuple, float]", color: str, store: bool, content: WHContent) -> tuple:
+        '''Returns the slot that should be used.
+
+        Args:
+            times (dict): Travel time for every possible slot, {(hor, ver): time}.
+            color (str): Color of the product.
+            store (bool): True if the product is stored, False if it is retrieved.
+            content (WHContent): Content of the rack.
+        Returns:
+            tuple: (hor, ver) of the slot.
+        '''
+        return min(times, key=lambda slot: (times[slot], slot))
+
+
+    def on_retrieve(self, color: str):
+        '''Is called after a product was retrieved.
+
+        Args:
+            color (str): Color of the retrieved product.
+        '''
+        pass
+
+
+class BalancedPolicy(SlotPolicy):
+    '''Fills the columns evenly, stores in the emptiest and retrieves from the fullest column, the travel time decides between slots of equally filled columns.'''
+    name = "balanced"
+
+    def select(self, times: "dict[tuple, float]", color: str, store: bool, content: WHContent) -> tuple:
+        # number of empty slots in every column
+        empty = Counter(hor for hor, ver in content.get_slots(EMPTY))
+        if store:
+            return min(times, key=lambda slot: (-empty[slot[0]], times[slot], slot))
+        return min(times, key=lambda slot: (empty[slot[0]], times[slot], slot))
+
+
+class ABCPolicy(SlotPolicy):
+    '''Sorts the colors into classes by how often they are retrieved, A-colors are stored nearest to the cb and C-colors farthest.'''
+    '''
+    Methodes:
+        get_class(): Returns the class of a color.
+    Attributes:
+        __A_SHARE (float): Share of the retrieves that the A-colors make up.
+        __B_SHARE (float): Share of the retrieves that the A- and B-colors make up.
+        __demand (Counter): Number of retrieves for every color.
+    '''
+    name = "abc"
+    __A_SHARE = 0.8
+    __B_SHARE = 0.95
+
+    def __init__(self):
+        '''Initializes ABCPolicy.'''
+        self.__demand: "Counter[str]" = Counter()
+
+
+    def select(self, times: "dict[tuple, float]", color: str, store: bool, content: WHContent) -> tuple:
+        if not store:
+            return super().select(times, color, store, content)
+
+        slots = sorted(times, key=lambda slot: (times[slot], slot))
+        color_class = self.get_class(color)
+        if color_class == "A":
+            return slots[0]
+        elif color_class == "B":
+            return slots[(len(slots) - 1) // 2]
+        return slots[-1]
+
+
+    def on_retrieve(self, color: str):
+        self.__demand[color] += 1
+
+
+    def get_class(self, color: str) -> str:
+        '''Returns the class of a color, all colors are A-colors until the first retrieve.
+
+        Args:
+            color (str): Color of the product.
+        Returns:
+            str: "A", "B" or "C".
+        '''
+        total = sum(self.__demand.values())
+        if total == 0:
+            return "A"
+        share = 0
+        for demand_color, demand in self.__demand.most_common():
+            if share < self.__A_SHARE * total:
+                color_class = "A"
+            elif share < self.__B_SHARE * total:
+                color_class = "B"
+            else:
+                color_class = "C"
+            if demand_color == color:
+                return color_class
+            share += demand
+        return "C"
+
+
+# every available slot policy, {name: SlotPolicy}
+slot_policies: "dict[str, SlotPolicy]" = {policy.name: policy for policy in (SlotPolicy(), BalancedPolicy(), ABCPolicy())}
+
+def get_slot_policy(name: str) -> SlotPolicy:
+    '''Returns the slot policy with the given name.
+
+    Args:
+        name (str): Name of the policy (nearest, balanced, abc).
+    Returns:
+        SlotPolicy: The policy.
+    Raises:
+        ValueError: No policy with this name.
+    '''
+    policy = slot_policies.get(name)
+    if policy == None:
+        raise ValueError(f"Slot policy {name} does not exist, use one of {list(slot_policies)}")
+    return policy
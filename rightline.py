@@ -28,6 +28,7 @@ from lib.vac_robot import VacRobot
 from lib.sort_line import SortLine
 from lib.warehouse import Warehouse
 from lib.mainline import MainLine, Status, MainState
+from lib.route_graph import RouteGraph, Route, Transition, with_option, ends_at
 from lib.setup import Setup
 
 class State(Enum):
@@ -62,13 +63,40 @@ class State(Enum):
     TEST = [1000, Status.FREE, "None"]
 
 
+# run function and next states of every state, the first allowed transition is used
+ROUTES = RouteGraph({
+    State.TEST: Route("test"),
+    MainState.INIT: Route("run_init", MainState.END),
+    State.GR1: Route("run_gr1", State.MPS),
+    State.MPS: Route("run_mps", State.CB1),
+    State.CB1: Route("run_cb1", Transition(State.GR2_CB1_TO_PM, with_option("with_PM")), State.GR2_CB1_TO_CB3),
+    State.GR2_CB1_TO_PM: Route("run_gr2", State.PM),
+    State.PM: Route("run_pm", State.GR2_PM_TO_CB3),
+    State.GR2_PM_TO_CB3: Route("run_gr2", State.CB3),
+    State.GR2_CB1_TO_CB3: Route("run_gr2", State.CB3),
+    State.CB3: Route("run_cb3", Transition(State.CB4_TO_WH, ends_at(State.WH_STORE)), State.CB4_TO_CB5),
+    State.CB4_TO_WH: Route("run_cb4", State.VG1_STORE),
+    State.VG1_STORE: Route("run_vg1", State.WH_STORE),
+    State.WH_STORE: Route("run_wh", MainState.END),
+    State.WH_RETRIEVE: Route("run_wh", State.VG1_RETRIEVE),
+    State.VG1_RETRIEVE: Route("run_vg1", State.CB4_TO_CB5),
+    State.CB4_TO_CB5: Route("run_cb4", State.CB5),
+    State.CB5: Route("run_cb5", State.GR3),
+    State.GR3: Route("run_gr3", State.SL),
+    State.SL: Route("run_sl", State.VG2),
+    State.VG2: Route("run_vg2", MainState.END)
+})
+
+
 class RightLine(MainLine):
     '''State loop and functions for right Factory.'''
     '''
     Methodes:
         run_...(): Calls the different modules.
-        mainloop(): Switches between machines.
+    Attributes:
+        routes (RouteGraph): Run function and next states of every state.
     '''
+    routes = ROUTES
 
     def __init__(self, revpi, config: dict):
         '''Initializes MiniFactory control loop.'''
@@ -79,93 +107,6 @@ class RightLine(MainLine):
 
         self.state = MainState.INIT
 
-    def mainloop(self):
-        '''Switches the line states.'''
-        # if line is waiting for the next machine
-        if self.waiting_for_state != None:
-            return
-
-        if self.state == State.TEST:
-            if self.test():
-                return
-            
-        if self.state == MainState.INIT:
-            if self.run_init():
-                self.switch_state(MainState.END, wait=False)
-
-        elif self.state == State.GR1:
-            if self.run_gr1():
-                self.switch_state(State.MPS)
-
-        elif self.state == State.MPS:
-            if self.run_mps():
-                self.switch_state(State.CB1)
-
-        elif self.state == State.CB1:
-            if self.run_cb1():
-                if self.config.get("with_PM"):
-                    self.switch_state(State.GR2_CB1_TO_PM)
-                else:
-                    self.switch_state(State.GR2_CB1_TO_CB3) 
-        
-        elif self.state == State.GR2_CB1_TO_PM:
-            if self.run_gr2():
-                self.switch_state(State.PM)
-
-        elif self.state == State.PM:
-            if self.run_pm():
-                self.switch_state(State.GR2_PM_TO_CB3)
-
-        elif self.state == State.GR2_PM_TO_CB3 or self.state == State.GR2_CB1_TO_CB3:
-            if self.run_gr2():
-                self.switch_state(State.CB3)
-
-        elif self.state == State.CB3:
-            if self.run_cb3():
-                if self.config["end_at"] == State.WH_STORE:
-                    self.switch_state(State.CB4_TO_WH)
-                else:
-                    self.switch_state(State.CB4_TO_CB5)
-
-        elif self.state == State.CB4_TO_WH:
-            if self.run_cb4():
-                self.switch_state(State.VG1_STORE)
-
-        elif self.state == State.VG1_STORE:
-            if self.run_vg1():
-                self.switch_state(State.WH_STORE)
-        
-        elif self.state == State.WH_STORE:
-            if self.run_wh():
-                self.switch_state(MainState.END)
-
-        elif self.state == State.WH_RETRIEVE:
-            if self.run_wh():
-                self.switch_state(State.VG1_RETRIEVE)
-
-        elif self.state == State.VG1_RETRIEVE:
-            if self.run_vg1():
-                self.switch_state(State.CB4_TO_CB5)
-        
-        elif self.state == State.CB4_TO_CB5:
-            if self.run_cb4():
-                self.switch_state(State.CB5)
-
-        elif self.state == State.CB5:
-            if self.run_cb5():
-                self.switch_state(State.GR3)
-
-        elif self.state == State.GR3:
-            if self.run_gr3():
-                self.switch_state(State.SL)
-
-        elif self.state == State.SL:
-            if self.run_sl():
-                self.switch_state(State.VG2)
-
-        elif self.state == State.VG2:
-            if self.run_vg2():
-                self.switch_state(MainState.END)
 
     ####################################################################################################
     # Methods that control the different states for the
@@ -200,7 +141,7 @@ class RightLine(MainLine):
             return True
         
         # init GR2
-        if self.state != self.config["end_at"] and (State.GR2_CB1_TO_CB3.value[1] == Status.FREE or State.GR2_CB1_TO_CB3.value[2] == self.name):
+        if self.state != self.config["end_at"] and self.state_is_free(State.GR2_CB1_TO_CB3):
             self.run_gr2()
 
 
@@ -263,11 +204,11 @@ class RightLine(MainLine):
         if cb.is_position(1):
             self.product_at = cb.name
             cb.run_to_stop_sensor("FWD", stop_sensor=f"{cb.name}_SENS_END", stop_delay_in_ms=200)
-        elif cb.is_position(2) and State.SL.value[1] == Status.FREE:
+        elif cb.is_position(2) and self.state_is_free(State.SL):
             cb.switch_state(MainState.END)
             return True
         # init gr3
-        if self.state != self.config["end_at"] and (State.GR3.value[1] == Status.FREE or State.GR3.value[2] == self.name):
+        if self.state != self.config["end_at"] and self.state_is_free(State.GR3):
             self.run_gr3()
 
 
@@ -275,7 +216,7 @@ class RightLine(MainLine):
         gr: GripRobot = self.get_machine("GR1", GripRobot, Position(-1, 0, 1400))
         if gr.is_position(0):
             gr.init()
-            if State.MPS.value[1] == Status.FREE:
+            if self.state_is_free(State.MPS):
                 self.run_mps()
 
         elif gr.is_position(1):
@@ -296,7 +237,7 @@ class RightLine(MainLine):
             gr.move_to_position(Position(900, 0, 1400), ignore_moving_pos=True)
         elif gr.is_position(5):
             gr.move_to_position(Position(535, 0, 1400))
-        elif gr.is_position(6) and (State.MPS.value[1] == Status.FREE or State.MPS.value[2] == self.name):
+        elif gr.is_position(6) and self.state_is_free(State.MPS):
             # move to tray
             gr.move_to_position(Position(-1, 82, -1))
         elif gr.is_position(7):
@@ -388,7 +329,7 @@ class RightLine(MainLine):
             self.product_at = gr.name
             # move to cb5
             gr.move_to_position(Position(1985, 62, 1800))
-        elif gr.is_position(4) and State.SL.value[1] == Status.FREE:
+        elif gr.is_position(4) and self.state_is_free(State.SL):
             # move down
             gr.move_to_position(Position(-1, -1, 2300))
         elif gr.is_position(5):
@@ -454,7 +395,7 @@ class RightLine(MainLine):
                 # move to cb4_start
                 vg.move_to_position(Position(0, 1375, 1100), ignore_moving_pos=True)
 
-            elif vg.is_position(4) and State.CB4_TO_CB5.value[1] == Status.FREE:
+            elif vg.is_position(4) and self.state_is_free(State.CB4_TO_CB5):
                 # move down
                 vg.move_to_position(Position(-1, -1, 1450))
             elif vg.is_position(5):
@@ -556,7 +497,7 @@ class RightLine(MainLine):
         elif mps.is_position(1):
             self.product_at = mps.name
             mps.run(with_oven=self.config.get("with_oven"), with_saw=self.config.get("with_saw"))
-        elif mps.is_position(2) and State.CB1.value[1] == Status.FREE:
+        elif mps.is_position(2) and self.state_is_free(State.CB1):
             if self.is_end_state():
                 mps.switch_state(MainState.END)
                 return True
@@ -0,0 +1,153 @@
+'''Tests for the offline queue of the MqttHandler with a fake mqtt client, run with "python -m unittest discover tests"'''
+
+__author__ = "Lukas Beck"
+__email__ = "st166506@stud.uni-stuttgart.de"
+__copyright__ = "Lukas Beck"
+
+__license__ = "GPL"
+__version__ = "2024.03.09"
+
+import json
+import time
+import unittest
+from unittest import mock
+
+import paho.mqtt.client as mqtt
+
+from lib.mqtt_handler import Configs, Status, MqttHandler
+
+TOPIC_START = "MiniFactory/Right/Factory"
+
+class FakeClient():
+    '''Client that never connects by itself, like a client whose broker is down, connect() calls on_connect.'''
+
+    def __init__(self, *_args, **_kwargs):
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.on_connect_fail = None
+        self.published: "list[tuple[str, str | bytes]]" = []
+        self.subscribed: "list[str]" = []
+
+    def message_callback_add(self, _topic, _callback):
+        pass
+
+    def reconnect_delay_set(self, _min_delay, _max_delay):
+        pass
+
+    def connect_async(self, _host, _port):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def subscribe(self, topic):
+        self.subscribed.append(topic)
+
+    def publish(self, topic, payload):
+        self.published.append((topic, payload))
+        return mqtt.MQTTMessageInfo(len(self.published))
+
+    def connect(self):
+        '''Simulates the broker accepting the connection.'''
+        self.on_connect(self, None, {}, mqtt.CONNACK_ACCEPTED)
+
+
+class TestOfflineQueue(unittest.TestCase):
+    '''Sends messages while the broker is down and checks what is published after the connection.'''
+
+    def setUp(self):
+        Configs.line_configs.clear()
+        Status.machine_status.clear()
+        Status.line_status.clear()
+        self.configs = Configs()
+        self.status = Status()
+        patcher = mock.patch.object(mqtt, "Client", FakeClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        start_time = time.time()
+        self.handler = MqttHandler("Right", self.configs, self.status)
+        self.init_time = time.time() - start_time
+        self.client: FakeClient = self.handler._MqttHandler__client
+
+
+    def get_published(self) -> "dict[str, list]":
+        '''Returns the decoded payloads of every Data topic in order of publishing.'''
+        published = {}
+        for topic, payload in self.client.published:
+            published.setdefault(topic.removeprefix(TOPIC_START + "/").removesuffix("/Data"), []).append(json.loads(payload))
+        return published
+
+
+    def test_init_with_broker_down(self):
+        self.assertLess(self.init_time, 1)
+        self.handler.send_data(MqttHandler.TOPIC_FACTORY_STATUS, {"status": "Program started"})
+        self.assertEqual(self.client.published, [])
+
+
+    def test_latest_payload_per_topic(self):
+        self.handler.send_data(MqttHandler.TOPIC_FACTORY_STATUS, {"line_started": {"name": "Line1", "at": "GR1"}})
+        self.handler.send_data(MqttHandler.TOPIC_FACTORY_STATUS, {"line_ended": {"name": "Line1", "at": "END"}})
+        self.client.connect()
+
+        self.assertEqual(self.get_published(), {MqttHandler.TOPIC_FACTORY_STATUS: [{"line_ended": {"name": "Line1", "at": "END"}}]})
+
+
+    def test_drops_oldest_topic(self):
+        self.handler.OFFLINE_QUEUE_SIZE = 3
+        topics = [MqttHandler.TOPIC_LINE_CONFIG, MqttHandler.TOPIC_FACTORY_CONFIG, MqttHandler.TOPIC_FACTORY_COMMANDS, MqttHandler.TOPIC_FACTORY_STATUS]
+        for topic in topics:
+            self.handler.send_data(topic, {"topic": topic})
+        self.client.connect()
+
+        self.assertEqual(list(self.get_published()), topics[1:])
+
+
+    def test_complete_status_after_connect(self):
+        self.status.machine_status.update({"CB1": ["RUNNING", "Line1"], "CB3": ["FREE", "None"]})
+        self.status.line_status.update({"Line1": {"self": {"state": "CB1", "product_at": "CB1"}}})
+        self.handler.send_data(MqttHandler.TOPIC_MACHINE_STATUS, {"CB1": ["RUNNING", "Line1"]})
+        self.handler.send_data(MqttHandler.TOPIC_LINE_STATUS, {"Line1": {"self": {"state": "CB1", "product_at": "CB1"}}})
+        self.handler.flush(force=True)
+        self.status.machine_status.update({"CB3": ["BLOCKED", "Line1"]})
+        self.handler.send_data(MqttHandler.TOPIC_MACHINE_STATUS, {"CB3": ["BLOCKED", "Line1"]})
+        self.handler.flush(force=True)
+        self.client.connect()
+
+        published = self.get_published()
+        self.assertEqual(len(published[MqttHandler.TOPIC_MACHINE_STATUS]), 1)
+        message = published[MqttHandler.TOPIC_MACHINE_STATUS][0]
+        self.assertEqual(set(message), {MqttHandler.SEQ_KEY, MqttHandler.DATA_KEY})
+        self.assertEqual(message[MqttHandler.DATA_KEY], {"CB1": ["RUNNING", "Line1"], "CB3": ["BLOCKED", "Line1"]})
+        line_status = published[MqttHandler.TOPIC_LINE_STATUS][0][MqttHandler.DATA_KEY]
+        self.assertEqual(line_status, {"Line1": {"self": {"state": "CB1", "product_at": "CB1"}}})
+
+
+    def test_sends_directly_when_connected(self):
+        self.client.connect()
+        self.handler.send_data(MqttHandler.TOPIC_FACTORY_STATUS, {"status": "Program started"})
+
+        self.assertEqual(self.get_published(), {MqttHandler.TOPIC_FACTORY_STATUS: [{"status": "Program started"}]})
+
+
+class TestBrokerDown(unittest.TestCase):
+    '''Starts the MqttHandler with the real client while no broker is reachable.'''
+
+    def test_init_returns(self):
+        start_time = time.time()
+        handler = MqttHandler("Right", Configs(), Status())
+        init_time = time.time() - start_time
+        handler.send_data(MqttHandler.TOPIC_FACTORY_STATUS, {"status": "Program started"})
+        handler.disconnect()
+        self.assertLess(init_time, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()